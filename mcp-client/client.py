@@ -1,15 +1,128 @@
 import asyncio
 import json
+import os
+import time
 from contextlib import AsyncExitStack
-from typing import Optional, Union, Mapping, Any, List
+from typing import Optional, Union, Mapping, Any, List, Dict
 
 from dotenv import load_dotenv
-from mcp import ClientSession, StdioServerParameters
+from mcp import ClientSession, StdioServerParameters, types
+from mcp.client.sse import sse_client
 from mcp.client.stdio import stdio_client
-from ollama import Client, ChatResponse, Message
+from mcp.shared.session import RequestResponder
+from ollama import AsyncClient, Message
 
 load_dotenv()
 
+MODEL = "llama3.2:3b"
+# Upper bound on model turns per query, so a model that keeps requesting tools still terminates.
+MAX_AGENT_STEPS = int(os.getenv("MCP_MAX_AGENT_STEPS", "5"))
+MAX_PARALLEL_TOOL_CALLS = int(os.getenv("MCP_MAX_PARALLEL_TOOL_CALLS", "4"))
+TOOL_CALL_TIMEOUT = float(os.getenv("MCP_TOOL_CALL_TIMEOUT", "60"))
+# How long Ollama keeps the model loaded after a request, so queries do not pay for reloading it.
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Tokens all tool results of one turn may take up in the conversation, shared between the calls.
+TOOL_RESULTS_TOKEN_BUDGET = int(os.getenv("MCP_TOOL_RESULTS_TOKEN_BUDGET", "3000"))
+# How oversized tool results are shrunk: "truncate" prunes columns and rows, "summarize" asks the model.
+TOOL_RESULT_STRATEGY = os.getenv("MCP_TOOL_RESULT_STRATEGY", "truncate")
+# Upper bound on the chunks summarized per result, so summarizing a huge listing still takes bounded time.
+MAX_SUMMARY_CHUNKS = int(os.getenv("MCP_MAX_SUMMARY_CHUNKS", "4"))
+# Rough characters per token for English text and tables, good enough for budgeting.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _is_table(lines: List[str]) -> bool:
+    """Whether lines look like the servers' tab-separated tables: a header and rows with as many columns."""
+    if len(lines) < 2 or "\t" not in lines[0]:
+        return False
+    width = lines[0].count("\t")
+    rows = [line for line in lines[1:] if not line.startswith("... ")]
+    return sum(line.count("\t") == width for line in rows) >= 0.9 * len(rows)
+
+
+def _prune_columns(lines: List[str], budget: int) -> List[str]:
+    """
+    Drop the widest columns, never the first two (the identifying ones), when that
+    makes every row fit. Otherwise all columns are kept and rows are cut instead.
+    """
+    header = lines[0].split("\t")
+    rows = [None if line.startswith("... ") else line.split("\t") for line in lines[1:]]
+    width = [sum(len(row[i]) + 1 for row in rows if row is not None and i < len(row)) for i in range(len(header))]
+
+    keep = list(range(len(header)))
+    size = len("\n".join(lines))
+    while len(keep) > 2 and size // CHARS_PER_TOKEN + 1 > budget:
+        widest = max(keep[2:], key=lambda i: width[i])
+        keep.remove(widest)
+        size -= width[widest]
+    if size // CHARS_PER_TOKEN + 1 > budget or len(keep) == len(header):
+        return lines
+
+    pruned = ["\t".join(header[i] for i in keep)]
+    for line, row in zip(lines[1:], rows):
+        pruned.append(line if row is None else "\t".join(row[i] for i in keep if i < len(row)))
+    dropped = ", ".join(header[i] for i in range(len(header)) if i not in keep)
+    pruned.append(f"... columns {dropped} omitted to fit the context budget.")
+    return pruned
+
+
+def truncate_tool_result(text: str, budget: int) -> str:
+    """
+    Shrink a tool result to roughly budget tokens. Tables first lose their widest
+    columns, then rows are cut from the end; a note tells the model what was left out.
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+
+    lines = text.splitlines()
+    header: List[str] = []
+    if _is_table(lines):
+        lines = _prune_columns(lines, budget)
+        header = lines[:1]
+        lines = lines[1:]
+        if estimate_tokens("\n".join(header + lines)) <= budget:
+            return "\n".join(header + lines)
+
+    # Reserve room for the note, then keep whole lines while they fit.
+    kept: List[str] = list(header)
+    used = estimate_tokens("\n".join(kept)) + 20
+    for line in lines:
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    if len(kept) == len(header) and lines:
+        kept.append(lines[0][:max(0, budget - used) * CHARS_PER_TOKEN])
+        kept.append("... output cut to fit the context budget, ask a narrower question for the rest.")
+        return "\n".join(kept)
+    omitted = len(header) + len(lines) - len(kept)
+    kept.append(f"... {omitted} more lines omitted to fit the context budget, ask a narrower question for the rest.")
+    return "\n".join(kept)
+
+
+def split_into_chunks(text: str, chunk_tokens: int) -> List[str]:
+    """Split text at line boundaries into chunks of about chunk_tokens, repeating a table header in each."""
+    lines = text.splitlines()
+    header = lines[:1] if _is_table(lines) else []
+    chunks: List[str] = []
+    current: List[str] = []
+    used = 0
+    for line in lines[len(header):]:
+        cost = estimate_tokens(line)
+        if current and used + cost > chunk_tokens:
+            chunks.append("\n".join(header + current))
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    if current:
+        chunks.append("\n".join(header + current))
+    return chunks
+
 
 class MCPClient:
     def __init__(self):
@@ -17,117 +130,244 @@ class MCPClient:
         self.stdio = None
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
-        self.ollama_client = Client("http://localhost:11434")
+        self.ollama_client = AsyncClient("http://localhost:11434")
+        self.last_time_to_first_token: Optional[float] = None
+        self.tools: Optional[List[types.Tool]] = None
+        self._available_functions: Optional[List[Dict[str, Any]]] = None
 
     async def connect_to_server(self, server_script_path: str):
         """Connect to an MCP server
 
         Args:
-            server_script_path: Path to the server script (.py or .js)
+            server_script_path: Path to the server script (.py or .js), or the URL of an SSE server
         """
-        is_python = server_script_path.endswith('.py')
-        is_js = server_script_path.endswith('.js')
-        if not (is_python or is_js):
-            raise ValueError("Server script must be a .py or .js file")
-
-        command = "python" if is_python else "node"
-        server_params = StdioServerParameters(
-            command=command,
-            args=[server_script_path],
-            env=None
+        if server_script_path.startswith(("http://", "https://")):
+            # A shared server started with `main.py --transport sse`, e.g. http://localhost:8000/sse
+            transport = await self.exit_stack.enter_async_context(sse_client(server_script_path))
+        else:
+            is_python = server_script_path.endswith('.py')
+            is_js = server_script_path.endswith('.js')
+            if not (is_python or is_js):
+                raise ValueError("Server script must be a .py or .js file, or the URL of an SSE server")
+
+            command = "python" if is_python else "node"
+            server_params = StdioServerParameters(
+                command=command,
+                args=[server_script_path],
+                env=None
+            )
+            transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
+        self.stdio, self.write = transport
+        self.session = await self.exit_stack.enter_async_context(
+            ClientSession(self.stdio, self.write, message_handler=self._handle_server_message)
         )
 
-        stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
-        self.stdio, self.write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
-
         await self.session.initialize()
 
-        response = await self.session.list_tools()
-        tools = response.tools
+        tools = await self.list_tools()
         print("\nConnected to server with tools:", [tool.name for tool in tools])
 
-    async def process_query(self, query: str) -> str:
-        """Process a query using the LLM and available MCP tools."""
-        messages: List[Union[Mapping[str, Any], Message]] = [
-            {"role": "user", "content": query}
-        ]
+    async def _handle_server_message(
+            self,
+            message: Union[RequestResponder[types.ServerRequest, types.ClientResult], types.ServerNotification, Exception]
+    ) -> None:
+        """Drop the cached tool catalog when the server announces that its tools changed."""
+        if isinstance(message, types.ServerNotification) and isinstance(message.root, types.ToolListChangedNotification):
+            self.tools = None
+            self._available_functions = None
+
+    async def list_tools(self) -> List[types.Tool]:
+        """Return the server's tools, fetching them only when the cached catalog is missing or stale."""
+        if self.tools is None:
+            response = await self.session.list_tools()
+            self.tools = response.tools
+            self._available_functions = None
+        return self.tools
+
+    async def get_available_functions(self) -> List[Dict[str, Any]]:
+        """Return the cached tool catalog converted to the Ollama 'functions' spec."""
+        tools = await self.list_tools()
+        if self._available_functions is None:
+            self._available_functions = [
+                {
+                    "name": tool.name,
+                    "description": tool.description,
+                    "parameters": tool.inputSchema
+                }
+                for tool in tools
+            ]
+        return self._available_functions
+
+    async def warm_up(self):
+        """Load the model into Ollama ahead of the first query."""
+        try:
+            await self.ollama_client.chat(model=MODEL, messages=[], keep_alive=KEEP_ALIVE)
+        except Exception as e:
+            print(f"\nCould not preload {MODEL}: {e}")
+
+    async def _chat(self, messages: List[Union[Mapping[str, Any], Message]], tools: Optional[List[Dict[str, Any]]] = None) -> Message:
+        """
+        Run one streamed chat turn, printing content tokens as they arrive, and
+        return the assembled assistant message.
+        """
+        started = time.perf_counter()
+        first_token_at: Optional[float] = None
+        content: List[str] = []
+        tool_calls: List[Message.ToolCall] = []
 
-        # 1) Fetch available tools from the MCP server and build OpenAI 'functions' spec
-        response = await self.session.list_tools()
-        available_functions = []
-        for tool in response.tools:
-            available_functions.append({
-                "name": tool.name,
-                "description": tool.description,
-                "parameters": tool.inputSchema
-            })
-
-        response: ChatResponse = self.ollama_client.chat(
-            model="llama3.2:3b",
+        stream = await self.ollama_client.chat(
+            model=MODEL,
             messages=messages,
-            tools=available_functions
+            tools=tools,
+            stream=True,
+            keep_alive=KEEP_ALIVE
         )
-
-        msg: Message = response.message
-
-        # 2) If the model returned plain text, just return it
-        if msg.content:
-            return msg.content
-
-        # 3) Otherwise it requested a function call
-        if msg.tool_calls.count == 0:
-            return ""
-
-        tool_call = msg.tool_calls[0]
-        fn_name = tool_call.function.name
-        raw_args = tool_call.function.arguments
-
+        async for chunk in stream:
+            if chunk.message.content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    print("\n", end="")
+                print(chunk.message.content, end="", flush=True)
+                content.append(chunk.message.content)
+            if chunk.message.tool_calls:
+                tool_calls.extend(chunk.message.tool_calls)
+
+        if first_token_at is not None:
+            self.last_time_to_first_token = first_token_at - started
+            print(f"\n(first token after {self.last_time_to_first_token:.2f}s, "
+                  f"done after {time.perf_counter() - started:.2f}s)")
+
+        return Message(role="assistant", content="".join(content), tool_calls=tool_calls or None)
+
+    @staticmethod
+    def _parse_arguments(raw_args: Any) -> Dict[str, Any]:
         if isinstance(raw_args, str):
             try:
-                fn_args = json.loads(raw_args)
+                return json.loads(raw_args)
             except json.JSONDecodeError:
                 raise RuntimeError(f"Could not parse function_call.arguments: {raw_args!r}")
-        elif isinstance(raw_args, dict):
-            fn_args = raw_args
+        elif isinstance(raw_args, Mapping):
+            return dict(raw_args)
         else:
             raise RuntimeError(f"Unexpected type for function_call.arguments: {type(raw_args)}")
 
-        print(f"\nCalling function: {fn_name} with args: {fn_args}")
-        tool_result = await self.session.call_tool(fn_name, fn_args)
+    async def _call_tool(self, tool_call: Message.ToolCall, limit: asyncio.Semaphore) -> str:
+        """Run one tool call and return its text output. Failures are reported to the model, not raised."""
+        fn_name = tool_call.function.name
+        try:
+            fn_args = self._parse_arguments(tool_call.function.arguments)
+        except RuntimeError as e:
+            return str(e)
+
+        async with limit:
+            print(f"\nCalling function: {fn_name} with args: {fn_args}")
+            try:
+                tool_result = await asyncio.wait_for(self.session.call_tool(fn_name, fn_args), TOOL_CALL_TIMEOUT)
+            except asyncio.TimeoutError:
+                return f"Tool {fn_name} timed out after {TOOL_CALL_TIMEOUT:g} seconds."
+            except Exception as e:
+                return f"Tool {fn_name} failed: {e}"
 
-        print("Function result:", tool_result.content)
-        # 4) Inject the function call and its result back into the conversation
+        print(f"Function {fn_name} result:", tool_result.content)
         if isinstance(tool_result.content, list):
-            func_output = "\n\n".join(tc.text for tc in tool_result.content)
-        else:
-            # fallback: if it's already a str
-            func_output = str(tool_result.content)
-        messages.append({
-            "role": "assistant",
-            "function_call": {
-                "name": fn_name,
-                "arguments": json.dumps(fn_args)
-            }
-        })
-
-        # 5) Inject the function’s response as a proper function-message:
-        messages.append({
-            "role": "function",
-            "name": fn_name,
-            "content": func_output  # THIS is a plain string
-        })
-
-        final_resp: ChatResponse = self.ollama_client.chat(
-            model="llama3.2:3b",
-            messages=messages,
-        )
+            return "\n\n".join(tc.text for tc in tool_result.content if hasattr(tc, "text"))
+        # fallback: if it's already a str
+        return str(tool_result.content)
+
+    async def _summarize(self, query: str, text: str, budget: int) -> str:
+        """
+        Map-reduce summary of a tool result: each chunk is summarized with the user's
+        question in mind, then the partial summaries are combined. At most
+        MAX_SUMMARY_CHUNKS chunks are read, the rest is reported as omitted.
+        """
+        chunks = split_into_chunks(text, budget)
+        omitted = chunks[MAX_SUMMARY_CHUNKS:]
+        chunks = chunks[:MAX_SUMMARY_CHUNKS]
+
+        async def summarize(content: str) -> str:
+            response = await self.ollama_client.chat(
+                model=MODEL,
+                messages=[{
+                    "role": "user",
+                    "content": f"Summarize this tool output in at most {budget // 2} words, keeping the facts "
+                               f"needed to answer: {query}\n\n{content}",
+                }],
+                keep_alive=KEEP_ALIVE
+            )
+            return response.message.content or ""
+
+        summaries = [await summarize(chunk) for chunk in chunks]
+        summary = "\n".join(summaries)
+        if len(summaries) > 1 and estimate_tokens(summary) > budget:
+            summary = await summarize(summary)
+        if omitted:
+            summary += f"\n... {len(omitted)} more parts of the output were not read, ask a narrower question for them."
+        return truncate_tool_result(summary, budget)
+
+    async def fit_tool_results(self, query: str, outputs: List[str]) -> List[str]:
+        """Keep the tool results of one turn within TOOL_RESULTS_TOKEN_BUDGET, however large the inventory."""
+        budget = max(1, TOOL_RESULTS_TOKEN_BUDGET // max(1, len(outputs)))
+        fitted = []
+        for output in outputs:
+            if estimate_tokens(output) <= budget:
+                fitted.append(output)
+                continue
+            print(f"\nShrinking a tool result of ~{estimate_tokens(output)} tokens to ~{budget} ({TOOL_RESULT_STRATEGY})")
+            if TOOL_RESULT_STRATEGY == "summarize":
+                try:
+                    fitted.append(await self._summarize(query, output, budget))
+                    continue
+                except Exception as e:
+                    print(f"\nCould not summarize the tool result, truncating it instead: {e}")
+            fitted.append(truncate_tool_result(output, budget))
+        return fitted
+
+    async def process_query(self, query: str) -> str:
+        """
+        Process a query using the LLM and available MCP tools.
+
+        Every tool call the model requests in a turn runs concurrently, and the
+        model is asked again until it answers without tools or MAX_AGENT_STEPS is hit.
+        Tool results are shrunk to the token budget before they are fed back.
+        Model output is streamed to the console while it is generated.
+        """
+        messages: List[Union[Mapping[str, Any], Message]] = [
+            {"role": "user", "content": query}
+        ]
+
+        # 1) Use the cached tool catalog as the OpenAI 'functions' spec
+        available_functions = await self.get_available_functions()
+        limit = asyncio.Semaphore(MAX_PARALLEL_TOOL_CALLS)
+        used_tools = False
+
+        for _ in range(MAX_AGENT_STEPS):
+            msg = await self._chat(messages, tools=available_functions)
+
+            # 2) If the model did not request any tool, it has answered
+            if not msg.tool_calls:
+                return f"Answer: {msg.content}" if used_tools else msg.content or ""
+
+            # 3) Otherwise run every requested tool call at once and feed the results back
+            used_tools = True
+            outputs = await asyncio.gather(*(self._call_tool(tool_call, limit) for tool_call in msg.tool_calls))
+            outputs = await self.fit_tool_results(query, outputs)
+            messages.append(msg)
+            for tool_call, output in zip(msg.tool_calls, outputs):
+                messages.append({
+                    "role": "tool",
+                    "name": tool_call.function.name,
+                    "content": output  # THIS is a plain string
+                })
+
+        # 4) Out of steps: ask for an answer from what has been gathered so far
+        final_msg = await self._chat(messages)
 
-        return f"Answer: {final_resp.message.content}"
+        return f"Answer: {final_msg.content}"
 
     async def chat_loop(self):
         """Run an interactive chat loop"""
         print("\nMCP Client Started!")
+        await self.warm_up()
         print("Type your queries or 'quit' to exit.")
 
         while True:
@@ -137,8 +377,8 @@ class MCPClient:
                 if query.lower() == 'quit':
                     break
 
-                response = await self.process_query(query)
-                print("\n" + response)
+                # The answer is streamed to the console by process_query.
+                await self.process_query(query)
 
             except Exception as e:
                 print(f"\nError: {str(e)}")
@@ -150,7 +390,7 @@ class MCPClient:
 
 async def main():
     if len(sys.argv) < 2:
-        print("Usage: python client.py <path_to_server_script>")
+        print("Usage: python client.py <path_to_server_script | http://host:port/sse>")
         sys.exit(1)
 
     client = MCPClient()
@@ -0,0 +1,311 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from mcp import types
+from ollama import ChatResponse, Message
+
+import client
+from client import (CHARS_PER_TOKEN, MCPClient, _prune_columns, estimate_tokens, split_into_chunks,
+                    truncate_tool_result)
+
+
+class FakeSession:
+    """
+    Answers call_tool after args['delay'] seconds and records how many calls were in flight
+    at once. Counts list_tools round-trips.
+    """
+
+    def __init__(self):
+        self.list_tools_calls = 0
+        self.calls = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def call_tool(self, name, args):
+        self.calls.append(name)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(args.get("delay", 0))
+        finally:
+            self.in_flight -= 1
+        return SimpleNamespace(content=[SimpleNamespace(text=f"{name} done")])
+
+    async def list_tools(self):
+        self.list_tools_calls += 1
+        tool = types.Tool(name=f"tool-v{self.list_tools_calls}", description="A tool.", inputSchema={"type": "object"})
+        return SimpleNamespace(tools=[tool])
+
+
+class FakeOllama:
+    """
+    Streams the scripted replies in order, one list of message chunks per chat turn. Once
+    the script runs out, every turn asks for the 'again' tool, or answers when no tools are offered.
+    """
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.turns = []
+        self.tools = []
+
+    async def chat(self, model, messages, tools=None, stream=False, keep_alive=None):
+        self.turns.append(list(messages))
+        self.tools.append(tools)
+        if self.replies:
+            chunks = self.replies.pop(0)
+        elif tools is not None:
+            chunks = [Message(role="assistant", content="", tool_calls=[tool_call("again")])]
+        else:
+            chunks = [Message(role="assistant", content="out of steps")]
+
+        async def stream_chunks():
+            for chunk in chunks:
+                yield ChatResponse(model=model, message=chunk)
+
+        return stream_chunks()
+
+
+def tool_call(name, **arguments):
+    return Message.ToolCall(function=Message.ToolCall.Function(name=name, arguments=arguments))
+
+
+def tool_results(messages):
+    return [m["content"] for m in messages if isinstance(m, dict) and m["role"] == "tool"]
+
+
+def fake_client(*replies):
+    mcp_client = MCPClient()
+    mcp_client.session = FakeSession()
+    mcp_client.ollama_client = FakeOllama(*replies)
+    return mcp_client
+
+
+def _vm_table(rows: int, description: str = "x" * 200) -> str:
+    lines = ["name\tstatus\tdescription"]
+    lines += [f"vm-{i}\trunning\t{description}" for i in range(rows)]
+    return "\n".join(lines)
+
+
+def test_truncate_tool_result_keeps_text_within_budget():
+    """
+    Test that a result within the budget is returned as is.
+    """
+    text = "vm-1 is running"
+    assert truncate_tool_result(text, 100) == text, "Expected a small result to be left untouched"
+
+
+def test_truncate_tool_result_cuts_whole_lines_and_counts_the_rest():
+    """
+    Test that plain text is cut at line boundaries to the budget, with a note counting the omitted lines.
+    """
+    lines = [f"line {i} " + "y" * 30 for i in range(100)]
+    result = truncate_tool_result("\n".join(lines), 100).splitlines()
+
+    kept = result[:-1]
+    assert kept == lines[:len(kept)], "Expected a prefix of whole lines to be kept"
+    assert result[-1].startswith(f"... {100 - len(kept)} more lines omitted"), f"Unexpected note {result[-1]!r}"
+    assert estimate_tokens("\n".join(result)) <= 100, "Expected the result to fit the budget"
+
+
+def test_truncate_tool_result_cuts_a_single_oversized_line():
+    """
+    Test that a single line over the budget is cut to it rather than dropped.
+    """
+    result = truncate_tool_result("z" * 1000, 50).splitlines()
+
+    assert result[0] and set(result[0]) == {"z"}, "Expected the start of the line to be kept"
+    assert len(result[0]) < 1000, "Expected the line to be cut"
+    assert result[1].startswith("... output cut to fit the context budget"), f"Unexpected note {result[1]!r}"
+
+
+def test_prune_columns_drops_the_widest_column():
+    """
+    Test that the widest column is dropped when that makes every row fit, and the note names it.
+    """
+    lines = _vm_table(10).splitlines()
+    pruned = _prune_columns(lines, 100)
+
+    assert pruned[0] == "name\tstatus", f"Expected the description column to be dropped, got {pruned[0]!r}"
+    assert pruned[1:11] == [f"vm-{i}\trunning" for i in range(10)], "Expected every row to be kept"
+    assert pruned[11] == "... columns description omitted to fit the context budget.", f"Unexpected note {pruned[11]!r}"
+
+
+def test_prune_columns_keeps_the_identifying_columns():
+    """
+    Test that the first two columns are never dropped: when rows do not fit even without the others, nothing is pruned.
+    """
+    lines = ["name\tid\tstatus"] + [f"vm-{i}\t{'i' * 100}\trunning" for i in range(50)]
+    assert _prune_columns(lines, 100) == lines, "Expected all columns to be kept when pruning cannot fit the rows"
+
+
+def test_truncate_tool_result_prunes_columns_before_rows():
+    """
+    Test that a table is first pruned of columns, and only loses rows when that is not enough.
+    """
+    result = truncate_tool_result(_vm_table(10), 100).splitlines()
+    assert len(result) == 12 and result[0] == "name\tstatus", "Expected all rows without the wide column"
+
+    result = truncate_tool_result(_vm_table(100, description="x" * 20), 100).splitlines()
+    assert result[0] == "name\tstatus\tdescription", "Expected the header to be kept when rows are cut"
+    assert result[-1].startswith("... ") and "more lines omitted" in result[-1], f"Unexpected note {result[-1]!r}"
+    assert estimate_tokens("\n".join(result)) <= 100, "Expected the result to fit the budget"
+
+
+def test_split_into_chunks_repeats_the_table_header():
+    """
+    Test that tables are split at row boundaries, each chunk starting with the header and no row lost or repeated.
+    """
+    text = _vm_table(20, description="x" * 40)
+    chunks = split_into_chunks(text, 50)
+
+    assert len(chunks) > 1, "Expected the table to be split"
+    rows = []
+    for chunk in chunks:
+        lines = chunk.splitlines()
+        assert lines[0] == "name\tstatus\tdescription", "Expected every chunk to start with the header"
+        assert estimate_tokens("\n".join(lines[1:])) <= 50 + len(lines), "Expected chunks of about chunk_tokens"
+        rows += lines[1:]
+    assert rows == text.splitlines()[1:], "Expected every row exactly once, in order"
+
+
+def test_split_into_chunks_gives_an_oversized_line_its_own_chunk():
+    """
+    Test that plain text gets no header, and a line over chunk_tokens forms a chunk of its own.
+    """
+    long_line = "w" * (20 * CHARS_PER_TOKEN)
+    chunks = split_into_chunks(f"first\n{long_line}\nlast", 10)
+
+    assert chunks == ["first", long_line, "last"], f"Unexpected chunks {[c[:10] for c in chunks]}"
+    assert split_into_chunks("", 10) == [], "Expected no chunks for an empty result"
+
+
+def test_process_query_runs_tool_calls_concurrently():
+    """
+    Test that every tool call of a turn runs at once, so the turn takes about as long as the slowest tool.
+    """
+    calls = [tool_call(f"tool-{i}", delay=0.1 * (i + 1)) for i in range(4)]
+    mcp_client = fake_client([Message(role="assistant", tool_calls=calls)], [Message(role="assistant", content="done")])
+
+    started = time.perf_counter()
+    answer = asyncio.run(mcp_client.process_query("status?"))
+    elapsed = time.perf_counter() - started
+
+    assert answer == "Answer: done", f"Unexpected answer {answer!r}"
+    assert sorted(mcp_client.session.calls) == [f"tool-{i}" for i in range(4)], "Expected every tool call to run"
+    assert elapsed < 0.6, f"Expected about the slowest tool's 0.4s, took {elapsed:.2f}s"
+    results = tool_results(mcp_client.ollama_client.turns[1])
+    assert results == [f"tool-{i} done" for i in range(4)], f"Expected the results in call order, got {results}"
+
+
+def test_process_query_caps_parallel_tool_calls(monkeypatch):
+    """
+    Test that no more than MAX_PARALLEL_TOOL_CALLS tool calls are in flight at once.
+    """
+    monkeypatch.setattr(client, "MAX_PARALLEL_TOOL_CALLS", 2)
+    calls = [tool_call(f"tool-{i}", delay=0.05) for i in range(6)]
+    mcp_client = fake_client([Message(role="assistant", tool_calls=calls)], [Message(role="assistant", content="done")])
+
+    asyncio.run(mcp_client.process_query("status?"))
+
+    assert len(mcp_client.session.calls) == 6, "Expected every tool call to run"
+    peak = mcp_client.session.peak_in_flight
+    assert peak == 2, f"Expected at most 2 calls in flight, saw {peak}"
+
+
+def test_process_query_reports_a_hung_tool(monkeypatch):
+    """
+    Test that a tool exceeding TOOL_CALL_TIMEOUT becomes a tool message instead of failing the query.
+    """
+    monkeypatch.setattr(client, "TOOL_CALL_TIMEOUT", 0.05)
+    calls = [tool_call("hung", delay=10), tool_call("quick")]
+    mcp_client = fake_client([Message(role="assistant", tool_calls=calls)], [Message(role="assistant", content="done")])
+
+    started = time.perf_counter()
+    answer = asyncio.run(mcp_client.process_query("status?"))
+
+    assert answer == "Answer: done", f"Unexpected answer {answer!r}"
+    assert time.perf_counter() - started < 1, "Expected the hung tool to be abandoned"
+    results = tool_results(mcp_client.ollama_client.turns[1])
+    assert results == ["Tool hung timed out after 0.05 seconds.", "quick done"], f"Unexpected results {results}"
+
+
+def test_process_query_stops_after_max_agent_steps(monkeypatch):
+    """
+    Test that a model which keeps asking for tools is stopped after MAX_AGENT_STEPS and asked for an answer.
+    """
+    monkeypatch.setattr(client, "MAX_AGENT_STEPS", 3)
+    mcp_client = fake_client()
+
+    answer = asyncio.run(mcp_client.process_query("status?"))
+
+    assert answer == "Answer: out of steps", f"Unexpected answer {answer!r}"
+    assert mcp_client.session.calls == ["again"] * 3, "Expected one tool call per allowed step"
+    assert len(mcp_client.ollama_client.turns) == 4, "Expected MAX_AGENT_STEPS turns and a final one without tools"
+
+
+def test_tool_catalog_is_cached_until_the_server_changes_it():
+    """
+    Test that queries reuse the tool catalog, and a ToolListChangedNotification makes the next query refetch it.
+    """
+    answer = [Message(role="assistant", content="done")]
+    mcp_client = fake_client(answer, answer, answer)
+
+    async def run():
+        await mcp_client.process_query("first")
+        await mcp_client.process_query("second")
+        assert mcp_client.session.list_tools_calls == 1, "Expected one list_tools round-trip for two queries"
+
+        changed = types.ToolListChangedNotification(method="notifications/tools/list_changed")
+        await mcp_client._handle_server_message(types.ServerNotification(changed))
+        await mcp_client.process_query("third")
+        assert mcp_client.session.list_tools_calls == 2, "Expected the catalog to be refetched after the change"
+
+    asyncio.run(run())
+    offered = [tool["name"] for tool in mcp_client.ollama_client.tools[-1]]
+    assert offered == ["tool-v2"], f"Expected the model to be offered the new catalog, got {offered}"
+
+
+def test_chat_assembles_the_streamed_message(capsys):
+    """
+    Test that streamed content deltas and a final tool-call chunk are assembled into one message, the text
+    is printed as it arrives and the time to the first token is measured.
+    """
+    calls = [tool_call("get_azure_virtual_machines", power_state="running")]
+    chunks = [Message(role="assistant", content=text) for text in ["Checking ", "your ", "VMs."]]
+    chunks.append(Message(role="assistant", content="", tool_calls=calls))
+
+    class SlowStart:
+        """Streams the chunks after a 0.05 s delay before the first one."""
+
+        async def chat(self, model, messages, tools=None, stream=False, keep_alive=None):
+            assert stream, "Expected a streamed chat"
+
+            async def stream_chunks():
+                await asyncio.sleep(0.05)
+                for chunk in chunks:
+                    yield ChatResponse(model=model, message=chunk)
+
+            return stream_chunks()
+
+    mcp_client = MCPClient()
+    mcp_client.ollama_client = SlowStart()
+    message = asyncio.run(mcp_client._chat([{"role": "user", "content": "Which VMs run?"}], tools=[]))
+
+    assert message.role == "assistant" and message.content == "Checking your VMs.", f"Unexpected {message!r}"
+    assert message.tool_calls == calls, f"Expected the streamed tool calls, got {message.tool_calls}"
+    assert "Checking your VMs." in capsys.readouterr().out, "Expected the text to be streamed to the console"
+    assert 0.05 <= mcp_client.last_time_to_first_token < 1, "Expected the time to the first token to be measured"
+
+
+if __name__ == "__main__":
+    test_truncate_tool_result_keeps_text_within_budget()
+    test_truncate_tool_result_cuts_whole_lines_and_counts_the_rest()
+    test_truncate_tool_result_cuts_a_single_oversized_line()
+    test_prune_columns_drops_the_widest_column()
+    test_prune_columns_keeps_the_identifying_columns()
+    test_truncate_tool_result_prunes_columns_before_rows()
+    test_split_into_chunks_repeats_the_table_header()
+    test_split_into_chunks_gives_an_oversized_line_its_own_chunk()
+    test_process_query_runs_tool_calls_concurrently()
+    test_tool_catalog_is_cached_until_the_server_changes_it()
@@ -0,0 +1,311 @@
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import ExitStack
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+from urllib.parse import urlsplit
+
+from common.disk_cache import DiskCache
+from common.metrics import count_upstream_request
+
+logger = logging.getLogger(__name__)
+
+
+def _route_key(path: str) -> str:
+    """Path plus the query parameters in sorted order, so clients may send them in any order."""
+    parts = urlsplit(path)
+    if not parts.query:
+        return parts.path
+    return f"{parts.path}?{'&'.join(sorted(parts.query.split('&')))}"
+
+
+class StubHTTPServer:
+    """
+    Threaded local HTTP server answering GET requests from pre-rendered JSON
+    bodies after an injected delay. Bodies are rendered up front, so neither
+    the time nor the memory of building them is charged to the tool under test.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = 0
+        self.routes: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, Nagle plus delayed ACKs would add 40 ms to each.
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                parts = urlsplit(self.path)
+                body = stub.routes.get(parts.path) or stub.routes.get(_route_key(self.path))
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug(format, *args)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, name="benchmark-stub", daemon=True).start()
+
+    def add_json(self, path: str, payload: Any) -> None:
+        """Serve payload at path, which may include a query string to answer paged listings."""
+        self.routes[_route_key(path)] = json.dumps(payload).encode()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# The batch forecast takes at most NWS_MAX_BATCH_LOCATIONS sites, so their number is capped
+# rather than scaled. They fall in a few gridpoints, as nearby sites do.
+MAX_SITES = 100
+_SITE_GRIDPOINTS = 4
+
+
+def site_locations(count: int) -> List[Tuple[float, float]]:
+    """count sites on a 0.1 degree grid around Denver, for the batch forecast."""
+    return [(round(39.0 + i // 10 * 0.1, 2), round(-105.0 + i % 10 * 0.1, 2)) for i in range(count)]
+
+
+def add_nws_routes(stub: StubHTTPServer, alert_count: int, site_count: int = 0, period_count: int = 14) -> None:
+    """NWS /points, gridpoint forecast and single and multi-area /alerts answers."""
+    forecast = {"properties": {"periods": [
+        {"name": f"Period {i}", "temperature": 60 + i % 20, "temperatureUnit": "F", "windSpeed": "10 mph",
+         "windDirection": "NW", "detailedForecast": "Partly cloudy, with a high near 65."}
+        for i in range(period_count)
+    ]}}
+    stub.add_json("/points/39.75,-105.0", {"properties": {"forecast": f"{stub.base_url}/gridpoints/BOU/62,60/forecast"}})
+    stub.add_json("/gridpoints/BOU/62,60/forecast", forecast)
+    for i, (latitude, longitude) in enumerate(site_locations(site_count)):
+        forecast_url = f"{stub.base_url}/gridpoints/BOU/{i % _SITE_GRIDPOINTS},60/forecast"
+        stub.add_json(f"/points/{latitude},{longitude}", {"properties": {"forecast": forecast_url}})
+    for x in range(_SITE_GRIDPOINTS):
+        stub.add_json(f"/gridpoints/BOU/{x},60/forecast", forecast)
+
+    alerts = {"features": [
+        {"properties": {"event": "Wind Advisory", "areaDesc": f"Zone {i}", "severity": "Moderate",
+                        "description": "West winds 25 to 35 mph with gusts up to 55 mph.",
+                        "instruction": "Use extra caution when driving."}}
+        for i in range(alert_count)
+    ]}
+    stub.add_json("/alerts/active/area/CA", alerts)
+    stub.add_json("/alerts/active?area=CA,NV,OR", alerts)
+
+
+def _raw_pod(i: int) -> Dict[str, Any]:
+    return {
+        "metadata": {"name": f"pod-{i}", "namespace": f"ns-{i % 20}", "labels": {"app": f"app-{i % 50}"}},
+        "spec": {"nodeName": f"node-{i % 100}"},
+        "status": {"podIP": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}", "phase": "Running"},
+    }
+
+
+def add_kubernetes_routes(stub: StubHTTPServer, pod_count: int, page_size: int) -> None:
+    """The /api/v1/pods listing in pages of page_size, linked by continue tokens."""
+    for start in range(0, max(pod_count, 1), page_size):
+        end = min(start + page_size, pod_count)
+        query = f"limit={page_size}" + (f"&continue={start}" if start else "")
+        stub.add_json(f"/api/v1/pods?{query}", {
+            "kind": "PodList",
+            "metadata": {"continue": str(end) if end < pod_count else None},
+            "items": [_raw_pod(i) for i in range(start, end)],
+        })
+
+
+class FakeProxmoxAPI:
+    """Answers /cluster/resources and /access/users for vm_count VMs and user_count users."""
+
+    def __init__(self, vm_count: int, latency: float, node_count: int = 16, user_count: int = 0):
+        self.latency = latency
+        self.resources = [
+            {"id": f"node/pve{i}", "type": "node", "node": f"pve{i}", "status": "online",
+             "cpu": 0.25, "maxcpu": 64, "mem": 2 ** 37, "maxmem": 2 ** 39, "uptime": 86400}
+            for i in range(node_count)
+        ]
+        self.resources.extend(
+            {"id": f"qemu/{100 + i}", "type": "qemu", "vmid": 100 + i, "name": f"vm-{i}", "tags": "web;prod",
+             "node": f"pve{i % node_count}", "status": "running" if i % 3 else "stopped",
+             "cpu": 0.05, "maxcpu": 4, "mem": 2 ** 31, "maxmem": 2 ** 33, "uptime": 3600}
+            for i in range(vm_count)
+        )
+        self.users = [
+            {"userid": f"user{i}@pve", "enable": 1, "email": f"user{i}@example.com", "comment": "benchmark"}
+            for i in range(user_count or vm_count)
+        ]
+
+    def list_resources(self, **kwargs: Any) -> List[Dict[str, Any]]:
+        time.sleep(self.latency)
+        return self.resources
+
+    def list_users(self, **kwargs: Any) -> List[Dict[str, Any]]:
+        time.sleep(self.latency)
+        return self.users
+
+
+class FakeResourceGraphClient:
+    """
+    Resource Graph answering any query with row_count rows in pages of at most
+    'top'. Requests are counted here as the pooled clients' request hook would.
+    """
+
+    def __init__(self, row_count: int, latency: float):
+        self.row_count = row_count
+        self.latency = latency
+
+    def resources(self, request: Any) -> SimpleNamespace:
+        count_upstream_request()
+        time.sleep(self.latency)
+        start = int(request.options.skip_token or 0)
+        end = min(start + request.options.top, self.row_count)
+        rows = [{"name": f"res-{i}", "resourceGroup": f"rg-{i % 40}", "location": "westeurope",
+                 "size": "Standard_B2s", "powerState": "running", "subscriptionId": f"sub-{i % 8}"}
+                for i in range(start, end)]
+        return SimpleNamespace(data=rows, count=len(rows), skip_token=str(end) if end < self.row_count else None)
+
+
+class FakeForecastOperations:
+    """Forecasts one month for any scope."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def usage(self, scope: str, parameters: Any, **kwargs: Any) -> SimpleNamespace:
+        count_upstream_request()
+        time.sleep(self.latency)
+        columns = [SimpleNamespace(name=name) for name in ["Cost", "UsageDate", "CostStatus", "Currency"]]
+        return SimpleNamespace(columns=columns, rows=[[10.0, 20250401, "Forecast", "EUR"]])
+
+
+def _paged(items: List[Any], page_size: int, latency: float) -> Iterator[Any]:
+    """Iterate like a google-api-core pager, paying the latency once per page."""
+    for start in range(0, len(items), page_size):
+        time.sleep(latency)
+        yield from items[start:start + page_size]
+
+
+class FakeBillingClient:
+    """Cloud Billing with account_count accounts sharing project_count projects."""
+
+    def __init__(self, account_count: int, project_count: int, latency: float):
+        self.latency = latency
+        self.accounts = [
+            SimpleNamespace(name=f"billingAccounts/{i:06d}-AAAAAA", display_name=f"Account {i}", open_=True)
+            for i in range(account_count)
+        ]
+        self.projects_per_account = math.ceil(project_count / account_count)
+
+    def list_billing_accounts(self, request: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Iterator[Any]:
+        return _paged(self.accounts, (request or {}).get("page_size") or 100, self.latency)
+
+    def list_project_billing_info(self, request: Dict[str, Any], **kwargs: Any) -> Iterator[Any]:
+        name = request["name"]
+        projects = [
+            SimpleNamespace(project_id=f"{name[-13:]}-p{i}", billing_enabled=True, billing_account_name=name)
+            for i in range(self.projects_per_account)
+        ]
+        return _paged(projects, request.get("page_size") or 100, self.latency)
+
+
+class FakeBudgetClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def list_budgets(self, parent: Optional[str] = None, request: Optional[Dict[str, Any]] = None,
+                     **kwargs: Any) -> Iterator[Any]:
+        amount = SimpleNamespace(budget_amount=SimpleNamespace(fixed_amount=SimpleNamespace(micro_amount=1_500_000_000)))
+        return _paged([SimpleNamespace(display_name="Monthly", amount_spec=amount)], 100, self.latency)
+
+
+class StandInBackends:
+    """
+    Every provider pointed at a local stand-in holding `size` objects, each
+    upstream request delayed by `latency` seconds.
+
+    NWS and Kubernetes go through their real HTTP clients to a stub server; the
+    Proxmox, Azure and GCP SDK clients are replaced by in-process fakes. Use as a
+    context manager, and call reset() before each measured call so it starts cold.
+    """
+
+    def __init__(self, size: int, latency: float, cache_dir: str):
+        self.size = size
+        self.latency = latency
+        self.cache_dir = cache_dir
+        self._stack = ExitStack()
+
+    def __enter__(self) -> "StandInBackends":
+        from google.oauth2 import service_account
+        from kubernetes import client
+
+        import tools.azure
+        import tools.gcp
+        import tools.kubernetes
+        import tools.proxmox
+        import tools.weather
+
+        patch = self._stack.enter_context
+        self.stub = StubHTTPServer(self.latency)
+        self._stack.callback(self.stub.close)
+        add_nws_routes(self.stub, self.size, min(self.size, MAX_SITES))
+        add_kubernetes_routes(self.stub, self.size, tools.kubernetes._LIST_PAGE_SIZE)
+        patch(mock.patch.object(tools.weather, "NWS_API_BASE", self.stub.base_url))
+
+        configuration = client.Configuration(host=self.stub.base_url)
+        patch(mock.patch.object(tools.kubernetes, "_core_api", client.CoreV1Api(client.ApiClient(configuration))))
+        # The informer answers from a watch cache, the benchmark measures the paged listing.
+        patch(mock.patch.object(tools.kubernetes, "_INFORMER_ENABLED", False))
+
+        proxmox = FakeProxmoxAPI(self.size, self.latency)
+        patch(mock.patch.object(tools.proxmox, "get_proxmox_api", lambda: proxmox))
+
+        self.disk_cache = DiskCache(f"{self.cache_dir}/cache.sqlite3")
+        self._stack.callback(self.disk_cache.close)
+        graph = FakeResourceGraphClient(self.size, self.latency)
+        cost = SimpleNamespace(forecast=FakeForecastOperations(self.latency))
+        patch(mock.patch.object(tools.azure, "get_disk_cache", lambda: self.disk_cache))
+        patch(mock.patch.object(tools.azure, "get_azure_credentials", lambda: None))
+        patch(mock.patch.object(tools.azure, "get_resource_graph_client", lambda credential: graph))
+        patch(mock.patch.object(tools.azure, "get_cost_management_client", lambda credential: cost))
+
+        patch(mock.patch.dict("os.environ", {"GOOGLE_APPLICATION_CREDENTIALS": f"{self.cache_dir}/key.json"}))
+        patch(mock.patch.object(service_account.Credentials, "from_service_account_file",
+                                lambda keyfile, scopes: SimpleNamespace(scopes=scopes)))
+        patch(mock.patch.object(tools.gcp, "get_disk_cache", lambda: self.disk_cache))
+        # The fake context is dropped from the pool on exit, the fake clients need no closing.
+        patch(mock.patch.dict(tools.gcp._contexts))
+        self.gcp_context = tools.gcp.get_gcp_context()
+        self.gcp_context._billing_client = FakeBillingClient(min(self.size, 10), self.size, self.latency)
+        self.gcp_context._budget_client = FakeBudgetClient(self.latency)
+        return self
+
+    def reset(self) -> None:
+        """Drop every cache the tools keep, so the next call reaches the stand-ins."""
+        import tools.proxmox
+        import tools.weather
+
+        tools.weather._response_cache.clear()
+        tools.proxmox.invalidate_proxmox_inventory()
+        self.disk_cache.clear()
+        self.gcp_context._billing_info.clear()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stack.close()
@@ -0,0 +1,243 @@
+"""
+Offline benchmark of the MCP tools against local stand-in backends.
+
+Every tool is called through the real FastMCP dispatch (an in-memory client
+session) while the providers answer from stand-ins holding N objects, each
+upstream request delayed by --latency-ms. For each tool and scale it reports
+latency percentiles, upstream requests per call, the result size and the
+peak Python memory of one call. Caches are dropped before every call.
+
+    python -m benchmarks.run --scales 10,1000,50000
+    python -m benchmarks.run --output json > baseline.json
+    python -m benchmarks.run --compare baseline.json
+
+With --compare the run exits non-zero when a tool got slower than the
+baseline by more than --tolerance, makes more upstream requests, or needs
+more memory.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from mcp.shared.memory import create_connected_server_and_client_session
+
+# Importing the tool modules registers their tools.
+import tools.azure
+import tools.gcp
+import tools.kubernetes
+import tools.proxmox
+import tools.weather
+from benchmarks.fakes import MAX_SITES, StandInBackends, site_locations
+from common.metrics import tool_metrics
+from common.results import render_records
+from mcp_server import mcp
+
+DEFAULT_SCALES = (10, 1000, 50000)
+
+# Azure forecasts are requested per subscription, so that scale is capped at a realistic tenant size.
+_MAX_SUBSCRIPTIONS = 100
+
+
+@dataclass(frozen=True)
+class Scenario:
+    tool: str
+    arguments: Callable[[int], Dict[str, Any]]
+
+
+SCENARIOS = [
+    Scenario("get_alerts", lambda scale: {"state": "CA", "max_rows": scale}),
+    Scenario("get_forecast", lambda scale: {"latitude": 39.7456, "longitude": -104.9994}),
+    Scenario("get_alerts_for_states", lambda scale: {"states": ["OR", "CA", "NV"], "max_rows": scale}),
+    Scenario("get_forecasts", lambda scale: {"locations": site_locations(min(scale, MAX_SITES))}),
+    Scenario("get_pods_api", lambda scale: {"max_rows": scale}),
+    Scenario("get_proxmox_virtual_machines", lambda scale: {"max_rows": scale}),
+    Scenario("get_proxmox_nodes", lambda scale: {}),
+    Scenario("get_proxmox_users", lambda scale: {"max_rows": scale}),
+    Scenario("get_azure_virtual_machines", lambda scale: {"subscriptions": ["sub-0"], "max_rows": scale}),
+    Scenario("get_azure_resource_groups", lambda scale: {"subscriptions": ["sub-0"], "max_rows": scale}),
+    Scenario("get_azure_forecast",
+             lambda scale: {"subscriptions": [f"sub-{i}" for i in range(min(scale, _MAX_SUBSCRIPTIONS))]}),
+    Scenario("get_gcp_billing_scan", lambda scale: {"max_rows": scale}),
+]
+
+RESULT_COLUMNS = ["tool", "scale", "calls", "errors", "p50_ms", "p95_ms", "max_ms", "upstream", "result_kib",
+                  "peak_mib"]
+
+
+@dataclass
+class BenchmarkResult:
+    tool: str
+    scale: int
+    calls: int
+    errors: int
+    p50_ms: float
+    p95_ms: float
+    max_ms: float
+    upstream: float
+    result_kib: float
+    peak_mib: float
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of the values."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def _result_text(result: Any) -> str:
+    return "".join(getattr(content, "text", "") for content in result.content)
+
+
+async def _call(session: Any, backends: StandInBackends, scenario: Scenario, scale: int) -> tuple:
+    backends.reset()
+    started = time.perf_counter()
+    result = await session.call_tool(scenario.tool, scenario.arguments(scale))
+    return time.perf_counter() - started, result
+
+
+async def run_scenario(
+        session: Any,
+        backends: StandInBackends,
+        scenario: Scenario,
+        scale: int,
+        iterations: int
+) -> BenchmarkResult:
+    """Call one tool iterations times for the latency and upstream figures, then once more under tracemalloc."""
+    before = tool_metrics.snapshot().get(scenario.tool)
+    upstream_before = before.upstream_requests if before else 0
+
+    seconds: List[float] = []
+    errors = 0
+    size = 0
+    for _ in range(iterations):
+        elapsed, result = await _call(session, backends, scenario, scale)
+        seconds.append(elapsed)
+        errors += bool(result.isError)
+        size = len(_result_text(result).encode())
+
+    upstream = tool_metrics.snapshot()[scenario.tool].upstream_requests - upstream_before
+
+    # Tracing slows every allocation down, so memory is measured on a separate call.
+    tracemalloc.start()
+    try:
+        await _call(session, backends, scenario, scale)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return BenchmarkResult(
+        tool=scenario.tool,
+        scale=scale,
+        calls=iterations,
+        errors=errors,
+        p50_ms=percentile(seconds, 0.5) * 1000,
+        p95_ms=percentile(seconds, 0.95) * 1000,
+        max_ms=max(seconds) * 1000,
+        upstream=upstream / iterations,
+        result_kib=size / 1024,
+        peak_mib=peak / 2 ** 20,
+    )
+
+
+async def run_benchmarks(
+        scales: Sequence[int],
+        iterations: int,
+        latency: float,
+        tool_names: Optional[Sequence[str]] = None
+) -> List[BenchmarkResult]:
+    scenarios = [scenario for scenario in SCENARIOS if not tool_names or scenario.tool in tool_names]
+    results = []
+    try:
+        for scale in scales:
+            with tempfile.TemporaryDirectory() as cache_dir, StandInBackends(scale, latency, cache_dir) as backends:
+                async with create_connected_server_and_client_session(mcp._mcp_server) as session:
+                    for scenario in scenarios:
+                        results.append(await run_scenario(session, backends, scenario, scale, iterations))
+                # The NWS client is bound to this event loop and to the stub server of this scale.
+                await tools.weather.close_http_client()
+    finally:
+        await tools.weather.close_http_client()
+    return results
+
+
+def compare(
+        results: Sequence[BenchmarkResult],
+        baseline: Sequence[Dict[str, Any]],
+        tolerance: float,
+        min_delta_ms: float
+) -> List[str]:
+    """
+    Regressions against a baseline run: latency or memory above tolerance times
+    the baseline, more upstream requests, or new errors. Latency differences
+    under min_delta_ms are noise and ignored.
+    """
+    previous = {(entry["tool"], entry["scale"]): entry for entry in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get((result.tool, result.scale))
+        if base is None:
+            continue
+        label = f"{result.tool} at {result.scale}"
+        if result.p50_ms > base["p50_ms"] * tolerance and result.p50_ms - base["p50_ms"] > min_delta_ms:
+            regressions.append(f"{label}: p50 {result.p50_ms:.1f} ms, was {base['p50_ms']:.1f} ms")
+        if result.upstream > base["upstream"]:
+            regressions.append(f"{label}: {result.upstream:g} upstream requests, was {base['upstream']:g}")
+        if result.peak_mib > base["peak_mib"] * tolerance and result.peak_mib - base["peak_mib"] > 1:
+            regressions.append(f"{label}: peak {result.peak_mib:.1f} MiB, was {base['peak_mib']:.1f} MiB")
+        if result.errors > base["errors"]:
+            regressions.append(f"{label}: {result.errors} failed calls, was {base['errors']}")
+    return regressions
+
+
+def _parse_scales(value: str) -> List[int]:
+    return [int(scale) for scale in value.split(",") if scale.strip()]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the MCP tools against local stand-in backends.")
+    parser.add_argument("--scales", type=_parse_scales, default=list(DEFAULT_SCALES),
+                        help="Comma-separated object counts per backend (default: 10,1000,50000).")
+    parser.add_argument("--iterations", type=int, default=5, help="Measured calls per tool and scale.")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Delay of every upstream request.")
+    parser.add_argument("--tools", help="Comma-separated tools to run (default: all).")
+    parser.add_argument("--output", choices=["text", "json"], default="text")
+    parser.add_argument("--compare", help="Baseline written by --output json, exit 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="Allowed slowdown or memory growth factor against the baseline.")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0,
+                        help="Latency differences below this are not regressions.")
+    args = parser.parse_args(argv)
+    # The server and httpx log every request at INFO, which would drown the report.
+    for name in ("mcp.server.lowlevel.server", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    tool_names = [name.strip() for name in args.tools.split(",")] if args.tools else None
+    results = asyncio.run(run_benchmarks(args.scales, max(1, args.iterations), args.latency_ms / 1000, tool_names))
+
+    if args.output == "json":
+        print(json.dumps([asdict(result) for result in results], indent=2))
+    else:
+        print(render_records(results, RESULT_COLUMNS))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
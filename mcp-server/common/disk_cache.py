@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Set, TypeVar
+
+from common.resilience import serve_stale
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mcp-server")
+
+# How long past its TTL an entry may still be served while it is refreshed in the background.
+_DEFAULT_MAX_STALE = float(os.getenv("MCP_CACHE_MAX_STALE", "86400"))
+
+
+def cache_key(*parts: Any) -> str:
+    """Build a cache key from provider, scope and parameters, e.g. cache_key("azure", "forecast", scope)."""
+    return json.dumps(parts, sort_keys=True, default=str)
+
+
+@dataclass
+class DiskCacheEntry:
+    value: Any
+    fetched_at: float
+    expires_at: float
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+
+class DiskCache:
+    """
+    SQLite-backed cache for slow-changing upstream data such as cost forecasts
+    and budgets. Entries survive server restarts, which matters because the stdio
+    server is respawned for every client. Values must be JSON-serializable.
+
+    get_or_fetch serves fresh entries directly. Entries less than max_stale past
+    their TTL are served as well and refreshed in the background.
+    """
+
+    def __init__(self, path: str, max_stale: float = _DEFAULT_MAX_STALE):
+        self.path = path
+        self.max_stale = max_stale
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._refreshing: Set[str] = set()
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mcp-cache-refresh")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Several server processes may share the file, WAL lets them read while one writes.
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, fetched_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def get_entry(self, key: str) -> Optional[DiskCacheEntry]:
+        """Return the entry for key, fresh or stale."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value, fetched_at, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return DiskCacheEntry(json.loads(row[0]), row[1], row[2])
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, fetched_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now + ttl),
+            )
+            connection.commit()
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            connection.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM entries")
+            connection.commit()
+            self.hits = self.stale_hits = self.misses = 0
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], T], ttl: float, force_refresh: bool = False) -> T:
+        """
+        Return the cached value for key, calling fetch on a miss, when the entry is
+        too stale, or when force_refresh is set. Exceptions from fetch are not cached.
+        If fetch fails and there is an entry, it is served however old it is,
+        unless MCP_SERVE_STALE is off.
+        """
+        entry = None if force_refresh else self.get_entry(key)
+        if entry is not None:
+            if entry.fresh:
+                with self._lock:
+                    self.hits += 1
+                return entry.value
+            if time.time() < entry.expires_at + self.max_stale:
+                with self._lock:
+                    self.stale_hits += 1
+                self._refresh_in_background(key, fetch, ttl)
+                return entry.value
+
+        with self._lock:
+            self.misses += 1
+        try:
+            value = fetch()
+        except Exception as e:
+            if entry is None or not serve_stale():
+                raise
+            logger.warning("Fetching %s failed, serving the entry from %.0f s ago: %s",
+                           key, time.time() - entry.fetched_at, e)
+            return entry.value
+        self.set(key, value, ttl)
+        return value
+
+    def _refresh_in_background(self, key: str, fetch: Callable[[], Any], ttl: float) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh() -> None:
+            try:
+                self.set(key, fetch(), ttl)
+            except Exception:
+                logger.warning("Background refresh of %s failed", key, exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._refresher.submit(refresh)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {
+            "path": self.path,
+            "size": size,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        """Close the database connection, it is reopened on next use."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+_disk_cache: Optional[DiskCache] = None
+_disk_cache_lock = threading.Lock()
+
+
+def get_disk_cache() -> DiskCache:
+    """The shared cache file in MCP_CACHE_DIR (default ~/.cache/mcp-server)."""
+    global _disk_cache
+    with _disk_cache_lock:
+        if _disk_cache is None:
+            directory = os.getenv("MCP_CACHE_DIR") or _DEFAULT_DIR
+            _disk_cache = DiskCache(os.path.join(directory, "cache.sqlite3"))
+        return _disk_cache
+
+
+def close_disk_cache() -> None:
+    with _disk_cache_lock:
+        if _disk_cache is not None:
+            _disk_cache.close()
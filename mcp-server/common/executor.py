@@ -0,0 +1,77 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+_DEFAULT_PROVIDER_CONCURRENCY = 4
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MCP_WORKER_THREADS", "16")),
+    thread_name_prefix="mcp-tool",
+)
+_provider_limits: Dict[str, asyncio.Semaphore] = {}
+_limits_lock = threading.Lock()
+
+
+def provider_concurrency(provider: str) -> int:
+    """Maximum concurrent blocking calls for a provider, from MCP_<PROVIDER>_CONCURRENCY."""
+    return int(os.getenv(f"MCP_{provider.upper()}_CONCURRENCY", str(_DEFAULT_PROVIDER_CONCURRENCY)))
+
+
+def _provider_limit(provider: str) -> asyncio.Semaphore:
+    with _limits_lock:
+        limit = _provider_limits.get(provider)
+        if limit is None:
+            limit = asyncio.Semaphore(provider_concurrency(provider))
+            _provider_limits[provider] = limit
+        return limit
+
+
+async def run_blocking(provider: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a blocking call on the shared worker pool so it does not stall the event loop.
+    At most MCP_<PROVIDER>_CONCURRENCY calls per provider run at once. The slot is
+    freed when the worker thread finishes, not when a deadline cancels the caller.
+    """
+    limit = _provider_limit(provider)
+    await limit.acquire()
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    try:
+        future = _executor.submit(context.run, fn, *args, **kwargs)
+    except BaseException:
+        limit.release()
+        raise
+    future.add_done_callback(lambda _: _release(loop, limit))
+    return await asyncio.wrap_future(future, loop=loop)
+
+
+def _release(loop: asyncio.AbstractEventLoop, limit: asyncio.Semaphore) -> None:
+    try:
+        loop.call_soon_threadsafe(limit.release)
+    except RuntimeError:
+        # The loop is closed, nobody is left waiting on the semaphore.
+        limit.release()
+
+
+def to_async(fn: Callable[..., T], provider: str) -> Callable[..., Awaitable[T]]:
+    """Wrap a blocking function into a coroutine function that runs it via run_blocking."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        return await run_blocking(provider, fn, *args, **kwargs)
+
+    return wrapper
+
+
+def submit_in_context(executor: Executor, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+    """
+    Submit fn to an executor with a copy of the caller's context, so fan-out
+    threads inside a tool still count towards that tool call's metrics.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
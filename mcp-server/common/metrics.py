@@ -0,0 +1,194 @@
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Latency histogram bucket upper bounds in seconds, as in the Prometheus client defaults plus 30 s and 60 s.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+# Calls slower than this are logged, so slow providers show up without querying server_stats.
+_SLOW_CALL_SECONDS = float(os.getenv("MCP_SLOW_TOOL_SECONDS", "5"))
+
+# Upstream requests made by the tool call in progress. The counter is a mutable cell, so
+# increments made in worker threads that run with a copy of the context are seen by the caller.
+_upstream_requests: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar(
+    "upstream_requests", default=None
+)
+_upstream_lock = threading.Lock()
+
+
+def count_upstream_request(count: int = 1) -> None:
+    """Record upstream API requests against the tool call in progress, if any."""
+    cell = _upstream_requests.get()
+    if cell is not None:
+        with _upstream_lock:
+            cell[0] += count
+
+
+@dataclass
+class ToolStats:
+    calls: int = 0
+    errors: Counter = field(default_factory=Counter)
+    buckets: List[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    upstream_requests: int = 0
+    result_bytes: int = 0
+    max_result_bytes: int = 0
+
+    def quantile(self, q: float) -> float:
+        """Latency quantile estimated from the histogram, as the upper bound of the bucket it falls in."""
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+
+class ToolMetrics:
+    """Thread-safe per-tool call statistics."""
+
+    def __init__(self):
+        self._stats: Dict[str, ToolStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, tool: str, seconds: float, upstream_requests: int, result_bytes: int,
+               error: Optional[str] = None) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(tool, ToolStats())
+            stats.calls += 1
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.upstream_requests += upstream_requests
+            stats.result_bytes += result_bytes
+            stats.max_result_bytes = max(stats.max_result_bytes, result_bytes)
+            if error:
+                stats.errors[error] += 1
+
+    def snapshot(self) -> Dict[str, ToolStats]:
+        with self._lock:
+            return {
+                tool: ToolStats(stats.calls, Counter(stats.errors), list(stats.buckets), stats.total_seconds,
+                                stats.max_seconds, stats.upstream_requests, stats.result_bytes,
+                                stats.max_result_bytes)
+                for tool, stats in self._stats.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+tool_metrics = ToolMetrics()
+
+
+def _result_size(result: Any) -> int:
+    if isinstance(result, str):
+        return len(result.encode())
+    if isinstance(result, bytes):
+        return len(result)
+    return len(str(result).encode())
+
+
+def instrument(fn: Callable[..., Awaitable[T]], name: str) -> Callable[..., Awaitable[T]]:
+    """Wrap a tool coroutine function to record its latency, upstream requests, result size and errors."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        cell = [0]
+        token = _upstream_requests.set(cell)
+        started = time.perf_counter()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            seconds = time.perf_counter() - started
+            tool_metrics.record(name, seconds, cell[0], 0, type(e).__name__)
+            logger.warning("Tool %s failed after %.0f ms: %s: %s", name, seconds * 1000, type(e).__name__, e)
+            raise
+        finally:
+            _upstream_requests.reset(token)
+
+        seconds = time.perf_counter() - started
+        tool_metrics.record(name, seconds, cell[0], _result_size(result))
+        if seconds >= _SLOW_CALL_SECONDS:
+            logger.info("Tool %s took %.0f ms and %d upstream requests", name, seconds * 1000, cell[0])
+        return result
+
+    return wrapper
+
+
+def render_prometheus(snapshot: Dict[str, ToolStats]) -> str:
+    """Render a metrics snapshot in the Prometheus text exposition format."""
+    lines = [
+        "# HELP mcp_tool_calls_total Tool calls.",
+        "# TYPE mcp_tool_calls_total counter",
+    ]
+    lines.extend(f'mcp_tool_calls_total{{tool="{tool}"}} {stats.calls}' for tool, stats in snapshot.items())
+    lines.extend(["# HELP mcp_tool_errors_total Failed tool calls by error class.",
+                  "# TYPE mcp_tool_errors_total counter"])
+    lines.extend(
+        f'mcp_tool_errors_total{{tool="{tool}",error="{error}"}} {count}'
+        for tool, stats in snapshot.items() for error, count in stats.errors.items()
+    )
+    lines.extend(["# HELP mcp_tool_duration_seconds Tool call latency.",
+                  "# TYPE mcp_tool_duration_seconds histogram"])
+    for tool, stats in snapshot.items():
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f'mcp_tool_duration_seconds_bucket{{tool="{tool}",le="{le}"}} {cumulative}')
+        lines.append(f'mcp_tool_duration_seconds_sum{{tool="{tool}"}} {stats.total_seconds:.6f}')
+        lines.append(f'mcp_tool_duration_seconds_count{{tool="{tool}"}} {stats.calls}')
+    lines.extend(["# HELP mcp_tool_upstream_requests_total Upstream API requests made by tool calls.",
+                  "# TYPE mcp_tool_upstream_requests_total counter"])
+    lines.extend(
+        f'mcp_tool_upstream_requests_total{{tool="{tool}"}} {stats.upstream_requests}'
+        for tool, stats in snapshot.items()
+    )
+    lines.extend(["# HELP mcp_tool_result_bytes_total Bytes returned by tool calls.",
+                  "# TYPE mcp_tool_result_bytes_total counter"])
+    lines.extend(
+        f'mcp_tool_result_bytes_total{{tool="{tool}"}} {stats.result_bytes}' for tool, stats in snapshot.items()
+    )
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> None:
+    """Serve the tool metrics in Prometheus text format on http://host:port/metrics from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus(tool_metrics.snapshot()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            # The default handler writes to stderr directly, route it through logging instead.
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="mcp-metrics", daemon=True).start()
+    logger.info("Serving tool metrics on http://%s:%d/metrics", host, port)
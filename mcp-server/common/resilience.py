@@ -0,0 +1,363 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple, Type, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Deadline of a read-only tool call, unless MCP_<PROVIDER>_TIMEOUT says otherwise.
+_TOOL_TIMEOUT = float(os.getenv("MCP_TOOL_TIMEOUT", "60"))
+# Upper bound for a single upstream request, lowered to what is left of the tool's deadline.
+_REQUEST_TIMEOUT = float(os.getenv("MCP_REQUEST_TIMEOUT", "30"))
+
+# Throttling and server-side failures, worth retrying. Other errors will not go away.
+TOO_MANY_REQUESTS = 429
+RETRYABLE_STATUS = frozenset({TOO_MANY_REQUESTS, 500, 502, 503, 504})
+
+_DEFAULT_MAX_RETRIES = 2
+_BACKOFF_BASE = float(os.getenv("MCP_RETRY_BACKOFF", "0.2"))
+_BACKOFF_CAP = 10.0
+
+# Each first attempt earns a fraction of a retry, so retries stay a bounded share of the
+# traffic and a failing backend is not hammered with retries on top of the normal load.
+_RETRY_BUDGET_RATIO = float(os.getenv("MCP_RETRY_BUDGET_RATIO", "0.2"))
+_RETRY_BUDGET_MAX = 10.0
+
+_BREAKER_FAILURES = 5
+_BREAKER_RESET_SECONDS = 30.0
+
+_SERVE_STALE = os.getenv("MCP_SERVE_STALE", "true").lower() in ("1", "true", "yes")
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+def provider_setting(name: str, setting: str, default: float) -> float:
+    """A setting of one provider or service from MCP_<NAME>_<SETTING>, e.g. MCP_PROXMOX_TIMEOUT."""
+    return float(os.getenv(f"MCP_{name.upper()}_{setting.upper()}", str(default)))
+
+
+def tool_timeout(provider: str) -> float:
+    """Deadline of a read-only tool call of the provider, from MCP_<PROVIDER>_TIMEOUT or MCP_TOOL_TIMEOUT."""
+    return provider_setting(provider, "timeout", _TOOL_TIMEOUT)
+
+
+def serve_stale() -> bool:
+    """Whether cached data past its TTL may be served when the backend fails (MCP_SERVE_STALE)."""
+    return _SERVE_STALE
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the deadline of the tool call in progress, None outside of a tool call."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def request_timeout(default: float = _REQUEST_TIMEOUT) -> float:
+    """Timeout for one upstream request: the default, capped by what is left of the tool's deadline."""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise TimeoutError("The tool call ran out of time")
+    return min(default, left)
+
+
+def with_deadline(fn: Callable[..., Awaitable[T]], name: str, seconds: float) -> Callable[..., Awaitable[T]]:
+    """
+    Wrap a tool coroutine function so it fails with TimeoutError after seconds.
+    The deadline is visible to request_timeout() and the retry helpers, in worker
+    threads as well, so upstream requests and retries never outlive the call.
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        token = _deadline.set(time.monotonic() + seconds)
+        try:
+            async with asyncio.timeout(seconds) as timeout:
+                return await fn(*args, **kwargs)
+        except TimeoutError:
+            if timeout.expired():
+                raise TimeoutError(f"{name} did not finish within {seconds:g} s") from None
+            raise
+        finally:
+            _deadline.reset(token)
+
+    return wrapper
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend that keeps failing."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a backend is down. After `failures` consecutive failures the
+    circuit opens and calls are rejected for reset_after seconds. Then a single
+    trial call is let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name: str, failures: int = _BREAKER_FAILURES, reset_after: float = _BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_after:
+                return "open"
+            return "half-open"
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError when the call must not reach the backend."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            wait = self._opened_at + self.reset_after - time.monotonic()
+            if wait > 0 or self._trial_running:
+                raise CircuitOpenError(
+                    f"{self.name} is failing, not calling it for another {max(wait, 0):.0f} s"
+                )
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Circuit of %s closed", self.name)
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._trial_running or self._consecutive_failures >= self.failures:
+                if self._opened_at is None:
+                    logger.warning("Circuit of %s opened after %d failures", self.name, self._consecutive_failures)
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def abandon(self) -> None:
+        """Give up on a call without an outcome, e.g. when it was cancelled, so a new trial can start."""
+        with self._lock:
+            self._trial_running = False
+
+
+class RetryBudget:
+    """Token bucket of retries: every first attempt adds ratio tokens, every retry takes one."""
+
+    def __init__(self, ratio: float = _RETRY_BUDGET_RATIO, maximum: float = _RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.maximum = maximum
+        self._tokens = maximum
+        self._lock = threading.Lock()
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._tokens = min(self.maximum, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_budgets: Dict[str, RetryBudget] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(service: str) -> CircuitBreaker:
+    """
+    The circuit breaker of one upstream service, e.g. azure_resource_graph, configured
+    by MCP_<SERVICE>_BREAKER_FAILURES / _BREAKER_RESET_SECONDS. Services of the same
+    cloud fail independently, so each has its own.
+    """
+    with _registry_lock:
+        breaker = _breakers.get(service)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                service,
+                int(provider_setting(service, "breaker_failures", _BREAKER_FAILURES)),
+                provider_setting(service, "breaker_reset_seconds", _BREAKER_RESET_SECONDS),
+            )
+            _breakers[service] = breaker
+        return breaker
+
+
+def breaker_states() -> Dict[str, str]:
+    """State of every service's circuit breaker: closed, open or half-open."""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.state for breaker in breakers}
+
+
+def _retry_budget(service: str) -> RetryBudget:
+    with _registry_lock:
+        budget = _budgets.get(service)
+        if budget is None:
+            budget = _budgets[service] = RetryBudget()
+        return budget
+
+
+def reset_resilience() -> None:
+    """Forget every breaker and retry budget, e.g. between tests."""
+    with _registry_lock:
+        _breakers.clear()
+        _budgets.clear()
+
+
+def retry_after_header(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, given in seconds or as an HTTP date."""
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class UpstreamErrors:
+    """
+    How a provider's SDK reports failures: status reads the HTTP status of an
+    error response (None for other errors), transport_errors returns the types
+    of timeouts and connection failures, and retry_after the delay an error asks
+    for, if any. The SDK types are imported inside these functions, so the SDK
+    is only loaded once the provider is used.
+    """
+
+    status: Callable[[Exception], Optional[int]]
+    transport_errors: Callable[[], Tuple[Type[BaseException], ...]]
+    retry_after: Optional[Callable[[Exception], Optional[float]]] = None
+
+    def is_throttled(self, error: Exception) -> bool:
+        """A 429: the service is up but rate limits the caller."""
+        return self.status(error) == TOO_MANY_REQUESTS
+
+    def is_transient(self, error: Exception) -> bool:
+        """Throttling, server errors, timeouts and connection failures, which a retry may get past."""
+        status = self.status(error)
+        if status is not None:
+            return status in RETRYABLE_STATUS
+        return isinstance(error, self.transport_errors())
+
+
+class _Attempts:
+    """The retry decisions shared by call_with_retries and acall_with_retries."""
+
+    def __init__(self, service: str, errors: UpstreamErrors, max_retries: Optional[int]):
+        self.service = service
+        self.breaker = get_breaker(service)
+        self.budget = _retry_budget(service)
+        self.errors = errors
+        self.max_retries = int(provider_setting(service, "max_retries", _DEFAULT_MAX_RETRIES)) \
+            if max_retries is None else max_retries
+        self.attempt = 0
+
+    def before(self) -> None:
+        self.breaker.before_call()
+        if self.attempt == 0:
+            self.budget.record_request()
+
+    def delay_after(self, error: Exception) -> Optional[float]:
+        """Record a failed attempt and return how long to wait before the next, or None to give up."""
+        if not self.errors.is_transient(error):
+            # The backend answered, the request itself was wrong.
+            self.breaker.record_success()
+            return None
+        if self.errors.is_throttled(error):
+            # Throttling is the service working as intended, and fanned-out calls hit it
+            # together. Counting it would open the circuit for every caller of the service.
+            self.breaker.abandon()
+        else:
+            self.breaker.record_failure()
+
+        delay = self.errors.retry_after(error) if self.errors.retry_after else None
+        if delay is None:
+            # Full jitter, so callers failing together do not retry together.
+            delay = random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** self.attempt))
+        left = remaining()
+        if self.attempt >= self.max_retries or (left is not None and delay >= left) or not self.budget.try_spend():
+            return None
+        self.attempt += 1
+        logger.info("Retrying %s in %.2f s after %s: %s", self.service, delay, type(error).__name__, error)
+        return delay
+
+
+def call_with_retries(
+        service: str,
+        fn: Callable[[], T],
+        errors: UpstreamErrors,
+        max_retries: Optional[int] = None
+) -> T:
+    """
+    Call fn through the service's circuit breaker, retrying transient failures
+    with jittered exponential backoff, or after the delay errors.retry_after reads
+    from the error (e.g. a Retry-After header). Retries stop at max_retries
+    (MCP_<SERVICE>_MAX_RETRIES, default 2), when the retry budget is spent, or
+    when the wait would pass the tool's deadline.
+    """
+    attempts = _Attempts(service, errors, max_retries)
+    while True:
+        attempts.before()
+        try:
+            result = fn()
+        except Exception as e:
+            delay = attempts.delay_after(e)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        except BaseException:
+            attempts.breaker.abandon()
+            raise
+        attempts.breaker.record_success()
+        return result
+
+
+async def acall_with_retries(
+        service: str,
+        fn: Callable[[], Awaitable[T]],
+        errors: UpstreamErrors,
+        max_retries: Optional[int] = None
+) -> T:
+    """call_with_retries for coroutine functions."""
+    attempts = _Attempts(service, errors, max_retries)
+    while True:
+        attempts.before()
+        try:
+            result = await fn()
+        except Exception as e:
+            delay = attempts.delay_after(e)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            attempts.breaker.abandon()
+            raise
+        attempts.breaker.record_success()
+        return result
@@ -0,0 +1,72 @@
+import json
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Literal, Optional, Sequence
+
+OutputFormat = Literal["text", "jsonl"]
+
+
+def record_fields(record: Any, columns: Sequence[str]) -> Dict[str, Any]:
+    """The given columns of a record, which is a mapping, a dataclass or any object with attributes."""
+    if isinstance(record, dict):
+        return {column: record.get(column) for column in columns}
+    return {column: getattr(record, column, None) for column in columns}
+
+
+def select_columns(columns: Sequence[str], fields: Optional[Sequence[str]]) -> List[str]:
+    """
+    Narrow a tool's columns to the requested fields, keeping the requested order.
+    Raises ValueError naming the available columns when a field is unknown.
+    """
+    if not fields:
+        return list(columns)
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise ValueError(f"Unknown fields {', '.join(unknown)}, available fields: {', '.join(columns)}")
+    return list(dict.fromkeys(fields))
+
+
+def _text_cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(item) for item in value)
+    return str(value).replace("\t", " ").replace("\n", " ")
+
+
+def render_records(
+        records: Iterable[Any],
+        columns: Sequence[str],
+        fields: Optional[Sequence[str]] = None,
+        max_rows: Optional[int] = None,
+        output_format: OutputFormat = "text",
+        empty_message: str = "No results found.",
+        noun: str = "rows",
+) -> str:
+    """
+    Render records as a tab-separated table with a header row (output_format='text')
+    or as one JSON object per line ('jsonl'), keeping only the selected fields.
+
+    The iterable is consumed lazily and at most max_rows records are rendered, so
+    a paged upstream listing stops at the limit. Lines are collected and joined
+    once, which keeps rendering linear in the number of rows.
+    """
+    columns = select_columns(columns, fields)
+    if max_rows is not None:
+        max_rows = max(1, max_rows)
+    rows = list(records if max_rows is None else islice(records, max_rows + 1))
+    truncated = max_rows is not None and len(rows) > max_rows
+    if truncated:
+        rows = rows[:max_rows]
+    if not rows:
+        return empty_message
+
+    if output_format == "jsonl":
+        lines = [json.dumps(record_fields(row, columns), default=str) for row in rows]
+    else:
+        lines = ["\t".join(columns)]
+        lines.extend("\t".join(_text_cell(value) for value in record_fields(row, columns).values()) for row in rows)
+    if truncated:
+        lines.append(f"... truncated after {max_rows} {noun}, narrow the query or raise max_rows.")
+    return "\n".join(lines)
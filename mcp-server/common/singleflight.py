@@ -0,0 +1,77 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_COALESCE_ENABLED = os.getenv("MCP_COALESCE_CALLS", "true").lower() in ("1", "true", "yes")
+
+
+def call_key(name: str, args: tuple, kwargs: Dict[str, Any]) -> str:
+    """
+    Key of a tool call. FastMCP passes every parameter, defaults included, as a
+    keyword argument, so calls that differ only in omitted defaults share a key.
+    """
+    return json.dumps([name, args, kwargs], sort_keys=True, default=str)
+
+
+class SingleFlight:
+    """
+    Lets concurrent callers with the same key share one in-flight call. The
+    first caller starts the call as a task; callers arriving before it finishes
+    await the same task and get the same result or exception. Nothing is kept
+    once the call finishes, so later callers start a new one.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Future[Any]"] = {}
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            # The task copies the first caller's context, so its upstream requests are counted once, there.
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(functools.partial(self._forget, key))
+        else:
+            self.shared += 1
+            logger.debug("Sharing the in-flight call %s", key)
+        # Shielded, so a caller that gives up does not cancel the call for the others.
+        return await asyncio.shield(call)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _forget(self, key: str, call: "asyncio.Future[Any]") -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.cancelled():
+            # Marks the exception as retrieved when every caller has gone away.
+            call.exception()
+
+
+_single_flight = SingleFlight()
+
+
+def coalesce(fn: Callable[..., Awaitable[T]], name: str,
+             single_flight: Optional[SingleFlight] = None) -> Callable[..., Awaitable[T]]:
+    """
+    Wrap a read-only tool coroutine function so identical concurrent calls,
+    same tool and same arguments, make one upstream fetch. Disabled with
+    MCP_COALESCE_CALLS=false. Never wrap tools that change anything.
+    """
+    if not _COALESCE_ENABLED:
+        return fn
+    flight = single_flight or _single_flight
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        return await flight.do(call_key(name, args, kwargs), lambda: fn(*args, **kwargs))
+
+    return wrapper
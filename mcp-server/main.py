@@ -1,24 +1,85 @@
+import time
+
+_started = time.perf_counter()
+
 from dotenv import load_dotenv
 
 load_dotenv()
 
+import argparse
 import importlib
+import logging
+import os
 import pkgutil
+from typing import Optional, Set
 
 import tools
 
+from common.metrics import start_metrics_server
 from mcp_server import mcp
 
+logger = logging.getLogger(__name__)
+
+
+def _parse_providers(value: Optional[str]) -> Optional[Set[str]]:
+    """Parse a comma-separated provider allowlist such as "weather,azure". Empty means all providers."""
+    if not value:
+        return None
+    return {provider.strip().lower() for provider in value.split(",") if provider.strip()}
 
-def _load_tools():
+
+def _load_tools(providers: Optional[Set[str]] = None):
     """
     Walk the tools/ package directory and import every .py module.
     Any new file you drop into tools/ automatically gets picked up.
+
+    Tool modules only register their schemas at import time, the provider SDKs
+    are imported on the first call. Pass providers to load only those modules.
     """
+    available = {name for _, name, _ in pkgutil.iter_modules(tools.__path__)}
+    for name in sorted((providers or available) - available):
+        logger.warning("Unknown provider %r, available providers: %s", name, ", ".join(sorted(available)))
+
     for finder, name, ispkg in pkgutil.iter_modules(tools.__path__):
+        if providers is not None and name not in providers:
+            continue
         importlib.import_module(f"{tools.__name__}.{name}")
 
 
 if __name__ == "__main__":
-    _load_tools()
-    mcp.run(transport="stdio")
+    parser = argparse.ArgumentParser(description="Run the MCP tool server.")
+    parser.add_argument(
+        "--providers",
+        default=os.getenv("MCP_PROVIDERS"),
+        help="Comma-separated tool modules to enable, e.g. weather,azure (default: all, or MCP_PROVIDERS).",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.getenv("MCP_METRICS_PORT", "0")),
+        help="Serve Prometheus tool metrics on this port at /metrics (default: off, or MCP_METRICS_PORT).",
+    )
+    parser.add_argument(
+        "--transport",
+        choices=["stdio", "sse"],
+        default=os.getenv("MCP_TRANSPORT", "stdio"),
+        help="stdio serves the client that spawned the process; sse runs one long-lived server for many "
+             "clients over HTTP (default: stdio, or MCP_TRANSPORT).",
+    )
+    parser.add_argument("--host", default=os.getenv("MCP_HOST", "127.0.0.1"), help="SSE bind address.")
+    parser.add_argument("--port", type=int, default=int(os.getenv("MCP_PORT", "8000")), help="SSE port.")
+    args = parser.parse_args()
+
+    _load_tools(_parse_providers(args.providers))
+    logger.info(
+        "Registered %d tools in %.0f ms",
+        len(mcp._tool_manager.list_tools()),
+        (time.perf_counter() - _started) * 1000,
+    )
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    if args.transport == "sse":
+        mcp.settings.host = args.host
+        mcp.settings.port = args.port
+        logger.info("Serving MCP over SSE on http://%s:%d%s", args.host, args.port, mcp.settings.sse_path)
+    mcp.run(transport=args.transport)
@@ -1,3 +1,183 @@
+import inspect
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, List, Literal, Optional
+
 from mcp.server.fastmcp import FastMCP
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from mcp.types import AnyFunction
+
+from common.disk_cache import close_disk_cache
+from common.executor import to_async
+from common.metrics import instrument, render_prometheus, tool_metrics
+from common.resilience import breaker_states, tool_timeout, with_deadline
+from common.results import render_records
+from common.singleflight import coalesce
+
+logger = logging.getLogger(__name__)
+
+ShutdownHook = Callable[[], Optional[Awaitable[None]]]
+
+_shutdown_hooks: List[ShutdownHook] = []
+
+
+def on_shutdown(hook: ShutdownHook) -> ShutdownHook:
+    """
+    Register a sync or async callable that releases shared resources (connection
+    pools, SDK clients) when the server stops. Usable as a decorator.
+    """
+    _shutdown_hooks.append(hook)
+    return hook
+
+
+on_shutdown(close_disk_cache)
+
+
+async def run_shutdown_hooks() -> None:
+    """Run every registered shutdown hook, most recently registered first."""
+    for hook in reversed(_shutdown_hooks):
+        try:
+            result = hook()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception("Shutdown hook %s failed", getattr(hook, "__name__", hook))
+
+
+@asynccontextmanager
+async def app_lifespan(app: Starlette) -> AsyncIterator[None]:
+    """Process lifespan of the network server: shared pools outlive every client session."""
+    try:
+        yield
+    finally:
+        await run_shutdown_hooks()
+
+
+def tool_provider(fn: AnyFunction) -> str:
+    """The provider a tool belongs to, i.e. the name of its module in tools/."""
+    return fn.__module__.rsplit(".", 1)[-1]
+
+
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    return PlainTextResponse(render_prometheus(tool_metrics.snapshot()), media_type="text/plain; version=0.0.4")
+
+
+class AgentMCP(FastMCP):
+    """
+    FastMCP server that keeps blocking tools off the event loop, shares identical
+    concurrent calls of read-only tools and records per-tool metrics.
+    """
+
+    def tool(
+            self,
+            name: Optional[str] = None,
+            description: Optional[str] = None,
+            mutating: bool = False,
+            timeout: Optional[float] = None,
+    ) -> Callable[[AnyFunction], AnyFunction]:
+        """
+        Decorator to register a tool. Set mutating for tools that change state, e.g. start a VM.
+        timeout overrides the deadline of the tool, see add_tool.
+        """
+        if callable(name):
+            raise TypeError(
+                "The @tool decorator was used incorrectly. Did you forget to call it? Use @tool() instead of @tool"
+            )
+
+        def decorator(fn: AnyFunction) -> AnyFunction:
+            self.add_tool(fn, name=name, description=description, mutating=mutating, timeout=timeout)
+            return fn
+
+        return decorator
+
+    def add_tool(
+            self,
+            fn: AnyFunction,
+            name: Optional[str] = None,
+            description: Optional[str] = None,
+            mutating: bool = False,
+            timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Register a tool. Read-only tools fail with TimeoutError after timeout seconds,
+        by default MCP_<PROVIDER>_TIMEOUT or MCP_TOOL_TIMEOUT. Mutating tools bound
+        their own waits, a deadline would only stop reporting on work still running,
+        so they get one only when timeout is given.
+        """
+        name = name or fn.__name__
+        provider = tool_provider(fn)
+        # Cloud SDKs are synchronous. Running them on the worker pool lets concurrent
+        # tool calls overlap instead of queueing behind one slow request.
+        if not inspect.iscoroutinefunction(fn):
+            fn = to_async(fn, provider)
+        if timeout is None and not mutating:
+            timeout = tool_timeout(provider)
+        if timeout is not None:
+            fn = with_deadline(fn, name, timeout)
+        # Two identical reads in flight return the same data, so they share one upstream fetch.
+        # A mutating call must run every time it is asked for.
+        if not mutating:
+            fn = coalesce(fn, name)
+        super().add_tool(instrument(fn, name), name=name, description=description)
+
+    async def run_stdio_async(self) -> None:
+        # A stdio server serves exactly one client, so its resources go when the session ends.
+        try:
+            await super().run_stdio_async()
+        finally:
+            await run_shutdown_hooks()
+
+    def sse_app(self) -> Starlette:
+        """
+        The SSE app, serving any number of concurrent client sessions from this
+        process. Credentials, SDK clients and caches are module-level, so every
+        session shares them; they are released when the server shuts down.
+        """
+        app = super().sse_app()
+        routes = [*app.routes, Route("/metrics", endpoint=metrics_endpoint)]
+        return Starlette(debug=self.settings.debug, routes=routes, lifespan=app_lifespan)
+
+
+mcp = AgentMCP("agent", log_level=os.getenv("MCP_LOG_LEVEL", "INFO").upper())
+
+_STATS_COLUMNS = ["tool", "calls", "errors", "p50_ms", "p95_ms", "p99_ms", "max_ms", "upstream", "avg_bytes"]
+
+
+@mcp.tool(
+    description="Show per-tool call counts, latency percentiles, upstream request counts, result sizes and errors "
+                "since the server started, and which upstream services are failing fast. "
+                "output_format='prometheus' returns the Prometheus text format."
+)
+async def server_stats(output_format: Literal["text", "jsonl", "prometheus"] = "text") -> str:
+    snapshot = tool_metrics.snapshot()
+    if output_format == "prometheus":
+        return render_prometheus(snapshot)
 
-mcp = FastMCP("agent", log_leve="info")
+    rows = [
+        {
+            "tool": tool,
+            "calls": stats.calls,
+            "errors": sum(stats.errors.values()),
+            "p50_ms": round(stats.quantile(0.5) * 1000),
+            "p95_ms": round(stats.quantile(0.95) * 1000),
+            "p99_ms": round(stats.quantile(0.99) * 1000),
+            "max_ms": round(stats.max_seconds * 1000),
+            "upstream": stats.upstream_requests,
+            "avg_bytes": stats.result_bytes // max(1, stats.calls),
+        }
+        for tool, stats in sorted(snapshot.items(), key=lambda item: -item[1].total_seconds)
+    ]
+    errors = [
+        f"{tool}: {count} x {error}"
+        for tool, stats in snapshot.items() for error, count in stats.errors.most_common()
+    ]
+    circuits = [
+        f"{service}: circuit {state}"
+        for service, state in sorted(breaker_states().items()) if state != "closed"
+    ]
+    table = render_records(rows, _STATS_COLUMNS, output_format=output_format, empty_message="No tool calls yet.")
+    return "\n".join([table, *errors, *circuits])
@@ -0,0 +1,20 @@
+import os
+
+import pytest
+
+# Tests marked live talk to real Azure, GCP, Kubernetes and Proxmox endpoints, and some
+# change state (e.g. power a VM on and off), so they only run when asked for.
+_LIVE_TESTS = os.getenv("MCP_LIVE_TESTS", "false").lower() in ("1", "true", "yes")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "live: needs real cloud credentials, runs only with MCP_LIVE_TESTS=1")
+
+
+def pytest_collection_modifyitems(config, items):
+    if _LIVE_TESTS:
+        return
+    skip_live = pytest.mark.skip(reason="live test, set MCP_LIVE_TESTS=1 to run it")
+    for item in items:
+        if "live" in item.keywords:
+            item.add_marker(skip_live)
@@ -1,8 +1,53 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from azure.core.exceptions import HttpResponseError
 from dotenv import load_dotenv
 
+import tools.azure
+from common.disk_cache import DiskCache
+from common.resilience import breaker_states, reset_resilience
 from tools.azure import *
 
 
+class FakeResourceGraphClient:
+    """Returns vm_count virtual machines in pages of at most 'top' rows."""
+
+    def __init__(self, vm_count: int):
+        self.vm_count = vm_count
+        self.requests = []
+
+    def resources(self, request):
+        self.requests.append(request)
+        start = int(request.options.skip_token or 0)
+        end = min(start + request.options.top, self.vm_count)
+        rows = [{"name": f"vm-{i}", "resourceGroup": "rg", "location": "westeurope", "size": "Standard_B2s",
+                 "powerState": "running", "subscriptionId": f"sub-{i % 3}"} for i in range(start, end)]
+        return SimpleNamespace(data=rows, count=len(rows), skip_token=str(end) if end < self.vm_count else None)
+
+
+class FakeForecastOperations:
+    """Forecasts 10.0 per subscription and throttles the first throttled_requests requests with a 429."""
+
+    def __init__(self, throttled_requests: int = 1):
+        self.scopes = []
+        self.throttled_requests = throttled_requests
+
+    def usage(self, scope, parameters, **kwargs):
+        self.scopes.append(scope)
+        if len(self.scopes) <= self.throttled_requests:
+            response = SimpleNamespace(status_code=429, reason="Too Many Requests", headers={
+                "x-ms-ratelimit-microsoft.costmanagement-qpu-retry-after": "0",
+                "x-ms-ratelimit-microsoft.costmanagement-entity-retry-after": "0.01",
+            })
+            raise HttpResponseError(message="Too many requests", response=response)
+        columns = [SimpleNamespace(name=name) for name in ["Cost", "UsageDate", "CostStatus", "Currency"]]
+        return SimpleNamespace(columns=columns, rows=[[10.0, 20250401, "Forecast", "EUR"]])
+
+
+@pytest.mark.live
 def test_get_azure_forecast():
     """
     Test the get_azure_forecast function.
@@ -13,6 +58,7 @@ def test_get_azure_forecast():
     print("Result", result)
 
 
+@pytest.mark.live
 def test_get_azure_resource_groups():
     """
     Test the get_azure_resource_groups function.
@@ -22,6 +68,7 @@ def test_get_azure_resource_groups():
     print("Result", result)
 
 
+@pytest.mark.live
 def test_get_azure_virtual_machines():
     """
     Test the get_azure_virtual_machines function.
@@ -31,6 +78,129 @@ def test_get_azure_virtual_machines():
     print("Result", result)
 
 
+def test_azure_clients_are_pooled(monkeypatch):
+    """
+    Test that credentials and SDK clients are created once and then reused.
+    """
+    monkeypatch.setenv("AZURE_TENANT_ID", "tenant")
+    monkeypatch.setenv("AZURE_CLIENT_ID", "client")
+    monkeypatch.setenv("AZURE_CLIENT_SECRET", "secret")
+
+    cred = get_azure_credentials()
+    assert get_azure_credentials() is cred, "Expected the credential to be reused"
+
+    graph = get_resource_graph_client(cred)
+    assert get_resource_graph_client(cred) is graph, "Expected the client to be reused"
+    assert get_cost_management_client(cred) is not graph, "Expected one client per client type"
+
+    close_azure_clients()
+    assert get_azure_credentials() is not cred, "Expected a fresh credential after closing the pool"
+    close_azure_clients()
+
+
+def test_pooled_credential_refreshes_scopes_concurrently():
+    """
+    Test that a slow token fetch for one scope does not block another scope, and each scope is fetched once.
+    """
+    fetched = []
+
+    class SlowCredential:
+        def get_token(self, *scopes, **kwargs):
+            fetched.append(scopes)
+            time.sleep(0.2)
+            return SimpleNamespace(token=scopes[0], expires_on=time.time() + 3600)
+
+    credential = PooledCredential(SlowCredential(), "tenant")
+    scopes = ["https://management.azure.com/.default", "https://graph.microsoft.com/.default"] * 2
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        tokens = list(pool.map(lambda scope: credential.get_token(scope).token, scopes))
+    elapsed = time.perf_counter() - started
+
+    assert tokens == scopes, "Expected every caller to get the token of its scope"
+    assert sorted(fetched) == sorted((scope,) for scope in set(scopes)), f"Expected one fetch per scope, got {fetched}"
+    assert elapsed < 0.35, f"Expected the two scopes to be fetched concurrently, took {elapsed:.2f}s"
+
+
+def test_get_azure_virtual_machines_uses_resource_graph(monkeypatch):
+    """
+    Test that VMs are read from Resource Graph in pages, filtered server-side and truncated at max_rows.
+    """
+    client = FakeResourceGraphClient(vm_count=2500)
+    monkeypatch.setattr(tools.azure, "get_azure_credentials", lambda: None)
+    monkeypatch.setattr(tools.azure, "get_resource_graph_client", lambda credential: client)
+
+    result = get_azure_virtual_machines(subscriptions=["sub-0", "sub-1"], power_state="running", max_rows=1500)
+    lines = result.splitlines()
+
+    assert lines[0] == "name\tresourceGroup\tlocation\tsize\tpowerState\tsubscriptionId", "Expected a header row"
+    assert len(lines) == 1502 and lines[-1].startswith("... truncated"), "Expected 1500 rows and a truncation note"
+    assert len(client.requests) == 2, "Expected two Resource Graph pages"
+    assert client.requests[0].subscriptions == ["sub-0", "sub-1"], "Expected one query across all subscriptions"
+    assert "powerState =~ 'running'" in client.requests[0].query, "Expected the power state to be filtered server-side"
+
+
+def test_get_azure_virtual_machines_rejects_max_rows_below_one(monkeypatch):
+    """
+    Test that max_rows below one is rejected before Resource Graph is asked for a page of size zero.
+    """
+    client = FakeResourceGraphClient(vm_count=3)
+    monkeypatch.setattr(tools.azure, "get_azure_credentials", lambda: None)
+    monkeypatch.setattr(tools.azure, "get_resource_graph_client", lambda credential: client)
+
+    assert get_azure_virtual_machines(max_rows=0) == "max_rows must be at least 1.", "Expected max_rows to be rejected"
+    with pytest.raises(ValueError):
+        list(query_resource_graph("Resources", max_rows=0))
+    assert client.requests == [], "Expected no Resource Graph request"
+
+
+def test_get_azure_forecast_fans_out_over_subscriptions(monkeypatch, tmp_path):
+    """
+    Test that forecasts are requested per subscription, throttled requests are retried and totals are summed.
+    """
+    forecast = FakeForecastOperations()
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(tools.azure, "get_disk_cache", lambda: cache)
+    monkeypatch.setattr(tools.azure, "get_azure_credentials", lambda: None)
+    monkeypatch.setattr(tools.azure, "get_cost_management_client", lambda credential: SimpleNamespace(forecast=forecast))
+
+    result = get_azure_forecast(subscriptions=["sub-0", "sub-1", "sub-2"])
+    lines = result.splitlines()
+    assert lines[0] == "scope\tdate\tstatus\tcost\tcurrency", "Expected a header row"
+    assert len(lines) == 4, "Expected one row per subscription"
+    assert lines[1] == "sub-0\t2025-04-01\tForecast\t10.00\tEUR", "Expected the forecast of the first subscription"
+    assert len(forecast.scopes) == 4, "Expected the throttled request to be retried once"
+
+    result = get_azure_forecast(subscriptions=["sub-0", "sub-1", "sub-2"], group_by="total")
+    assert result.splitlines()[1] == "total\t2025-04-01\tForecast\t30.00\tEUR", "Expected the forecasts to be summed"
+    assert len(forecast.scopes) == 4, "Expected the second call to be served from the disk cache"
+
+    get_azure_forecast(subscriptions=["sub-0"], force_refresh=True)
+    assert len(forecast.scopes) == 5, "Expected force_refresh to query Azure again"
+
+
+def test_throttling_does_not_open_circuits(monkeypatch, tmp_path):
+    """
+    Test that a throttled forecast fan-out neither fails the remaining subscriptions nor blocks Resource Graph.
+    """
+    reset_resilience()
+    forecast = FakeForecastOperations(throttled_requests=6)
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(tools.azure, "get_disk_cache", lambda: cache)
+    monkeypatch.setattr(tools.azure, "get_azure_credentials", lambda: None)
+    monkeypatch.setattr(tools.azure, "get_cost_management_client", lambda credential: SimpleNamespace(forecast=forecast))
+    monkeypatch.setattr(tools.azure, "get_resource_graph_client", lambda credential: FakeResourceGraphClient(3))
+
+    lines = get_azure_forecast(subscriptions=[f"sub-{i}" for i in range(8)]).splitlines()
+    vms = get_azure_virtual_machines(subscriptions=["sub-0"])
+    states = breaker_states()
+    reset_resilience()
+
+    assert len(lines) == 9 and all(line.endswith("EUR") for line in lines[1:]), "Expected every subscription"
+    assert states["azure_cost_management"] == "closed", "Expected throttling not to open the circuit"
+    assert len(vms.splitlines()) == 4, "Expected Resource Graph to be called"
+
+
 if __name__ == "__main__":
     load_dotenv()
     test_get_azure_forecast()
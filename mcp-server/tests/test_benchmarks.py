@@ -0,0 +1,37 @@
+import asyncio
+
+from benchmarks.run import SCENARIOS, BenchmarkResult, compare, percentile, run_benchmarks
+
+
+def test_benchmarks_run_every_tool_offline():
+    """
+    Test that every benchmarked tool succeeds against the stand-in backends and its upstream requests are counted.
+    """
+    results = asyncio.run(run_benchmarks([10], iterations=1, latency=0.0))
+    by_tool = {result.tool: result for result in results}
+
+    assert set(by_tool) == {scenario.tool for scenario in SCENARIOS}, "Expected one result per scenario"
+    assert all(result.errors == 0 for result in results), "Expected no failed tool calls"
+    assert by_tool["get_forecast"].upstream == 2, "Expected the /points and forecast requests"
+    assert by_tool["get_pods_api"].upstream == 1, "Expected one pod list page"
+    assert by_tool["get_azure_forecast"].upstream == 10, "Expected one forecast request per subscription"
+    assert all(result.result_kib > 0 for result in results), "Expected every tool to return output"
+
+
+def test_compare_reports_regressions():
+    """
+    Test that slower, chattier or failing tools are reported against a baseline and small jitter is not.
+    """
+    baseline = [{"tool": "get_alerts", "scale": 10, "errors": 0, "p50_ms": 20.0, "upstream": 1.0, "peak_mib": 1.0}]
+    jitter = BenchmarkResult("get_alerts", 10, 5, 0, 24.0, 30.0, 30.0, 1.0, 1.0, 1.2)
+    slower = BenchmarkResult("get_alerts", 10, 5, 1, 45.0, 50.0, 50.0, 2.0, 1.0, 1.2)
+
+    assert compare([jitter], baseline, 1.5, 5.0) == [], "Expected jitter within the tolerance to pass"
+    regressions = compare([slower], baseline, 1.5, 5.0)
+    assert len(regressions) == 3, "Expected the latency, upstream and error regressions"
+    assert percentile([3.0, 1.0, 2.0, 4.0], 0.5) == 2.0, "Expected the nearest-rank median"
+
+
+if __name__ == "__main__":
+    test_benchmarks_run_every_tool_offline()
+    test_compare_reports_regressions()
@@ -0,0 +1,42 @@
+import time
+
+from common.cache import TTLCache
+
+
+def test_ttl_cache_expires_entries():
+    """
+    Test that entries are served until their TTL runs out and kept for revalidation afterwards.
+    """
+    cache = TTLCache(maxsize=4)
+    cache.set("fresh", 1, ttl=60)
+    cache.set("stale", 2, ttl=0, etag='"abc"')
+    time.sleep(0.01)
+
+    assert cache.get("fresh") == 1, "Expected the fresh entry to be served"
+    assert cache.get("stale") is None, "Expected the expired entry to be treated as a miss"
+    assert cache.get_entry("stale").metadata["etag"] == '"abc"', "Expected expired entries to keep their metadata"
+
+    cache.refresh("stale", ttl=60)
+    assert cache.get("stale") == 2, "Expected a refreshed entry to be fresh again"
+
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["revalidations"] == 1, f"Unexpected stats {stats}"
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    """
+    Test that the cache stays within maxsize by evicting the least recently used entry.
+    """
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")
+    cache.set("c", 3, ttl=60)
+
+    assert cache.get("b") is None, "Expected the least recently used entry to be evicted"
+    assert cache.get("a") == 1 and cache.get("c") == 3, "Expected recently used entries to survive"
+
+
+if __name__ == "__main__":
+    test_ttl_cache_expires_entries()
+    test_ttl_cache_evicts_least_recently_used()
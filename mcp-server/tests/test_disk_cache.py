@@ -0,0 +1,55 @@
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from common.disk_cache import DiskCache, cache_key
+
+
+def test_disk_cache_survives_restarts(tmp_path):
+    """
+    Test that cached values are read back by a new cache instance on the same file.
+    """
+    path = str(tmp_path / "cache.sqlite3")
+    key = cache_key("azure", "forecast", "/subscriptions/sub-0", "Monthly")
+    calls = []
+
+    cache = DiskCache(path)
+    value = cache.get_or_fetch(key, lambda: calls.append(1) or [{"Cost": 10.0}], ttl=60)
+    cache.close()
+
+    restarted = DiskCache(path)
+    assert restarted.get_or_fetch(key, lambda: calls.append(1) or [], ttl=60) == value, "Expected the cached value"
+    assert len(calls) == 1, "Expected a single upstream fetch across restarts"
+
+    restarted.get_or_fetch(key, lambda: calls.append(1) or [], ttl=60, force_refresh=True)
+    assert len(calls) == 2, "Expected force_refresh to fetch again"
+
+
+def test_disk_cache_serves_stale_while_revalidating(tmp_path):
+    """
+    Test that a stale entry is returned immediately and refreshed in the background.
+    """
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), max_stale=60)
+    cache.set("budgets", ["old"], ttl=0)
+    time.sleep(0.01)
+    refreshed = threading.Event()
+
+    def fetch():
+        refreshed.set()
+        return ["new"]
+
+    assert cache.get_or_fetch("budgets", fetch, ttl=60) == ["old"], "Expected the stale value to be served"
+    assert refreshed.wait(5), "Expected a background refresh"
+    for _ in range(100):
+        if cache.get_entry("budgets").fresh:
+            break
+        time.sleep(0.01)
+    assert cache.get_or_fetch("budgets", fetch, ttl=60) == ["new"], "Expected the refreshed value"
+    assert cache.stats()["stale_hits"] == 1, "Expected one stale hit"
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        test_disk_cache_survives_restarts(Path(directory))
+        test_disk_cache_serves_stale_while_revalidating(Path(directory) / "stale")
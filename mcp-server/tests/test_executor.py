@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from common.executor import run_blocking, to_async
+
+
+def _sleep(seconds: float) -> float:
+    time.sleep(seconds)
+    return seconds
+
+
+def test_blocking_calls_overlap():
+    """
+    Test that blocking calls run concurrently on the worker pool.
+    """
+
+    async def run():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(run_blocking("overlap", _sleep, 0.2) for _ in range(4)))
+        return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(run())
+    assert results == [0.2] * 4, "Expected every call to return its result"
+    assert elapsed < 0.6, f"Expected the calls to overlap, took {elapsed:.2f}s"
+
+
+def test_provider_concurrency_limit(monkeypatch):
+    """
+    Test that MCP_<PROVIDER>_CONCURRENCY caps concurrent calls for a provider.
+    """
+    monkeypatch.setenv("MCP_SERIAL_CONCURRENCY", "1")
+    sleep = to_async(_sleep, "serial")
+
+    async def run():
+        started = time.perf_counter()
+        await asyncio.gather(sleep(0.1), sleep(0.1), sleep(0.1))
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    assert elapsed >= 0.3, f"Expected the calls to be serialized, took {elapsed:.2f}s"
+
+
+def test_cancelled_call_keeps_its_slot_until_the_thread_ends(monkeypatch):
+    """
+    Test that a call abandoned by its deadline holds the provider slot until its worker thread finishes.
+    """
+    monkeypatch.setenv("MCP_ABANDONED_CONCURRENCY", "1")
+
+    async def run():
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(run_blocking("abandoned", _sleep, 0.3), 0.05)
+        except asyncio.TimeoutError:
+            pass
+        await run_blocking("abandoned", _sleep, 0)
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    assert elapsed >= 0.3, f"Expected the next call to wait for the abandoned thread, took {elapsed:.2f}s"
+
+
+if __name__ == "__main__":
+    test_blocking_calls_overlap()
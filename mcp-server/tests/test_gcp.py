@@ -1,8 +1,57 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
 from dotenv import load_dotenv
+from google.oauth2 import service_account
+
+import tools.gcp
+from common.disk_cache import DiskCache
+from tools.gcp import close_gcp_contexts, get_gcp_billing_accounts, get_gcp_billing_scan, get_gcp_context, get_gcp_forecast
+
+
+class FakeBillingClient:
+    """Attaches every project to billing account 0000-AAAA, and lists account_count accounts of 3 projects each."""
+
+    def __init__(self, account_count: int = 1):
+        self.account_count = account_count
+        self.requests = []
+
+    def get_project_billing_info(self, name, **kwargs):
+        self.requests.append(name)
+        return SimpleNamespace(billing_enabled=True, billing_account_name="billingAccounts/0000-AAAA")
+
+    def get_billing_account(self, name, **kwargs):
+        time.sleep(0.1)
+        return SimpleNamespace(name=name, display_name=name.split("/")[-1], open_=True)
+
+    def list_billing_accounts(self, request, **kwargs):
+        return iter([SimpleNamespace(name=f"billingAccounts/{i:04d}-AAAA", display_name=f"Account {i}", open_=True)
+                     for i in range(self.account_count)])
 
-from tools.gcp import get_gcp_billing_accounts, get_gcp_forecast
+    def list_project_billing_info(self, request, **kwargs):
+        return iter([SimpleNamespace(project_id=f"{request['name'][-9:]}-p{i}", billing_enabled=True,
+                                     billing_account_name=request["name"]) for i in range(3)])
 
 
+class FakeBudgetClient:
+    def list_budgets(self, parent=None, request=None, **kwargs):
+        amount = SimpleNamespace(budget_amount=SimpleNamespace(fixed_amount=SimpleNamespace(micro_amount=1_500_000_000)))
+        return iter([SimpleNamespace(display_name="Monthly", amount_spec=amount)])
+
+
+def _fake_gcp_context(monkeypatch, tmp_path, billing_client):
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", str(tmp_path / "key.json"))
+    monkeypatch.setattr(service_account.Credentials, "from_service_account_file",
+                        lambda keyfile, scopes: SimpleNamespace(scopes=scopes))
+    context = get_gcp_context()
+    context._billing_client = billing_client
+    context._budget_client = FakeBudgetClient()
+    return context
+
+
+@pytest.mark.live
 def test_get_gcp_billing_accounts():
     """
     Test the get_gcp_forecast function.
@@ -14,6 +63,7 @@ def test_get_gcp_billing_accounts():
     print("Result", result)
 
 
+@pytest.mark.live
 def test_get_gcp_forecast():
     """
     Test the get_gcp_forecast function.
@@ -24,6 +74,73 @@ def test_get_gcp_forecast():
     print("Result", result)
 
 
+def test_gcp_context_is_shared(monkeypatch, tmp_path):
+    """
+    Test that the key file is parsed once and billing info fetched by one tool is reused by the other.
+    """
+    loads = []
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", str(tmp_path / "key.json"))
+    monkeypatch.setenv("GCP_PROJECT_ID", "demo")
+    monkeypatch.setattr(service_account.Credentials, "from_service_account_file",
+                        lambda keyfile, scopes: loads.append(keyfile) or SimpleNamespace(scopes=scopes))
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(tools.gcp, "get_disk_cache", lambda: cache)
+
+    context = get_gcp_context()
+    billing_client = FakeBillingClient()
+    context._billing_client = billing_client
+    context._budget_client = FakeBudgetClient()
+
+    assert get_gcp_billing_accounts()["billing_account"] == "0000-AAAA", "Expected the project's billing account"
+    assert get_gcp_forecast() == ["Monthly: $1,500.00"], "Expected the budgets of the billing account"
+    assert get_gcp_context() is context and len(loads) == 1, "Expected the key file to be parsed once"
+    assert len(billing_client.requests) == 1, "Expected the project billing info to be memoized"
+
+    context._billing_client = context._budget_client = None
+    close_gcp_contexts()
+
+
+def test_get_gcp_billing_scan(monkeypatch, tmp_path):
+    """
+    Test that every billing account is scanned, projects are memoized and output is truncated at max_rows.
+    """
+    context = _fake_gcp_context(monkeypatch, tmp_path, FakeBillingClient(account_count=20))
+
+    result = get_gcp_billing_scan(max_rows=50)
+    sections = result.split("\n\n")
+    assert len(sections) == 3, "Expected account, project and budget tables"
+    assert len(sections[0].splitlines()) == 21, "Expected one row per billing account"
+    assert sections[1].splitlines()[-1].startswith("... truncated"), "Expected the 60 projects to be truncated"
+    assert len(sections[2].splitlines()) == 21, "Expected one budget per billing account"
+    assert context.billing_account_id("0019-AAAA-p2") == "0019-AAAA", "Expected scanned projects to be memoized"
+
+    context._billing_client = context._budget_client = None
+    close_gcp_contexts()
+
+
+def test_get_gcp_billing_scan_of_given_accounts(monkeypatch, tmp_path):
+    """
+    Test that given billing accounts are fetched concurrently and counts beyond max_rows are marked as such.
+    """
+    context = _fake_gcp_context(monkeypatch, tmp_path, FakeBillingClient())
+
+    started = time.perf_counter()
+    result = get_gcp_billing_scan(billing_accounts=[f"{i:04d}-AAAA" for i in range(4)], max_rows=2,
+                                  output_format="jsonl")
+    elapsed = time.perf_counter() - started
+    lines = result.split("\n\n")[0].splitlines()
+    accounts = [json.loads(line) for line in lines[:-1]]
+
+    assert [account["billing_account"] for account in accounts] == ["0000-AAAA", "0001-AAAA"], "Expected max_rows rows"
+    assert lines[-1].startswith("... truncated"), "Expected a truncation note"
+    assert accounts[0]["projects"] == ">2", f"Expected the 3 projects to be counted as >2, got {accounts[0]}"
+    assert accounts[0]["budgets"] == 1, f"Expected the one budget to be counted exactly, got {accounts[0]}"
+    assert elapsed < 0.3, f"Expected the 4 accounts to be fetched concurrently, took {elapsed:.2f}s"
+
+    context._billing_client = context._budget_client = None
+    close_gcp_contexts()
+
+
 if __name__ == "__main__":
     load_dotenv()
     test_get_gcp_billing_accounts()
@@ -1,17 +1,174 @@
-from tools.kubernetes import get_pods_api, create_demo_nginx
+import json
+import time
 
+import pytest
 
+import tools.kubernetes
+from tools.kubernetes import get_pods_api, create_demo_nginx, parse_label_selector, parse_field_selector, \
+    PodInformer, PodSummary, iter_pods_from_api, render_pods
+
+
+def _raw_pod(name, namespace="default", phase="Running", labels=None, resource_version="1"):
+    return {
+        "metadata": {"name": name, "namespace": namespace, "labels": labels or {}, "resourceVersion": resource_version},
+        "spec": {"nodeName": "node-1"},
+        "status": {"podIP": "10.0.0.1", "phase": phase},
+    }
+
+
+class _FakeResponse:
+    def __init__(self, payload=None, lines=()):
+        self.data = json.dumps(payload).encode() if payload is not None else b""
+        self._lines = lines
+
+    def stream(self, amt=None, decode_content=False):
+        for line in self._lines:
+            yield (json.dumps(line) + "\n").encode()
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class _FakeCoreV1Api:
+    """Serves two pages of pods, then one batch of watch events."""
+
+    def __init__(self):
+        self.watch_calls = []
+
+    def list_pod_for_all_namespaces(self, **kwargs):
+        if kwargs.get("watch"):
+            self.watch_calls.append(kwargs.get("resource_version"))
+            if len(self.watch_calls) > 1:
+                time.sleep(0.05)
+                return _FakeResponse()
+            return _FakeResponse(lines=[
+                {"type": "MODIFIED", "object": _raw_pod("web-1", phase="Succeeded", resource_version="11")},
+                {"type": "DELETED", "object": _raw_pod("web-2", resource_version="12")},
+                {"type": "ADDED", "object": _raw_pod("db-1", namespace="data", labels={"app": "db"},
+                                                     resource_version="13")},
+            ])
+        if kwargs.get("_continue") is None:
+            return _FakeResponse({"metadata": {"continue": "page-2"},
+                                  "items": [_raw_pod("web-1", labels={"app": "web"})]})
+        return _FakeResponse({"metadata": {"resourceVersion": "10"},
+                              "items": [_raw_pod("web-2", labels={"app": "web"})]})
+
+
+class _ExpiringWatchApi(_FakeCoreV1Api):
+    """Answers the first watch with a 410 Gone ERROR event, as when the resourceVersion has expired."""
+
+    def __init__(self):
+        super().__init__()
+        self.lists = 0
+
+    def list_pod_for_all_namespaces(self, **kwargs):
+        if kwargs.get("watch") and not self.watch_calls:
+            self.watch_calls.append(kwargs.get("resource_version"))
+            return _FakeResponse(lines=[{"type": "ERROR", "object": {
+                "kind": "Status", "code": 410, "reason": "Expired", "message": "too old resource version"}}])
+        if not kwargs.get("watch") and kwargs.get("_continue") is None:
+            self.lists += 1
+        return super().list_pod_for_all_namespaces(**kwargs)
+
+
+def _wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.mark.live
 def test_get_pods_in_all_namespaces():
     pods = get_pods_api()
     assert pods is not None, "Failed to retrieve pods"
 
 
+@pytest.mark.live
 def test_create_demo_nginx():
     result = create_demo_nginx()
     assert "Nginx demo is up!" in result, "Failed to create Nginx demo"
     print("Result:", result)
 
 
+def test_selectors_match_cached_pods():
+    """
+    Test that label and field selectors are evaluated against pod summaries.
+    """
+    pod = PodSummary(name="web-1", namespace="default", ip="10.0.0.1", phase="Running", node="node-1",
+                     labels={"app": "web", "tier": "frontend"})
+
+    def matches(matchers):
+        return all(match(pod) for match in matchers)
+
+    assert matches(parse_label_selector("app=web,tier in (frontend, edge)")), "Expected the labels to match"
+    assert not matches(parse_label_selector("app!=web")), "Expected != to exclude the pod"
+    assert matches(parse_label_selector("!canary,tier")), "Expected existence checks to match"
+    assert matches(parse_field_selector("status.phase=Running,spec.nodeName==node-1")), "Expected the fields to match"
+    assert parse_field_selector("spec.restartPolicy=Always") is None, "Expected unknown fields to be unsupported"
+
+
+def test_pod_informer_lists_then_watches(monkeypatch):
+    """
+    Test that the informer lists every page, then applies watch events from the listed resourceVersion.
+    """
+    api = _FakeCoreV1Api()
+    monkeypatch.setattr(tools.kubernetes, "_core_api", api)
+    informer = PodInformer()
+    try:
+        assert informer.query() is None, "Expected a cold informer to leave the query to the API"
+        _wait_until(lambda: len(api.watch_calls) >= 2)
+
+        pods = {pod.name: pod for pod in informer.query()}
+        assert set(pods) == {"web-1", "db-1"}, f"Unexpected pods {sorted(pods)}"
+        assert pods["web-1"].phase == "Succeeded", "Expected the MODIFIED event to be applied"
+        assert [pod.name for pod in informer.query(namespace="data", label_selector="app=db")] == ["db-1"]
+        assert api.watch_calls[:2] == ["10", "13"], "Expected the watch to resume from the last resourceVersion"
+    finally:
+        informer.stop()
+
+
+def test_pod_informer_relists_after_watch_error(monkeypatch):
+    """
+    Test that an ERROR event on the watch makes the informer list the pods again.
+    """
+    api = _ExpiringWatchApi()
+    monkeypatch.setattr(tools.kubernetes, "_core_api", api)
+    informer = PodInformer()
+    try:
+        informer.query()
+        _wait_until(lambda: api.lists >= 2 and informer.query() is not None)
+
+        assert api.lists == 2, f"Expected one relist after the expired watch, got {api.lists} lists"
+        assert {pod.name for pod in informer.query()} == {"web-1", "web-2"}, "Expected the relisted pods"
+    finally:
+        informer.stop()
+
+
+def test_pod_listing_stops_paging_at_max_rows(monkeypatch):
+    """
+    Test that streamed pod listings only fetch the pages needed for max_rows.
+    """
+    requested_pages = []
+
+    class PagedApi:
+        def list_namespaced_pod(self, namespace, limit, _continue, **kwargs):
+            page = int(_continue or 0)
+            requested_pages.append(page)
+            items = [_raw_pod(f"pod-{page * limit + i}", namespace=namespace) for i in range(limit)]
+            return _FakeResponse({"metadata": {"continue": str(page + 1)}, "items": items})
+
+    monkeypatch.setattr(tools.kubernetes, "_core_api", PagedApi())
+    result = render_pods(iter_pods_from_api(namespace="batch", page_size=10), output_format="jsonl", max_rows=25)
+    lines = result.splitlines()
+
+    assert requested_pages == [0, 1, 2], f"Expected three pages to be fetched, got {requested_pages}"
+    assert json.loads(lines[0])["name"] == "pod-0", "Expected JSON lines output"
+    assert len(lines) == 26 and lines[-1].startswith("... truncated"), "Expected 25 rows and a truncation note"
+
+
 if __name__ == "__main__":
     test_get_pods_in_all_namespaces()
     test_create_demo_nginx()
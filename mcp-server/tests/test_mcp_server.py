@@ -0,0 +1,24 @@
+import asyncio
+
+import mcp_server
+from mcp_server import mcp, on_shutdown
+
+
+def test_sse_app_releases_shared_resources_on_server_shutdown(monkeypatch):
+    """
+    Test that the network app runs the shutdown hooks once, when the server stops, rather than per client session.
+    """
+    closed = []
+    monkeypatch.setattr(mcp_server, "_shutdown_hooks", [])
+    on_shutdown(lambda: closed.append("pool"))
+    app = mcp.sse_app()
+    paths = {route.path for route in app.routes}
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            assert not closed, "Expected shared resources to stay open while the server runs"
+
+    asyncio.run(run())
+    assert closed == ["pool"], "Expected the shutdown hooks to run when the server stops"
+    assert {"/sse", "/messages", "/metrics"} <= paths, f"Unexpected routes {paths}"
+
@@ -0,0 +1,55 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from common.executor import run_blocking, submit_in_context
+from common.metrics import count_upstream_request, instrument, render_prometheus, tool_metrics
+from mcp_server import server_stats
+
+
+def _fan_out(count: int) -> str:
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for future in [submit_in_context(executor, count_upstream_request) for _ in range(count)]:
+            future.result()
+    return "x" * 100
+
+
+async def _listing_tool() -> str:
+    return await run_blocking("test", _fan_out, 8)
+
+
+async def _failing_tool() -> str:
+    raise KeyError("missing")
+
+
+def test_instrument_records_calls_upstream_requests_and_errors():
+    """
+    Test that instrumented tools record latency, result size, errors and upstream requests made on worker threads.
+    """
+    tool_metrics.reset()
+    listing = instrument(_listing_tool, "listing")
+    failing = instrument(_failing_tool, "failing")
+
+    async def run():
+        await asyncio.gather(listing(), listing())
+        with pytest.raises(KeyError):
+            await failing()
+
+    asyncio.run(run())
+    snapshot = tool_metrics.snapshot()
+
+    assert snapshot["listing"].calls == 2, "Expected both calls to be counted"
+    assert snapshot["listing"].upstream_requests == 16, "Expected upstream requests from fan-out threads to count"
+    assert snapshot["listing"].result_bytes == 200, "Expected the result sizes to be summed"
+    assert snapshot["failing"].errors == {"KeyError": 1}, "Expected the error class to be recorded"
+
+    stats = asyncio.run(server_stats()).splitlines()
+    assert stats[0].startswith("tool\tcalls\terrors\tp50_ms"), "Expected a stats table"
+    assert "failing: 1 x KeyError" in stats, "Expected the error classes to be listed"
+    assert 'mcp_tool_calls_total{tool="listing"} 2' in render_prometheus(snapshot), "Expected Prometheus counters"
+    tool_metrics.reset()
+
+
+if __name__ == "__main__":
+    test_instrument_records_calls_upstream_requests_and_errors()
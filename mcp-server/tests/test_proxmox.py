@@ -1,9 +1,40 @@
+import json
+
+import pytest
 from dotenv import load_dotenv
 
+import tools.proxmox
 from tools.proxmox import get_proxmox_virtual_machines, get_proxmox_nodes, get_proxmox_users, \
-    start_proxmox_virtual_machine, stop_proxmox_virtual_machine
+    start_proxmox_virtual_machine, stop_proxmox_virtual_machine, invalidate_proxmox_inventory, \
+    start_proxmox_virtual_machines
+
+
+class FakeProxmoxAPI:
+    """Answers /cluster/resources for a cluster of two nodes and vm_count VMs."""
+
+    def __init__(self, vm_count: int):
+        self.vm_count = vm_count
+        self.calls = 0
+        self.started = []
+
+    def list_resources(self, **kwargs):
+        self.calls += 1
+        nodes = [{"id": f"node/pve{i}", "type": "node", "node": f"pve{i}", "status": "online",
+                  "cpu": 0.25, "maxcpu": 16, "mem": 2 ** 33, "maxmem": 2 ** 35} for i in (1, 2)]
+        vms = [{"id": f"qemu/{100 + i}", "type": "qemu", "vmid": 100 + i, "name": f"vm-{i}", "tags": "web;prod",
+                "node": f"pve{i % 2 + 1}", "status": "running" if i % 3 else "stopped"} for i in range(self.vm_count)]
+        return nodes + vms
 
+    def start_vm(self, node, vmid, **kwargs):
+        self.started.append(vmid)
+        return f"UPID:{node}:qmstart:{vmid}:"
 
+    def list_tasks(self, node, **kwargs):
+        return [{"upid": f"UPID:{node}:qmstart:{vmid}:", "endtime": 1, "status": "OK" if vmid != "103" else "failed"}
+                for vmid in self.started]
+
+
+@pytest.mark.live
 def test_get_proxmox_virtual_machines():
     """
     Test the get_proxmox_virtual_machine function.
@@ -14,6 +45,7 @@ def test_get_proxmox_virtual_machines():
     print("Result", result)
 
 
+@pytest.mark.live
 def test_get_proxmox_nodes():
     """
     Test the get_proxmox_virtual_machine function.
@@ -24,6 +56,7 @@ def test_get_proxmox_nodes():
     print("Result", result)
 
 
+@pytest.mark.live
 def test_get_proxmox_users():
     """
     Test the get_proxmox_virtual_machine function.
@@ -34,6 +67,7 @@ def test_get_proxmox_users():
     print("Result", result)
 
 
+@pytest.mark.live
 def test_start_proxmox_virtual_machine():
     """
     Test the start_proxmox_virtual_machine function.
@@ -44,6 +78,7 @@ def test_start_proxmox_virtual_machine():
     print("Result", result)
 
 
+@pytest.mark.live
 def test_stop_proxmox_virtual_machine():
     """
     Test the stop_proxmox_virtual_machine function.
@@ -54,6 +89,92 @@ def test_stop_proxmox_virtual_machine():
     print("Result", result)
 
 
+def test_proxmox_inventory_uses_one_request(monkeypatch):
+    """
+    Test that listing VMs and nodes is served from one /cluster/resources snapshot.
+    """
+    api = FakeProxmoxAPI(vm_count=500)
+    monkeypatch.setattr(tools.proxmox, "get_proxmox_api", lambda: api)
+    invalidate_proxmox_inventory()
+
+    vms = get_proxmox_virtual_machines()
+    running = get_proxmox_virtual_machines(status="running")
+    nodes = get_proxmox_nodes()
+    first_node = get_proxmox_nodes(max_rows=1).splitlines()
+    invalidate_proxmox_inventory()
+
+    assert vms.splitlines()[0] == "vmid\tname\tnode\tstatus", "Expected a header row"
+    assert len(vms.splitlines()) == 501, "Expected every VM to be listed"
+    assert all(line.endswith("\trunning") for line in running.splitlines()[1:]), "Expected only running VMs"
+    assert "pve1\tonline\t25.00\t16\t8.00\t32.00" in nodes, "Expected the nodes to be listed"
+    assert len(first_node) == 3 and first_node[-1].startswith("... truncated after 1 nodes"), "Expected max_rows nodes"
+    assert get_proxmox_nodes(max_rows=0) == "max_rows must be at least 1.", "Expected max_rows to be rejected"
+    assert api.calls == 1, f"Expected one request for the whole inventory, got {api.calls}"
+
+
+def test_get_proxmox_virtual_machines_selects_fields(monkeypatch):
+    """
+    Test that VM listings return only the requested fields and at most max_rows VMs.
+    """
+    api = FakeProxmoxAPI(vm_count=50)
+    monkeypatch.setattr(tools.proxmox, "get_proxmox_api", lambda: api)
+    invalidate_proxmox_inventory()
+
+    lines = get_proxmox_virtual_machines(fields=["vmid", "tags"], max_rows=10, output_format="jsonl").splitlines()
+    invalidate_proxmox_inventory()
+
+    assert json.loads(lines[0]) == {"vmid": "100", "tags": ["web", "prod"]}, "Expected only the selected fields"
+    assert len(lines) == 11 and lines[-1].startswith("... truncated"), "Expected 10 VMs and a truncation note"
+    assert get_proxmox_virtual_machines(fields=["ip"]).startswith("Unknown fields ip"), "Expected unknown fields to be reported"
+
+
+def test_bulk_start_reports_per_vm(monkeypatch):
+    """
+    Test that a bulk start skips running VMs, starts the rest and reports each task's outcome.
+    """
+    api = FakeProxmoxAPI(vm_count=7)
+    monkeypatch.setattr(tools.proxmox, "get_proxmox_api", lambda: api)
+
+    result = start_proxmox_virtual_machines(tag="web", timeout=5).splitlines()
+    missing = start_proxmox_virtual_machines(vm_ids=["999"], timeout=5)
+
+    assert sorted(api.started) == ["100", "103", "106"], f"Expected only stopped VMs to be started, got {api.started}"
+    assert "VM 101 is already running." in result, "Expected running VMs to be skipped"
+    assert "VM 100 (vm-0 on pve1) started." in result, "Expected the completed task to be reported"
+    assert "VM 103 could not be started: failed" in result, "Expected the failed task to be reported"
+    assert missing == "VM 999 was not found.", "Expected unknown IDs to be reported"
+
+
+def test_power_action_reports_running_tasks(monkeypatch):
+    """
+    Test that a power action stops waiting after PROXMOX_TASK_TIMEOUT and reports the task still running.
+    """
+    api = FakeProxmoxAPI(vm_count=1)
+    api.list_tasks = lambda node, **kwargs: []
+    api.get_task_status = lambda node, upid: {"status": "running"}
+    monkeypatch.setattr(tools.proxmox, "get_proxmox_api", lambda: api)
+    monkeypatch.setattr(tools.proxmox, "_TASK_TIMEOUT", 0.05)
+
+    result = start_proxmox_virtual_machine("100")
+    bulk = start_proxmox_virtual_machines(vm_ids=["100"], timeout=600)
+
+    assert result == "VM 100: task UPID:pve1:qmstart:100: still running after 0.05s.", f"Unexpected result {result}"
+    assert bulk == result, "Expected the timeout to be capped at PROXMOX_TASK_TIMEOUT"
+
+
+def test_power_action_rejects_non_positive_timeout(monkeypatch):
+    """
+    Test that a timeout of zero or less is rejected before any VM is started.
+    """
+    api = FakeProxmoxAPI(vm_count=1)
+    monkeypatch.setattr(tools.proxmox, "get_proxmox_api", lambda: api)
+
+    for timeout in (0, -5):
+        result = start_proxmox_virtual_machines(vm_ids=["100"], timeout=timeout)
+        assert result == "timeout must be greater than 0.", f"Unexpected result {result!r} for timeout={timeout}"
+    assert api.started == [], "Expected no VM to be started"
+
+
 if __name__ == "__main__":
     load_dotenv()
     test_get_proxmox_virtual_machines()
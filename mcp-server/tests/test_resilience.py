@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import pytest
+
+import common.resilience
+from common.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    UpstreamErrors,
+    call_with_retries,
+    get_breaker,
+    request_timeout,
+    reset_resilience,
+    retry_after_header,
+    with_deadline,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+ERRORS = UpstreamErrors(
+    lambda error: getattr(error, "status", None),
+    lambda: (ConnectionError,),
+    lambda error: 1.5 if getattr(error, "status", None) == 429 else None,
+)
+
+
+def test_circuit_breaker_opens_and_recovers():
+    """
+    Test that a breaker fails fast after repeated failures and closes again after a successful trial call.
+    """
+    breaker = CircuitBreaker("backend", failures=3, reset_after=0.05)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+
+    assert breaker.state == "open", "Expected the circuit to open after 3 failures"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open", "Expected a trial call to be allowed after the reset delay"
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed", "Expected a successful trial to close the circuit"
+
+
+def test_call_with_retries(monkeypatch):
+    """
+    Test that transient errors are retried after the Retry-After delay, up to max_retries, and other errors are not.
+    """
+    reset_resilience()
+    sleeps = []
+    monkeypatch.setattr(common.resilience.time, "sleep", sleeps.append)
+    attempts = []
+
+    def throttled() -> str:
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise StatusError(429)
+        return "ok"
+
+    result = call_with_retries("test", throttled, ERRORS, max_retries=2)
+    assert result == "ok" and len(attempts) == 3, "Expected two retries before the call succeeded"
+    assert sleeps == [1.5, 1.5], f"Expected the Retry-After delay to be used, got {sleeps}"
+
+    def unreachable() -> str:
+        attempts.append(1)
+        raise ConnectionError("refused")
+
+    attempts.clear()
+    with pytest.raises(ConnectionError):
+        call_with_retries("test", unreachable, ERRORS, max_retries=1)
+    assert len(attempts) == 2, "Expected to give up after max_retries"
+
+    def invalid() -> str:
+        attempts.append(1)
+        raise StatusError(404)
+
+    attempts.clear()
+    with pytest.raises(StatusError):
+        call_with_retries("test", invalid, ERRORS)
+    assert len(attempts) == 1, "Expected a non-transient error not to be retried"
+    assert get_breaker("test").state == "closed", "Expected the circuit to stay closed"
+    assert retry_after_header({"Retry-After": "7"}) == 7.0, "Expected Retry-After in seconds to be read"
+    reset_resilience()
+
+
+def test_with_deadline():
+    """
+    Test that a tool past its deadline fails with TimeoutError naming it and request timeouts shrink to fit.
+    """
+
+    async def slow() -> float:
+        timeout = request_timeout(30)
+        await asyncio.sleep(1)
+        return timeout
+
+    async def quick() -> float:
+        return request_timeout(30)
+
+    with pytest.raises(TimeoutError, match="slow_tool did not finish within 0.05 s"):
+        asyncio.run(with_deadline(slow, "slow_tool", 0.05)())
+    assert asyncio.run(with_deadline(quick, "quick_tool", 5)()) <= 5, "Expected the request timeout to fit the deadline"
+    assert request_timeout(30) == 30, "Expected the default outside of a tool call"
+
+
+if __name__ == "__main__":
+    test_circuit_breaker_opens_and_recovers()
+    test_with_deadline()
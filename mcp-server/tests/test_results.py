@@ -0,0 +1,40 @@
+import json
+from dataclasses import dataclass
+from itertools import count
+
+from common.results import render_records
+
+
+@dataclass
+class Vm:
+    name: str
+    status: str
+    cpu: float
+
+
+def test_render_records_selects_fields_and_stops_at_max_rows():
+    """
+    Test that only the selected fields are rendered and an endless stream is consumed up to max_rows.
+    """
+    vms = (Vm(f"vm-{i}", "running", i / 10) for i in count())
+    lines = render_records(vms, ["name", "status", "cpu"], fields=["cpu", "name"], max_rows=3).splitlines()
+
+    assert lines[0] == "cpu\tname", "Expected the header to follow the requested field order"
+    assert lines[1:4] == ["0.00\tvm-0", "0.10\tvm-1", "0.20\tvm-2"], f"Unexpected rows {lines[1:4]}"
+    assert lines[4] == "... truncated after 3 rows, narrow the query or raise max_rows.", "Expected a truncation note"
+
+
+def test_render_records_as_json_lines():
+    """
+    Test that dict records are rendered as one JSON object per line, and an empty listing as the empty message.
+    """
+    rows = [{"name": "rg-1", "location": "westeurope", "extra": "dropped"}]
+    result = render_records(rows, ["name", "location"], output_format="jsonl")
+
+    assert json.loads(result) == {"name": "rg-1", "location": "westeurope"}, "Expected only the declared columns"
+    assert render_records([], ["name"], empty_message="Nothing.") == "Nothing.", "Expected the empty message"
+
+
+if __name__ == "__main__":
+    test_render_records_selects_fields_and_stops_at_max_rows()
+    test_render_records_as_json_lines()
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from common.singleflight import SingleFlight, coalesce
+from mcp_server import AgentMCP
+
+
+def test_identical_concurrent_calls_share_one_fetch():
+    """
+    Test that concurrent calls with the same arguments share one call and different arguments do not.
+    """
+    flight = SingleFlight()
+    fetched = []
+
+    async def get_alerts(state: str) -> str:
+        fetched.append(state)
+        await asyncio.sleep(0.01)
+        return f"alerts for {state}"
+
+    tool = coalesce(get_alerts, "get_alerts", flight)
+
+    async def run():
+        return await asyncio.gather(tool(state="CA"), tool(state="CA"), tool(state="NV"), tool(state="CA"))
+
+    results = asyncio.run(run())
+    assert results == ["alerts for CA", "alerts for CA", "alerts for NV", "alerts for CA"], "Expected every result"
+    assert sorted(fetched) == ["CA", "NV"], "Expected one fetch per distinct argument set"
+    assert flight.shared == 2 and flight.in_flight() == 0, "Expected two shared calls and nothing left in flight"
+
+    asyncio.run(tool(state="CA"))
+    assert fetched.count("CA") == 2, "Expected a finished call not to be reused"
+
+
+def test_shared_call_errors_and_cancellation():
+    """
+    Test that every caller sees the error of a shared call and a cancelled caller does not cancel the others.
+    """
+    flight = SingleFlight()
+
+    async def failing() -> str:
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def slow() -> str:
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run_failing():
+        return await asyncio.gather(flight.do("a", failing), flight.do("a", failing), return_exceptions=True)
+
+    errors = asyncio.run(run_failing())
+    assert all(isinstance(error, RuntimeError) for error in errors), "Expected both callers to see the error"
+
+    async def run_cancelled():
+        first = asyncio.ensure_future(flight.do("b", slow))
+        second = asyncio.ensure_future(flight.do("b", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run_cancelled()) == "done", "Expected the remaining caller to get the result"
+
+
+def test_mutating_tools_are_not_coalesced():
+    """
+    Test that the server shares concurrent reads but runs every call of a mutating tool.
+    """
+    server = AgentMCP("test")
+    calls = {"read": 0, "start": 0}
+
+    @server.tool()
+    async def read_inventory() -> str:
+        calls["read"] += 1
+        await asyncio.sleep(0.01)
+        return "inventory"
+
+    @server.tool(mutating=True)
+    async def start_vm(vm_id: str) -> str:
+        calls["start"] += 1
+        await asyncio.sleep(0.01)
+        return f"started {vm_id}"
+
+    async def run():
+        await asyncio.gather(*(server.call_tool("read_inventory", {}) for _ in range(3)))
+        await asyncio.gather(*(server.call_tool("start_vm", {"vm_id": "109"}) for _ in range(3)))
+
+    asyncio.run(run())
+    assert calls == {"read": 1, "start": 3}, f"Unexpected call counts {calls}"
+
+
+if __name__ == "__main__":
+    test_identical_concurrent_calls_share_one_fetch()
+    test_shared_call_errors_and_cancellation()
+    test_mutating_tools_are_not_coalesced()
@@ -0,0 +1,191 @@
+import asyncio
+
+import httpx
+import pytest
+
+import common.resilience
+import tools.weather
+from common.resilience import reset_resilience
+from tools.weather import (
+    close_http_client,
+    get_alerts,
+    get_alerts_for_states,
+    get_forecasts,
+    get_http_client,
+    make_nws_request,
+    nws_cache_stats,
+    points_url,
+)
+
+
+def test_http_client_is_shared():
+    """
+    Test that the NWS HTTP client is reused until it is closed.
+    """
+
+    async def run():
+        client = get_http_client()
+        assert get_http_client() is client, "Expected the HTTP client to be reused"
+        await close_http_client()
+        assert client.is_closed, "Expected the HTTP client to be closed"
+        assert get_http_client() is not client, "Expected a fresh HTTP client after closing"
+        await close_http_client()
+
+    asyncio.run(run())
+
+
+def test_points_url_rounds_coordinates():
+    """
+    Test that nearby coordinates resolve to the same /points URL.
+    """
+    assert points_url(39.7412, -104.9921) == points_url(39.7389, -104.9879), "Expected nearby points to share a URL"
+
+
+def test_make_nws_request_revalidates_with_etag():
+    """
+    Test that cached NWS responses are served from memory and revalidated with If-None-Match once stale.
+    """
+    url = "https://api.weather.gov/alerts/active/area/ZZ"
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304, headers={"Cache-Control": "max-age=60"})
+        return httpx.Response(200, json={"features": []}, headers={"ETag": '"v1"', "Cache-Control": "max-age=0"})
+
+    async def run():
+        tools.weather._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            first = await make_nws_request(url)
+            second = await make_nws_request(url)
+            third = await make_nws_request(url)
+        finally:
+            await close_http_client()
+        return first, second, third
+
+    before = nws_cache_stats()
+    first, second, third = asyncio.run(run())
+    after = nws_cache_stats()
+
+    assert first == second == third == {"features": []}, "Expected the cached body to be returned"
+    assert len(requests) == 2, "Expected one full fetch and one conditional request"
+    assert requests[1].headers["If-None-Match"] == '"v1"', "Expected the stored ETag to be sent"
+    assert after["revalidations"] == before["revalidations"] + 1, "Expected the 304 to be counted"
+    assert after["hits"] == before["hits"] + 1, "Expected the revalidated entry to be served from memory"
+
+
+def test_make_nws_request_survives_an_unreachable_nws(monkeypatch):
+    """
+    Test that connection errors are retried, then answered with the stale entry if there is one, else None.
+    """
+    monkeypatch.setattr(common.resilience, "_BACKOFF_BASE", 0.0)
+    reset_resilience()
+    stale_url = "https://api.weather.gov/alerts/active/area/YY"
+    missing_url = "https://api.weather.gov/alerts/active/area/XX"
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(request.url.path)
+        if len(attempts) == 1:
+            return httpx.Response(200, json={"features": []}, headers={"Cache-Control": "max-age=0"})
+        raise httpx.ConnectTimeout("timed out", request=request)
+
+    async def run():
+        tools.weather._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await make_nws_request(stale_url), await make_nws_request(stale_url), await make_nws_request(missing_url)
+        finally:
+            await close_http_client()
+
+    fresh, stale, missing = asyncio.run(run())
+    reset_resilience()
+
+    assert fresh == stale == {"features": []}, "Expected the stale response while the NWS is unreachable"
+    assert missing is None, "Expected None without a cached response"
+    # Three tries for the stale URL, then the fifth consecutive failure opens the circuit.
+    assert len(attempts) == 6, f"Expected the circuit to open after five failures, got {len(attempts)} requests"
+
+
+def test_get_alerts_renders_at_most_max_rows():
+    """
+    Test that alerts are rendered as records with the selected fields and truncated at max_rows.
+    """
+    tools.weather._response_cache.clear()
+    features = [{"properties": {"event": "Wind Advisory", "areaDesc": f"Zone {i}", "severity": "Moderate",
+                                "description": "Gusty\nwinds."}} for i in range(5)]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"features": features})
+
+    async def run():
+        tools.weather._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await get_alerts("KS", max_rows=2), await get_alerts("KS", fields=["areaDesc"], output_format="jsonl")
+        finally:
+            await close_http_client()
+
+    table, selected = asyncio.run(run())
+    tools.weather._response_cache.clear()
+    lines = table.splitlines()
+
+    assert lines[0] == "event\tareaDesc\tseverity\tdescription\tinstruction", "Expected a header row"
+    assert lines[1] == "Wind Advisory\tZone 0\tModerate\tGusty winds.\t", "Expected one line per alert"
+    assert len(lines) == 4 and lines[-1].startswith("... truncated after 2 alerts"), "Expected a truncation note"
+    assert selected.splitlines()[4] == '{"areaDesc": "Zone 4"}', "Expected only the selected field"
+    assert asyncio.run(get_alerts("KS", fields=["wind"])).startswith("Unknown fields wind"), "Expected unknown fields"
+
+
+def test_batch_tools_share_requests():
+    """
+    Test that batch forecasts look up each gridpoint once and batch alerts make one multi-area request.
+    """
+    tools.weather._response_cache.clear()
+    requests = []
+    period = {"name": "Tonight", "temperature": 45, "temperatureUnit": "F", "windSpeed": "10 mph",
+              "windDirection": "NW", "detailedForecast": "Clear."}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(str(request.url))
+        if "/points/" in request.url.path:
+            gridpoint = "BOU/62,60" if request.url.path.endswith("-105.0") else "PUB/10,10"
+            forecast_url = f"https://api.weather.gov/gridpoints/{gridpoint}/forecast"
+            return httpx.Response(200, json={"properties": {"forecast": forecast_url}})
+        if "/gridpoints/" in request.url.path:
+            return httpx.Response(200, json={"properties": {"periods": [period] * 5}})
+        return httpx.Response(200, json={"features": alerts})
+
+    alerts = []
+
+    async def run():
+        tools.weather._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            forecasts = await get_forecasts([(39.7412, -105.0), (39.7389, -105.0), (40.0, -105.0), (38.0, -104.0)])
+            none = await get_alerts_for_states(["or", "CA", "NV", "CA"])
+            tools.weather._response_cache.clear()
+            alerts.extend({"properties": {"event": "Red Flag Warning", "areaDesc": f"Zone {i}"}} for i in range(60))
+            capped = await get_alerts_for_states(["CA", "NV", "OR"], fields=["event"], max_rows=10)
+        finally:
+            await close_http_client()
+        return forecasts, none, capped
+
+    forecasts, none, capped = asyncio.run(run())
+    tools.weather._response_cache.clear()
+
+    assert sum("/points/" in url for url in requests) == 3, "Expected nearby coordinates to share a /points lookup"
+    assert sum("/gridpoints/" in url for url in requests) == 2, "Expected one forecast request per gridpoint"
+    assert forecasts.startswith("39.7412,-105; 39.7389,-105; 40,-105:"), "Expected locations grouped by gridpoint"
+    assert forecasts.count("Tonight:") == 4, "Expected two periods per gridpoint"
+    assert requests[-2].endswith("/alerts/active?area=CA,NV,OR"), "Expected a single multi-area alerts request"
+    assert none == "No active alerts for CA, NV, OR.", "Expected the states to be reported"
+    assert len(capped.splitlines()) == 12, "Expected a header, 10 alerts and a truncation note"
+    assert capped.endswith("truncated after 10 alerts, narrow the query or raise max_rows."), "Expected a footer"
+
+
+if __name__ == "__main__":
+    test_http_client_is_shared()
+    test_points_url_rounds_coordinates()
+    test_make_nws_request_revalidates_with_etag()
+    test_make_nws_request_survives_an_unreachable_nws(pytest.MonkeyPatch())
+    test_get_alerts_renders_at_most_max_rows()
+    test_batch_tools_share_requests()
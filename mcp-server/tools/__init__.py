@@ -0,0 +1,7 @@
+"""
+Tool modules, one per provider, imported by main.py to register their tools.
+
+Importing a module must stay cheap, so the provider SDKs are imported inside
+the functions that use them and load on the first tool call. Imports needed
+only for type annotations go under TYPE_CHECKING.
+"""
@@ -1,29 +1,126 @@
+import functools
 import os
-from typing import Iterable
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Literal, Optional, Tuple, Type, TypeVar
+
+from common.disk_cache import cache_key, get_disk_cache
+from common.executor import submit_in_context
+from common.metrics import count_upstream_request
+from common.resilience import UpstreamErrors, call_with_retries
+from common.results import OutputFormat, render_records, select_columns
+from mcp_server import mcp, on_shutdown
+
+# For annotations only, the SDK is imported on first use (see tools/__init__.py).
+if TYPE_CHECKING:
+    from azure.core.credentials import AccessToken
+    from azure.identity import ClientSecretCredential
+    from azure.mgmt.costmanagement import CostManagementClient
+    from azure.mgmt.costmanagement.models import ForecastDefinition, ForecastResult
+    from azure.mgmt.resourcegraph import ResourceGraphClient
 
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.costmanagement import CostManagementClient
-from azure.mgmt.costmanagement.models import (
-    ForecastDefinition, ForecastDataset, ForecastAggregation, ForecastResult
-)
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.resource.resources.v2024_11_01.models import ResourceGroup
 
-from mcp_server import mcp
+@functools.lru_cache(maxsize=None)
+def _forecast_params(granularity: str = "Monthly") -> "ForecastDefinition":
+    from azure.mgmt.costmanagement.models import ForecastAggregation, ForecastDataset, ForecastDefinition
 
-_FORECAST_PARAMS = ForecastDefinition(
-    type="Usage",
-    timeframe="MonthToDate",
-    dataset=ForecastDataset(
-        granularity="Monthly",
-        aggregation={"totalCost": ForecastAggregation(name="Cost", function="Sum")}
+    return ForecastDefinition(
+        type="Usage",
+        timeframe="MonthToDate",
+        dataset=ForecastDataset(
+            granularity=granularity,
+            aggregation={"totalCost": ForecastAggregation(name="Cost", function="Sum")}
+        )
     )
+
+
+# Seconds before expiry at which a cached access token is considered stale.
+_TOKEN_REFRESH_MARGIN = float(os.getenv("AZURE_TOKEN_REFRESH_MARGIN", "300"))
+
+# The SDK defaults wait up to 300 s for a response. Retries are left to call_with_retries,
+# which honors the tool's deadline and the circuit breaker of each Azure service.
+_CONNECTION_TIMEOUT = float(os.getenv("AZURE_CONNECTION_TIMEOUT", "10"))
+_READ_TIMEOUT = float(os.getenv("AZURE_READ_TIMEOUT", "30"))
+
+# Rows per Resource Graph page (the service maximum is 1000).
+_GRAPH_PAGE_SIZE = int(os.getenv("AZURE_GRAPH_PAGE_SIZE", "1000"))
+_MAX_ROWS = int(os.getenv("AZURE_MAX_ROWS", "500"))
+
+# Cost Management throttles per tenant and per scope, so forecasts fan out over a small pool.
+_COST_CONCURRENCY = int(os.getenv("AZURE_COST_CONCURRENCY", "4"))
+_COST_MAX_RETRIES = int(os.getenv("AZURE_COST_MAX_RETRIES", "4"))
+_COST_DEFAULT_RETRY_AFTER = 5.0
+
+# Forecasts are recomputed upstream a few times a day, so they are kept in the on-disk cache.
+_FORECAST_TTL = float(os.getenv("AZURE_FORECAST_TTL", "21600"))
+
+# Headers Cost Management sets on 429 responses, in seconds.
+_COST_RETRY_AFTER_HEADERS = (
+    "x-ms-ratelimit-microsoft.costmanagement-qpu-retry-after",
+    "x-ms-ratelimit-microsoft.costmanagement-entity-retry-after",
+    "x-ms-ratelimit-microsoft.costmanagement-tenant-retry-after",
+    "x-ms-ratelimit-microsoft.costmanagement-clienttype-retry-after",
+    "Retry-After",
 )
 
+_ClientT = TypeVar("_ClientT")
+
+
+class PooledCredential:
+    """
+    Wraps a ClientSecretCredential so that every SDK client built on it shares
+    one token cache. Tokens are refreshed ahead of expiry instead of on the
+    first request that fails with an expired token.
+    """
+
+    def __init__(self, credential: "ClientSecretCredential", tenant_id: str):
+        self.tenant_id = tenant_id
+        self._credential = credential
+        self._tokens: Dict[Tuple[Any, ...], "AccessToken"] = {}
+        # One lock per (scopes, tenant), so a slow AAD refresh only blocks callers waiting for the same token.
+        self._refresh_locks: Dict[Tuple[Any, ...], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key: Tuple[Any, ...]) -> Optional["AccessToken"]:
+        with self._lock:
+            token = self._tokens.get(key)
+        if token is None or token.expires_on - time.time() < _TOKEN_REFRESH_MARGIN:
+            return None
+        return token
+
+    def get_token(self, *scopes: str, **kwargs: Any) -> "AccessToken":
+        # Claims challenges (CAE) must always go to AAD.
+        if kwargs.get("claims"):
+            return self._credential.get_token(*scopes, **kwargs)
+
+        key = (scopes, kwargs.get("tenant_id"))
+        token = self._cached(key)
+        if token is not None:
+            return token
+
+        with self._lock:
+            refresh_lock = self._refresh_locks.setdefault(key, threading.Lock())
+        with refresh_lock:
+            # Another thread may have refreshed the token while this one waited.
+            token = self._cached(key)
+            if token is None:
+                token = self._credential.get_token(*scopes, **kwargs)
+                with self._lock:
+                    self._tokens[key] = token
+        return token
+
+    def close(self) -> None:
+        self._credential.close()
+
 
-def get_azure_credentials():
-    """Get Azure credentials from environment variables."""
+_credential_pool: Dict[Tuple[str, str, str], PooledCredential] = {}
+_client_pool: Dict[Tuple[str, type], Any] = {}
+_pool_lock = threading.Lock()
+
+
+def get_azure_credentials() -> PooledCredential:
+    """Get the shared Azure credential for the service principal in the environment."""
     tenant_id = os.getenv("AZURE_TENANT_ID")
     client_id = os.getenv("AZURE_CLIENT_ID")
     client_secret = os.getenv("AZURE_CLIENT_SECRET")
@@ -31,89 +128,346 @@ def get_azure_credentials():
     if not all([tenant_id, client_id, client_secret]):
         raise ValueError("Please set AZURE_TENANT_ID, AZURE_CLIENT_ID, and AZURE_CLIENT_SECRET.")
 
-    return ClientSecretCredential(tenant_id, client_id, client_secret)
+    from azure.identity import ClientSecretCredential
+
+    key = (tenant_id, client_id, client_secret)
+    with _pool_lock:
+        credential = _credential_pool.get(key)
+        if credential is None:
+            credential = PooledCredential(ClientSecretCredential(tenant_id, client_id, client_secret), tenant_id)
+            _credential_pool[key] = credential
+    return credential
+
+
+def _count_request(request: Any) -> None:
+    count_upstream_request()
+
+
+def _get_pooled_client(client_type: Type[_ClientT], credential: PooledCredential) -> _ClientT:
+    """
+    Return the shared SDK client for (tenant, client type), creating it on first
+    use. Reusing the client keeps its HTTP session and connections alive.
+    """
+    key = (credential.tenant_id, client_type)
+    with _pool_lock:
+        client = _client_pool.get(key)
+        if client is None:
+            # The hook runs for every HTTP request the pipeline sends.
+            options: Dict[str, Any] = {
+                "raw_request_hook": _count_request,
+                "connection_timeout": _CONNECTION_TIMEOUT,
+                "read_timeout": _READ_TIMEOUT,
+                "retry_total": 0,
+            }
+            client = client_type(credential=credential, **options)
+            _client_pool[key] = client
+    return client
+
+
+@on_shutdown
+def close_azure_clients() -> None:
+    """Close every pooled Azure client and credential."""
+    with _pool_lock:
+        clients = list(_client_pool.values())
+        credentials = list(_credential_pool.values())
+        _client_pool.clear()
+        _credential_pool.clear()
+
+    for client in clients:
+        client.close()
+    for credential in credentials:
+        credential.close()
+
+
+def get_cost_management_client(credential: PooledCredential) -> "CostManagementClient":
+    """Get Azure Cost Management client. Queries are scope-addressed, so one client serves every subscription."""
+    from azure.mgmt.costmanagement import CostManagementClient
+
+    return _get_pooled_client(CostManagementClient, credential)
+
+
+def _retry_after(headers: Any) -> float:
+    """Seconds to wait before retrying a throttled Cost Management request."""
+    delays = []
+    for header in _COST_RETRY_AFTER_HEADERS:
+        try:
+            delays.append(float(headers.get(header)))
+        except (TypeError, ValueError):
+            continue
+    return max(delays, default=_COST_DEFAULT_RETRY_AFTER)
+
+
+def _status(error: Exception) -> Optional[int]:
+    from azure.core.exceptions import HttpResponseError
+
+    return error.status_code if isinstance(error, HttpResponseError) else None
 
 
-def get_cost_management_client(
-        credential: ClientSecretCredential,
-        subscription_id: str
-) -> CostManagementClient:
-    """Get Azure Cost Management client."""
-    return CostManagementClient(credential=credential, subscription_id=subscription_id)
+def _transport_errors() -> Tuple[type, ...]:
+    from azure.core.exceptions import ServiceRequestError, ServiceResponseError
 
+    return ServiceRequestError, ServiceResponseError
 
-def get_resource_management_client(
-        credential: ClientSecretCredential,
-        subscription_id: str
-) -> ResourceManagementClient:
-    """Get Azure Resource Management client."""
-    return ResourceManagementClient(credential=credential, subscription_id=subscription_id)
 
+def _throttled_retry_after(error: Exception) -> Optional[float]:
+    """The delay a 429 asks for, None for other errors so they back off with jitter."""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    return _retry_after(response.headers if response is not None else {})
 
-def get_compute_management_client(
-        credential: ClientSecretCredential,
-        subscription_id: str
-) -> ComputeManagementClient:
-    """Get Azure Compute Management client."""
-    return ComputeManagementClient(credential=credential, subscription_id=subscription_id)
 
+_ERRORS = UpstreamErrors(_status, _transport_errors, _throttled_retry_after)
 
-@mcp.tool(description="Get Azure forecast for the current subscription.")
-def get_azure_forecast() -> str:
-    cred = get_azure_credentials()
-    subscription_id = os.getenv("AZURE_SUBSCRIPTION_ID")
-    cost_management_client: CostManagementClient = get_cost_management_client(cred, subscription_id)
 
-    if not subscription_id:
-        return "❌ AZURE_SUBSCRIPTION_ID is not set."
+def forecast_scope(scope: str, granularity: str = "Monthly") -> "ForecastResult":
+    """
+    Forecast the cost of one Cost Management scope. Throttled (429) requests are
+    retried after the delay the service asks for in its x-ms-ratelimit headers.
+    """
+    client = get_cost_management_client(get_azure_credentials())
+    return call_with_retries(
+        "azure_cost_management",
+        lambda: client.forecast.usage(scope, _forecast_params(granularity)),
+        _ERRORS,
+        _COST_MAX_RETRIES,
+    )
+
+
+def _forecast_records(scope: str, granularity: str, force_refresh: bool = False) -> List[Dict[str, Any]]:
+    """Forecast rows of one scope as column -> value records, served from the on-disk cache."""
+
+    def fetch() -> List[Dict[str, Any]]:
+        result = forecast_scope(scope, granularity)
+        columns = [column.name for column in result.columns or []]
+        return [dict(zip(columns, row)) for row in result.rows or []]
+
+    key = cache_key("azure", "forecast", scope, granularity)
+    return get_disk_cache().get_or_fetch(key, fetch, _FORECAST_TTL, force_refresh=force_refresh)
 
-    scope = f"/subscriptions/{subscription_id}"
+
+def _format_usage_date(value: Any) -> str:
+    # UsageDate comes back as a yyyymmdd number.
+    value = str(value or "")
+    if len(value) >= 8 and value[:8].isdigit():
+        return f"{value[:4]}-{value[4:6]}-{value[6:8]}"
+    return value
+
+
+_FORECAST_COLUMNS = ["scope", "date", "status", "cost", "currency"]
+
+
+@mcp.tool(
+    description="Get the Azure cost forecast for the current month across the configured subscriptions, a given "
+                "list of subscriptions, or a management group / billing scope (e.g. "
+                "/providers/Microsoft.Management/managementGroups/<id>). Granularity is Daily or Monthly; "
+                "group_by=subscription lists each scope, group_by=total sums them. Forecasts are cached for "
+                "a few hours, set force_refresh to query Azure again."
+)
+def get_azure_forecast(
+        subscriptions: Optional[List[str]] = None,
+        scope: Optional[str] = None,
+        granularity: Literal["Daily", "Monthly"] = "Monthly",
+        group_by: Literal["subscription", "total"] = "subscription",
+        force_refresh: bool = False,
+        output_format: OutputFormat = "text"
+) -> str:
+    if scope:
+        scopes = {scope.rstrip("/").rsplit("/", 1)[-1]: scope}
+    else:
+        subscription_ids = subscriptions or default_subscriptions()
+        if not subscription_ids:
+            return "❌ AZURE_SUBSCRIPTION_ID is not set."
+        scopes = {subscription_id: f"/subscriptions/{subscription_id}" for subscription_id in subscription_ids}
 
     try:
-        result: ForecastResult = cost_management_client.forecast.usage(scope, _FORECAST_PARAMS)
+        get_azure_credentials()
     except Exception as e:
         return f"Could not retrieve forecast. Please check your Azure credentials, {e}."
 
-    response_string = ""
-    for row in result.rows:
-        response_string += f"{row}\n"
+    records: List[Tuple[str, Dict[str, Any]]] = []
+    errors: List[str] = []
+    with ThreadPoolExecutor(max_workers=max(1, min(_COST_CONCURRENCY, len(scopes)))) as executor:
+        futures = {
+            label: submit_in_context(executor, _forecast_records, path, granularity, force_refresh)
+            for label, path in scopes.items()
+        }
+        for label, future in futures.items():
+            try:
+                records.extend((label, record) for record in future.result())
+            except Exception as e:
+                errors.append(f"{label}: could not retrieve forecast, {e}")
+
+    # The forecast API has no grouping, so totals are summed here.
+    totals: Dict[Tuple[str, str, str, str], float] = {}
+    for label, record in records:
+        key = (
+            label if group_by == "subscription" else "total",
+            _format_usage_date(record.get("UsageDate")),
+            str(record.get("CostStatus") or ""),
+            str(record.get("Currency") or ""),
+        )
+        totals[key] = totals.get(key, 0.0) + float(record.get("Cost") or 0)
+
+    if not totals:
+        if errors:
+            return "Could not retrieve forecast. Please check your Azure credentials.\n" + "\n".join(errors)
+        return "No forecast data found."
+
+    rows = (
+        {"scope": label, "date": date, "status": status, "cost": round(cost, 2), "currency": currency}
+        for (label, date, status, currency), cost in sorted(totals.items())
+    )
+    return "\n".join([render_records(rows, _FORECAST_COLUMNS, output_format=output_format), *errors])
+
+
+def get_resource_graph_client(credential: PooledCredential) -> "ResourceGraphClient":
+    """Get Azure Resource Graph client. Subscriptions are chosen per query, so one client serves them all."""
+    from azure.mgmt.resourcegraph import ResourceGraphClient
+
+    return _get_pooled_client(ResourceGraphClient, credential)
 
-    return response_string
+
+def default_subscriptions() -> Optional[List[str]]:
+    """
+    Subscriptions to query when a tool is not given any: AZURE_SUBSCRIPTION_IDS
+    (comma-separated), else AZURE_SUBSCRIPTION_ID. None means every subscription
+    the service principal can read.
+    """
+    subscriptions = os.getenv("AZURE_SUBSCRIPTION_IDS") or os.getenv("AZURE_SUBSCRIPTION_ID")
+    if not subscriptions:
+        return None
+    return [subscription.strip() for subscription in subscriptions.split(",") if subscription.strip()]
+
+
+def kql_string(value: str) -> str:
+    """Quote a value as a KQL string literal."""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def query_resource_graph(
+        query: str,
+        subscriptions: Optional[List[str]] = None,
+        management_group: Optional[str] = None,
+        max_rows: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Run a KQL query over Azure Resource Graph and yield result rows, following
+    skip tokens. One query spans every requested subscription.
+    """
+    from azure.mgmt.resourcegraph.models import QueryRequest, QueryRequestOptions
+
+    if max_rows is not None and max_rows < 1:
+        raise ValueError("max_rows must be at least 1.")
+
+    client = get_resource_graph_client(get_azure_credentials())
+    if management_group:
+        scope = {"management_groups": [management_group]}
+    elif subscriptions:
+        scope = {"subscriptions": subscriptions}
+    else:
+        scope = {}
+
+    skip_token = None
+    returned = 0
+    while True:
+        page_size = _GRAPH_PAGE_SIZE if max_rows is None else min(_GRAPH_PAGE_SIZE, max_rows - returned)
+        request = QueryRequest(
+            query=query,
+            options=QueryRequestOptions(skip_token=skip_token, top=page_size, result_format="objectArray"),
+            **scope,
+        )
+        response = call_with_retries("azure_resource_graph", functools.partial(client.resources, request), _ERRORS)
+        for row in response.data:
+            yield row
+        returned += response.count
+        skip_token = response.skip_token
+        if not skip_token or (max_rows is not None and returned >= max_rows):
+            return
+
+
+_RESOURCE_GROUP_COLUMNS = ["name", "location", "subscriptionId"]
+_VIRTUAL_MACHINE_COLUMNS = ["name", "resourceGroup", "location", "size", "powerState", "subscriptionId"]
 
 
 @mcp.tool(
-    description="List all Azure resource groups in the current subscription."
+    description="List Azure resource groups (name, location, subscription) across the configured subscriptions, "
+                "a given list of subscriptions or a management group. Optionally filter by location and "
+                "return only the given fields."
 )
-def get_azure_resource_groups():
-    cred = get_azure_credentials()
-    subscription_id = os.getenv("AZURE_SUBSCRIPTION_ID")
-    resource_management_client: ResourceManagementClient = get_resource_management_client(cred, subscription_id)
+def get_azure_resource_groups(
+        subscriptions: Optional[List[str]] = None,
+        management_group: Optional[str] = None,
+        location: Optional[str] = None,
+        max_rows: int = _MAX_ROWS,
+        fields: Optional[List[str]] = None,
+        output_format: OutputFormat = "text"
+):
+    try:
+        columns = select_columns(_RESOURCE_GROUP_COLUMNS, fields)
+    except ValueError as e:
+        return str(e)
+    if max_rows < 1:
+        return "max_rows must be at least 1."
+
+    query = ["ResourceContainers", "| where type =~ 'microsoft.resources/subscriptions/resourcegroups'"]
+    if location:
+        query.append(f"| where location =~ {kql_string(location)}")
+    query.append(f"| project {', '.join(columns)}")
+    query.append("| order by name asc" if "name" in columns else f"| order by {columns[0]} asc")
 
     try:
-        resource_groups: Iterable[ResourceGroup] = resource_management_client.resource_groups.list()
+        rows = query_resource_graph("\n".join(query), subscriptions or default_subscriptions(), management_group,
+                                    max_rows + 1)
+        return render_records(rows, columns, max_rows=max_rows, output_format=output_format,
+                              empty_message="No resource groups found.")
     except Exception as e:
         return f"Could not retrieve resource groups. Please check your Azure credentials, {e}."
 
-    response_string: str = ""
-    for resource_group in resource_groups:
-        response_string += f"{resource_group.name}\n"
-
-    return response_string
 
+@mcp.tool(
+    description="List Azure virtual machines (name, resource group, location, size, power state, subscription) "
+                "across the configured subscriptions, a given list of subscriptions or a management group. "
+                "Optionally filter by resource group, location or power state (e.g. running, deallocated) and "
+                "return only the given fields."
+)
+def get_azure_virtual_machines(
+        subscriptions: Optional[List[str]] = None,
+        management_group: Optional[str] = None,
+        resource_group: Optional[str] = None,
+        location: Optional[str] = None,
+        power_state: Optional[str] = None,
+        max_rows: int = _MAX_ROWS,
+        fields: Optional[List[str]] = None,
+        output_format: OutputFormat = "text"
+):
+    try:
+        columns = select_columns(_VIRTUAL_MACHINE_COLUMNS, fields)
+    except ValueError as e:
+        return str(e)
+    if max_rows < 1:
+        return "max_rows must be at least 1."
 
-@mcp.tool()
-def get_azure_virtual_machines():
-    cred = get_azure_credentials()
-    subscription_id = os.getenv("AZURE_SUBSCRIPTION_ID")
-    compute_management_client: ComputeManagementClient = get_compute_management_client(cred, subscription_id)
+    query = [
+        "Resources",
+        "| where type =~ 'microsoft.compute/virtualmachines'",
+        "| extend size = tostring(properties.hardwareProfile.vmSize),",
+        "         powerState = tostring(split(tostring(properties.extended.instanceView.powerState.code), '/')[1])",
+    ]
+    if resource_group:
+        query.append(f"| where resourceGroup =~ {kql_string(resource_group)}")
+    if location:
+        query.append(f"| where location =~ {kql_string(location)}")
+    if power_state:
+        query.append(f"| where powerState =~ {kql_string(power_state)}")
+    # Only the selected columns are returned by Resource Graph.
+    query.append(f"| project {', '.join(columns)}")
+    query.append("| order by name asc" if "name" in columns else f"| order by {columns[0]} asc")
 
     try:
-        virtual_machines = compute_management_client.virtual_machines.list_all()
+        rows = query_resource_graph("\n".join(query), subscriptions or default_subscriptions(), management_group,
+                                    max_rows + 1)
+        return render_records(rows, columns, max_rows=max_rows, output_format=output_format,
+                              empty_message="No virtual machines found.")
     except Exception as e:
         return f"Could not retrieve virtual machines. Please check your Azure credentials, {e}."
-
-    response_string: str = ""
-    for vm in virtual_machines:
-        response_string += f"{vm.name}\n"
-
-    return response_string
@@ -1,45 +1,216 @@
+import itertools
+import logging
 import os
-from typing import List, Union, Dict
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, List, Literal, Optional, Tuple, TypeVar, Union, Dict
 
-from google.cloud.billing import CloudBillingClient
-from google.cloud.billing.budgets import BudgetServiceClient
-from google.cloud.billing_v1 import ProjectBillingInfo
-from google.oauth2 import service_account
-from googleapiclient import discovery
+from common.cache import TTLCache
+from common.disk_cache import cache_key, get_disk_cache
+from common.executor import submit_in_context
+from common.metrics import count_upstream_request
+from common.resilience import UpstreamErrors, call_with_retries, remaining, request_timeout
+from common.results import OutputFormat, render_records
+from mcp_server import mcp, on_shutdown
 
-from mcp_server import mcp
+# For annotations only, the SDK is imported on first use (see tools/__init__.py).
+if TYPE_CHECKING:
+    from google.cloud import bigquery
+    from google.cloud.billing import BillingAccount, CloudBillingClient
+    from google.cloud.billing.budgets import Budget, BudgetServiceClient
+    from google.cloud.billing_v1 import ProjectBillingInfo
 
+logger = logging.getLogger(__name__)
 
-def enable_api_via_discovery(api_service: str):
+T = TypeVar("T")
+
+_CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+
+# Project -> billing account assignments rarely change, so lookups are memoized in memory.
+_BILLING_INFO_TTL = float(os.getenv("GCP_BILLING_INFO_TTL", "3600"))
+_BILLING_INFO_CACHE_SIZE = int(os.getenv("GCP_BILLING_INFO_CACHE_SIZE", "1024"))
+
+# Billing accounts scanned at once by get_gcp_billing_scan, and the page size of its listings.
+_SCAN_CONCURRENCY = int(os.getenv("GCP_SCAN_CONCURRENCY", "8"))
+_SCAN_PAGE_SIZE = int(os.getenv("GCP_SCAN_PAGE_SIZE", "100"))
+_MAX_ROWS = int(os.getenv("GCP_MAX_ROWS", "500"))
+
+_TABLE_NAME = re.compile(r"^[\w-]+\.\w+\.\w+$")
+
+# Budgets change rarely, so they are kept in the on-disk cache.
+_BUDGET_TTL = float(os.getenv("GCP_BUDGET_TTL", "21600"))
+
+# Upper bound for one API request; the client library default is 60 s.
+_REQUEST_TIMEOUT = float(os.getenv("GCP_REQUEST_TIMEOUT", "20"))
+
+
+def _status(error: Exception) -> Optional[int]:
+    from google.api_core.exceptions import GoogleAPICallError
+
+    return error.code if isinstance(error, GoogleAPICallError) else None
+
+
+def _transport_errors() -> Tuple[type, ...]:
+    from google.auth.exceptions import TransportError
+
+    return (TransportError,)
+
+
+_ERRORS = UpstreamErrors(_status, _transport_errors)
+
+
+def gcp_call(service: str, method: Callable[..., T], **kwargs: Any) -> T:
     """
-    Enables the given API (e.g. "cloudbilling.googleapis.com" or "billingbudgets.googleapis.com")
-    for the specified GCP project.
+    Call a GCP client method with an explicit timeout, retried and guarded by the
+    circuit breaker of the service, e.g. gcp_billing. The client library's own
+    retries are turned off, so attempts are not multiplied and stay within the
+    tool's deadline.
+    """
+    return call_with_retries(
+        service, lambda: method(retry=None, timeout=request_timeout(_REQUEST_TIMEOUT), **kwargs), _ERRORS
+    )
+
+
+class GcpContext:
+    """
+    Credentials, SDK clients and lookups shared by every GCP tool call for one
+    service account key file. The key file is parsed once and the scoped
+    credential refreshes its own token; the clients keep their gRPC channels open.
     """
-    creds = _get_gcp_credentials()
-    svc = discovery.build("serviceusage", "v1", credentials=creds)
-    name = f"projects/{os.getenv("GCP_PROJECT_ID")}/services/{api_service}"
-    resp = svc.services().enable(name=name).execute()
-    print(f"Enabled {api_service} → operation: {resp.get('name')}")
-    return resp
 
+    def __init__(self, keyfile: str):
+        from google.oauth2 import service_account
 
-def _get_gcp_credentials():
+        self.keyfile = keyfile
+        # Scoping up front lets every client share this credential and its token instead of a scoped copy.
+        self.credentials = service_account.Credentials.from_service_account_file(keyfile, scopes=[_CLOUD_PLATFORM_SCOPE])
+        self._billing_client: Optional["CloudBillingClient"] = None
+        self._budget_client: Optional["BudgetServiceClient"] = None
+        self._bigquery_client: Optional["bigquery.Client"] = None
+        self._service_usage = None
+        self._billing_info: TTLCache[str, "ProjectBillingInfo"] = TTLCache(maxsize=_BILLING_INFO_CACHE_SIZE)
+        self._lock = threading.Lock()
+
+    @property
+    def billing_client(self) -> "CloudBillingClient":
+        with self._lock:
+            if self._billing_client is None:
+                from google.cloud.billing import CloudBillingClient
+
+                self._billing_client = CloudBillingClient(credentials=self.credentials)
+            return self._billing_client
+
+    @property
+    def budget_client(self) -> "BudgetServiceClient":
+        with self._lock:
+            if self._budget_client is None:
+                from google.cloud.billing.budgets import BudgetServiceClient
+
+                self._budget_client = BudgetServiceClient(credentials=self.credentials)
+            return self._budget_client
+
+    def project_billing_info(self, project_id: str, refresh: bool = False) -> "ProjectBillingInfo":
+        """Billing info of a project, memoized for GCP_BILLING_INFO_TTL seconds."""
+        info = None if refresh else self._billing_info.get(project_id)
+        if info is None:
+            count_upstream_request()
+            info = gcp_call(
+                "gcp_billing", self.billing_client.get_project_billing_info, name=f"projects/{project_id}"
+            )
+            self._billing_info.set(project_id, info, ttl=_BILLING_INFO_TTL)
+        return info
+
+    def remember_billing_info(self, project_id: str, info: "ProjectBillingInfo") -> None:
+        """Memoize billing info obtained from a listing, e.g. while scanning a billing account."""
+        self._billing_info.set(project_id, info, ttl=_BILLING_INFO_TTL)
+
+    def billing_account_id(self, project_id: str) -> Optional[str]:
+        """ID of the billing account a project is attached to, None if it has none."""
+        info = self.project_billing_info(project_id)
+        return info.billing_account_name.split("/")[-1] if info.billing_account_name else None
+
+    @property
+    def bigquery_client(self) -> "bigquery.Client":
+        with self._lock:
+            if self._bigquery_client is None:
+                from google.cloud import bigquery
+
+                project = os.getenv("GCP_PROJECT_ID") or getattr(self.credentials, "project_id", None)
+                self._bigquery_client = bigquery.Client(project=project, credentials=self.credentials)
+            return self._bigquery_client
+
+    def enable_service(self, project_id: str, api_service: str) -> Dict[str, Any]:
+        with self._lock:
+            if self._service_usage is None:
+                from googleapiclient import discovery
+
+                # The discovery document bundled with the client library, no network round trip.
+                self._service_usage = discovery.build(
+                    "serviceusage", "v1", credentials=self.credentials, static_discovery=True, cache_discovery=False
+                )
+            # Discovery-based clients are not thread-safe, so requests are made under the lock.
+            name = f"projects/{project_id}/services/{api_service}"
+            count_upstream_request()
+            return self._service_usage.services().enable(name=name).execute()
+
+    def close(self) -> None:
+        for client in (self._billing_client, self._budget_client):
+            if client is not None:
+                client.transport.close()
+        if self._bigquery_client is not None:
+            self._bigquery_client.close()
+        if self._service_usage is not None:
+            self._service_usage.close()
+
+
+_contexts: Dict[str, GcpContext] = {}
+_contexts_lock = threading.Lock()
+
+
+def get_gcp_context() -> GcpContext:
+    """Get the shared GCP context for the service account in GOOGLE_APPLICATION_CREDENTIALS."""
     keyfile = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     if not keyfile:
         raise ValueError("Please set GOOGLE_APPLICATION_CREDENTIALS to your service account JSON path.")
-    return service_account.Credentials.from_service_account_file(keyfile)
+
+    with _contexts_lock:
+        context = _contexts.get(keyfile)
+        if context is None:
+            context = GcpContext(keyfile)
+            _contexts[keyfile] = context
+        return context
+
+
+@on_shutdown
+def close_gcp_contexts() -> None:
+    """Close every pooled GCP client."""
+    with _contexts_lock:
+        contexts = list(_contexts.values())
+        _contexts.clear()
+
+    for context in contexts:
+        context.close()
+
+
+def enable_api_via_discovery(api_service: str):
+    """
+    Enables the given API (e.g. "cloudbilling.googleapis.com" or "billingbudgets.googleapis.com")
+    for the specified GCP project.
+    """
+    resp = get_gcp_context().enable_service(os.getenv("GCP_PROJECT_ID"), api_service)
+    logger.info("Enabled %s → operation: %s", api_service, resp.get("name"))
+    return resp
 
 
 @mcp.tool(description="List all GCP Cloud Billing account IDs accessible by this service account.")
 def get_gcp_billing_accounts() -> List[str]:
-    creds = _get_gcp_credentials()
     project_id = os.getenv("GCP_PROJECT_ID")
     if not project_id:
         return {"error": "Please set GCP_PROJECT_ID"}
 
-    client = CloudBillingClient(credentials=creds)
     try:
-        info: ProjectBillingInfo = client.get_project_billing_info(name=f"projects/{project_id}")
+        info = get_gcp_context().project_billing_info(project_id)
     except Exception as e:
         return {"error": str(e)}
 
@@ -50,40 +221,232 @@ def get_gcp_billing_accounts() -> List[str]:
     }
 
 
-@mcp.tool(description="List your GCP Budgets (i.e. your planned/forecast thresholds) for the current project.")
-def get_gcp_forecast() -> Union[List[str], Dict[str, str]]:
+def _list_budget_lines(project_id: str) -> List[str]:
+    """Budgets of the billing account the project is attached to, one "name: amount" line each."""
+    context = get_gcp_context()
+    try:
+        billing_acct_id = context.billing_account_id(project_id)
+    except Exception as e:
+        raise ValueError(f"Could not fetch project billing info: {e}")
+
+    if not billing_acct_id:
+        raise ValueError(f"Project {project_id} has no billing account attached.")
+
+    parent = f"billingAccounts/{billing_acct_id}"
+    count_upstream_request()
+    try:
+        pager = gcp_call("gcp_budgets", context.budget_client.list_budgets, parent=parent)
+    except Exception as e:
+        raise ValueError(f"Could not list budgets for {parent}: {e}")
+
+    return [f"{b.display_name or '<unnamed>'}: {_budget_amount(b)}" for b in pager]
+
+
+def _budget_amount(budget: "Budget") -> str:
+    if budget.amount_spec and budget.amount_spec.budget_amount:
+        micros = budget.amount_spec.budget_amount.fixed_amount.micro_amount
+        return f"${micros / 1_000_000:,.2f}"
+    return "[no fixed amount]"
+
+
+@mcp.tool(
+    description="List your GCP Budgets (i.e. your planned/forecast thresholds) for the current project. "
+                "Budgets are cached for a few hours, set force_refresh to query GCP again."
+)
+def get_gcp_forecast(force_refresh: bool = False) -> Union[List[str], Dict[str, str]]:
     project_id = os.getenv("GCP_PROJECT_ID")
     if not project_id:
         return {"error": "Please set GCP_PROJECT_ID to your GCP project ID."}
 
-    creds = _get_gcp_credentials()
+    try:
+        return get_disk_cache().get_or_fetch(
+            cache_key("gcp", "budgets", project_id),
+            lambda: _list_budget_lines(project_id),
+            _BUDGET_TTL,
+            force_refresh=force_refresh,
+        )
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def _row_count(rows: List[Dict[str, Any]], max_rows: int) -> Union[int, str]:
+    return f">{max_rows}" if len(rows) > max_rows else len(rows)
+
 
-    billing_client = CloudBillingClient(credentials=creds)
+def _scan_billing_account(
+        account: "BillingAccount",
+        include_projects: bool,
+        include_budgets: bool,
+        max_rows: int
+) -> Dict[str, Any]:
+    """
+    Projects and budgets of one billing account. Pagers are consumed lazily and stop
+    after max_rows, so larger counts are reported as ">max_rows".
+    """
+    context = get_gcp_context()
+    account_id = account.name.split("/")[-1]
+    projects: List[Dict[str, Any]] = []
+    budgets: List[Dict[str, Any]] = []
+    errors: List[str] = []
+
+    if include_projects:
+        count_upstream_request()
+        try:
+            pager = gcp_call(
+                "gcp_billing", context.billing_client.list_project_billing_info,
+                request={"name": account.name, "page_size": _SCAN_PAGE_SIZE},
+            )
+            for info in itertools.islice(pager, max_rows + 1):
+                context.remember_billing_info(info.project_id, info)
+                projects.append(
+                    {"project": info.project_id, "billing_account": account_id, "billing_enabled": info.billing_enabled}
+                )
+        except Exception as e:
+            errors.append(f"{account_id}: could not list projects, {e}")
+
+    if include_budgets:
+        count_upstream_request()
+        try:
+            pager = gcp_call("gcp_budgets", context.budget_client.list_budgets,
+                             request={"parent": account.name, "page_size": _SCAN_PAGE_SIZE})
+            for budget in itertools.islice(pager, max_rows + 1):
+                budgets.append(
+                    {"budget": budget.display_name or "<unnamed>", "billing_account": account_id,
+                     "amount": _budget_amount(budget)}
+                )
+        except Exception as e:
+            errors.append(f"{account_id}: could not list budgets, {e}")
+
+    return {
+        "account": {
+            "billing_account": account_id,
+            "name": account.display_name,
+            "open": account.open_,
+            "projects": _row_count(projects, max_rows),
+            "budgets": _row_count(budgets, max_rows),
+        },
+        "projects": projects,
+        "budgets": budgets,
+        "errors": errors,
+    }
+
+
+@mcp.tool(
+    description="Scan every GCP billing account visible to the service account (or the given billing account IDs) "
+                "and list their linked projects with billing status and their budgets."
+)
+def get_gcp_billing_scan(
+        billing_accounts: Optional[List[str]] = None,
+        include_projects: bool = True,
+        include_budgets: bool = True,
+        max_rows: int = _MAX_ROWS,
+        output_format: OutputFormat = "text"
+) -> str:
     try:
-        pb_info = billing_client.get_project_billing_info(name=f"projects/{project_id}")
+        context = get_gcp_context()
+        if billing_accounts:
+            count_upstream_request(len(billing_accounts))
+            with ThreadPoolExecutor(max_workers=max(1, min(_SCAN_CONCURRENCY, len(billing_accounts)))) as executor:
+                futures = [
+                    submit_in_context(executor, gcp_call, "gcp_billing", context.billing_client.get_billing_account,
+                                      name=f"billingAccounts/{account_id.split('/')[-1]}")
+                    for account_id in billing_accounts
+                ]
+                accounts = [future.result() for future in futures]
+        else:
+            count_upstream_request()
+            accounts = list(
+                gcp_call("gcp_billing", context.billing_client.list_billing_accounts,
+                         request={"page_size": _SCAN_PAGE_SIZE})
+            )
     except Exception as e:
-        return {"error": f"Could not fetch project billing info: {e}"}
+        return f"Could not list billing accounts. Please check your GCP credentials, {e}."
 
-    if not pb_info.billing_account_name:
-        return {"error": f"Project {project_id} has no billing account attached."}
+    if not accounts:
+        return "No billing accounts found."
 
-    billing_acct_id = pb_info.billing_account_name.split("/")[-1]
+    with ThreadPoolExecutor(max_workers=max(1, min(_SCAN_CONCURRENCY, len(accounts)))) as executor:
+        futures = [
+            submit_in_context(executor, _scan_billing_account, account, include_projects, include_budgets, max_rows)
+            for account in accounts
+        ]
+        results = [future.result() for future in futures]
+
+    sections = [render_records(
+        (result["account"] for result in results), _ACCOUNT_COLUMNS, max_rows=max_rows, output_format=output_format
+    )]
+    if include_projects:
+        projects = sorted((row for result in results for row in result["projects"]), key=lambda row: row["project"])
+        sections.append(render_records(projects, _PROJECT_COLUMNS, max_rows=max_rows, output_format=output_format,
+                                       empty_message="No projects found."))
+    if include_budgets:
+        budgets = (row for result in results for row in result["budgets"])
+        sections.append(render_records(budgets, _BUDGET_COLUMNS, max_rows=max_rows, output_format=output_format,
+                                       empty_message="No budgets found."))
+    errors = [error for result in results for error in result["errors"]]
+    return "\n\n".join(sections) + "".join(f"\n{error}" for error in errors)
+
+
+_ACCOUNT_COLUMNS = ["billing_account", "name", "open", "projects", "budgets"]
+_PROJECT_COLUMNS = ["project", "billing_account", "billing_enabled"]
+_BUDGET_COLUMNS = ["budget", "billing_account", "amount"]
+
+_SPEND_GROUPS = {"project": "project.id", "service": "service.description"}
+
+
+@mcp.tool(
+    description="Actual GCP spend (cost after credits) over the last N days from the BigQuery billing export, "
+                "grouped by project or service. Needs google-cloud-bigquery and GCP_BILLING_EXPORT_TABLE "
+                "(project.dataset.table) or the table argument."
+)
+def get_gcp_actual_spend(
+        days: int = 30,
+        group_by: Literal["project", "service"] = "project",
+        table: Optional[str] = None,
+        max_rows: int = _MAX_ROWS,
+        output_format: OutputFormat = "text"
+) -> str:
+    table = table or os.getenv("GCP_BILLING_EXPORT_TABLE")
+    if not table:
+        return "❌ Please set GCP_BILLING_EXPORT_TABLE to the billing export table (project.dataset.table)."
+    if not _TABLE_NAME.match(table):
+        return f"❌ {table!r} is not a project.dataset.table name."
 
-    budget_client = BudgetServiceClient(credentials=creds)
-    parent = f"billingAccounts/{billing_acct_id}"
     try:
-        pager = budget_client.list_budgets(parent=parent)
+        from google.cloud import bigquery
+    except ImportError:
+        return "❌ The BigQuery billing export needs the google-cloud-bigquery package."
+
+    query = f"""
+        SELECT {_SPEND_GROUPS[group_by]} AS name, currency,
+               SUM(cost) + SUM(IFNULL((SELECT SUM(c.amount) FROM UNNEST(credits) AS c), 0)) AS cost
+        FROM `{table}`
+        WHERE usage_start_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+        GROUP BY name, currency
+        ORDER BY cost DESC
+        LIMIT @limit
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("days", "INT64", days),
+        bigquery.ScalarQueryParameter("limit", "INT64", max_rows + 1),
+    ])
+
+    client = get_gcp_context().bigquery_client
+
+    def run_query() -> List[Any]:
+        # A query job may legitimately run for a while, so it gets whatever is left of the tool's deadline.
+        job = client.query(query, job_config=job_config, timeout=request_timeout(_REQUEST_TIMEOUT))
+        return list(job.result(timeout=remaining()))
+
+    count_upstream_request()
+    try:
+        rows = call_with_retries("gcp_bigquery", run_query, _ERRORS)
     except Exception as e:
-        return {"error": f"Could not list budgets for {parent}: {e}"}
-
-    lines: List[str] = []
-    for b in pager:
-        display = b.display_name or "<unnamed>"
-        amt = "[no fixed amount]"
-        if b.amount_spec and b.amount_spec.budget_amount:
-            micros = b.amount_spec.budget_amount.fixed_amount.micro_amount
-            dollars = micros / 1_000_000
-            amt = f"${dollars:,.2f}"
-        lines.append(f"{display}: {amt}")
-
-    return lines
+        return f"Could not query the billing export. Please check your GCP credentials, {e}."
+
+    spend = (
+        {group_by: row["name"] or "<none>", "cost": round(row["cost"], 2), "currency": row["currency"]}
+        for row in rows
+    )
+    return render_records(spend, [group_by, "cost", "currency"], max_rows=max_rows, output_format=output_format,
+                          empty_message="No spend found.")
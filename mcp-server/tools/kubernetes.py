@@ -1,28 +1,380 @@
-from kubernetes import client, config
-from kubernetes.client import V1Pod, V1Service
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from mcp_server import mcp
+from common.metrics import count_upstream_request
+from common.resilience import UpstreamErrors, call_with_retries, request_timeout
+from common.results import OutputFormat, render_records, select_columns
+from mcp_server import mcp, on_shutdown
 
+# For annotations only, the SDK is imported on first use (see tools/__init__.py).
+if TYPE_CHECKING:
+    from kubernetes import client, watch
 
-def get_client_api() -> client.CoreV1Api:
-    """Get Kubernetes API client."""
-    config.load_kube_config()
-    return client.CoreV1Api()
+logger = logging.getLogger(__name__)
 
+_INFORMER_ENABLED = os.getenv("K8S_POD_INFORMER", "true").lower() in ("1", "true", "yes")
+_WATCH_TIMEOUT = int(os.getenv("K8S_WATCH_TIMEOUT", "300"))
+_LIST_PAGE_SIZE = int(os.getenv("K8S_LIST_PAGE_SIZE", "500"))
+_MAX_ROWS = int(os.getenv("K8S_MAX_ROWS", "200"))
+# Upper bound for one list request, the client waits indefinitely by default.
+_REQUEST_TIMEOUT = float(os.getenv("K8S_REQUEST_TIMEOUT", "30"))
+
+_HTTP_GONE = 410
+
+_core_api: Optional["client.CoreV1Api"] = None
+_api_lock = threading.Lock()
+
+PodMatcher = Callable[["PodSummary"], bool]
+
+
+def get_client_api() -> "client.CoreV1Api":
+    """Get Kubernetes API client. The kubeconfig is loaded once and the client reused."""
+    from kubernetes import client, config
+
+    global _core_api
+    with _api_lock:
+        if _core_api is None:
+            config.load_kube_config()
+            _core_api = client.CoreV1Api()
+    return _core_api
+
+
+@dataclass
+class PodSummary:
+    """The handful of pod fields the tools report, instead of the full V1Pod."""
+    name: str
+    namespace: str
+    ip: str
+    phase: str
+    node: str
+    labels: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_raw(cls, pod: Dict[str, Any]) -> "PodSummary":
+        """Project a pod as returned by the API server (camelCase JSON)."""
+        metadata = pod.get("metadata") or {}
+        spec = pod.get("spec") or {}
+        status = pod.get("status") or {}
+        return cls(
+            name=metadata.get("name", ""),
+            namespace=metadata.get("namespace", ""),
+            ip=status.get("podIP") or "",
+            phase=status.get("phase") or "",
+            node=spec.get("nodeName") or "",
+            labels=metadata.get("labels") or {},
+        )
+
+
+POD_COLUMNS = ["namespace", "name", "ip", "phase", "node"]
+
+# Pod fields the API server accepts in field selectors, mapped to their PodSummary attribute.
+_POD_FIELDS = {
+    "metadata.name": "name",
+    "metadata.namespace": "namespace",
+    "status.podIP": "ip",
+    "status.phase": "phase",
+    "spec.nodeName": "node",
+}
+
+_SET_REQUIREMENT = re.compile(r"^([\w./-]+)\s+(in|notin)\s+\(([^)]*)\)$")
+_EQUALITY_REQUIREMENT = re.compile(r"^([\w./-]+)\s*(==|=|!=)\s*([\w./-]*)$")
+_EXISTS_REQUIREMENT = re.compile(r"^(!?)([\w./-]+)$")
+
+
+def _status(error: Exception) -> Optional[int]:
+    from kubernetes.client.rest import ApiException
+
+    return error.status if isinstance(error, ApiException) else None
+
+
+def _transport_errors() -> Tuple[type, ...]:
+    from urllib3.exceptions import HTTPError
+
+    return (HTTPError,)
+
+
+_ERRORS = UpstreamErrors(_status, _transport_errors)
+
+
+def iter_pod_pages(list_fn: Callable[..., Any], page_size: int, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Yield raw pod list pages, following continue tokens. Pages are decoded from
+    raw JSON one at a time, so memory scales with page size, not cluster size.
+    Each page request is bounded by a timeout and retried on transient failures.
+    """
+    continue_token = None
+    while True:
+        def list_page() -> Any:
+            count_upstream_request()
+            return list_fn(limit=page_size, _continue=continue_token, _preload_content=False,
+                           _request_timeout=request_timeout(_REQUEST_TIMEOUT), **kwargs)
+
+        response = call_with_retries("kubernetes", list_page, _ERRORS)
+        page = json.loads(response.data)
+        yield page
+        continue_token = page["metadata"].get("continue")
+        if not continue_token:
+            return
+
+
+def _split_selector(selector: str) -> List[str]:
+    """Split a selector on the commas that are not inside an in (...) value list."""
+    return [part.strip() for part in re.split(r",(?![^()]*\))", selector) if part.strip()]
+
+
+def parse_label_selector(selector: Optional[str]) -> Optional[List[PodMatcher]]:
+    """
+    Compile a label selector into matchers evaluated against cached pods.
+    Returns None when the selector uses syntax this parser does not understand.
+    """
+    matchers: List[PodMatcher] = []
+    for requirement in _split_selector(selector or ""):
+        if match := _SET_REQUIREMENT.match(requirement):
+            key, operator, values = match.groups()
+            allowed = {value.strip() for value in values.split(",")}
+            if operator == "in":
+                matchers.append(lambda pod, k=key, a=allowed: pod.labels.get(k) in a)
+            else:
+                matchers.append(lambda pod, k=key, a=allowed: pod.labels.get(k) not in a)
+        elif match := _EQUALITY_REQUIREMENT.match(requirement):
+            key, operator, value = match.groups()
+            if operator == "!=":
+                matchers.append(lambda pod, k=key, v=value: pod.labels.get(k) != v)
+            else:
+                matchers.append(lambda pod, k=key, v=value: pod.labels.get(k) == v)
+        elif match := _EXISTS_REQUIREMENT.match(requirement):
+            negated, key = match.groups()
+            matchers.append(lambda pod, k=key, n=bool(negated): (k in pod.labels) != n)
+        else:
+            return None
+    return matchers
 
-@mcp.tool()
-def get_pods_api() -> str:
-    v1 = get_client_api()
-    print("Listing pods with their IPs:")
-    ret = v1.list_pod_for_all_namespaces(watch=False)
-    for i in ret.items:
-        print("%s\t%s\t%s" % (i.status.pod_ip, i.metadata.namespace, i.metadata.name))
-    return ret.items
 
+def parse_field_selector(selector: Optional[str]) -> Optional[List[PodMatcher]]:
+    """
+    Compile a pod field selector into matchers evaluated against cached pods.
+    Returns None for fields that are not part of PodSummary.
+    """
+    matchers: List[PodMatcher] = []
+    for requirement in _split_selector(selector or ""):
+        match = _EQUALITY_REQUIREMENT.match(requirement)
+        if not match or match.group(1) not in _POD_FIELDS:
+            return None
+        path, operator, value = match.groups()
+        attribute = _POD_FIELDS[path]
+        if operator == "!=":
+            matchers.append(lambda pod, a=attribute, v=value: getattr(pod, a) != v)
+        else:
+            matchers.append(lambda pod, a=attribute, v=value: getattr(pod, a) == v)
+    return matchers
 
-@mcp.tool()
+
+class PodInformer:
+    """
+    Mirrors every pod in the cluster in memory, like a client-go informer: one
+    paged list, then a watch that resumes from the last seen resourceVersion.
+    The list is only repeated when the API server reports that version as gone.
+    """
+
+    def __init__(self):
+        self._pods: Dict[Tuple[str, str], PodSummary] = {}
+        self._resource_version: Optional[str] = None
+        self._lock = threading.Lock()
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._watch: Optional["watch.Watch"] = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="pod-informer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._synced.clear()
+        if self._watch is not None:
+            self._watch.stop()
+
+    def query(
+            self,
+            namespace: Optional[str] = None,
+            label_selector: Optional[str] = None,
+            field_selector: Optional[str] = None
+    ) -> Optional[List[PodSummary]]:
+        """
+        Answer a pod query from memory. Returns None when the cache has not synced
+        yet or a selector cannot be evaluated locally, so the caller asks the API.
+        The first query starts the sync in the background without waiting for it.
+        """
+        label_matchers = parse_label_selector(label_selector)
+        field_matchers = parse_field_selector(field_selector)
+        if label_matchers is None or field_matchers is None:
+            return None
+
+        self.start()
+        if not self._synced.is_set():
+            return None
+
+        matchers = label_matchers + field_matchers
+        with self._lock:
+            pods = list(self._pods.values())
+        return [
+            pod for pod in pods
+            if (not namespace or pod.namespace == namespace) and all(match(pod) for match in matchers)
+        ]
+
+    def _run(self) -> None:
+        from kubernetes.client.rest import ApiException
+
+        backoff = 1.0
+        while not self._stopped.is_set():
+            try:
+                if self._resource_version is None:
+                    self._relist()
+                self._watch_from_resource_version()
+                backoff = 1.0
+                continue
+            except ApiException as e:
+                if e.status == _HTTP_GONE:
+                    logger.info("Pod watch resourceVersion expired, relisting.")
+                    self._resource_version = None
+                    continue
+                logger.warning("Pod informer request failed: %s", e)
+            except Exception as e:
+                logger.warning("Pod informer failed: %s", e)
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    def _relist(self) -> None:
+        pods: Dict[Tuple[str, str], PodSummary] = {}
+        resource_version = None
+        for page in iter_pod_pages(get_client_api().list_pod_for_all_namespaces, _LIST_PAGE_SIZE):
+            for raw_pod in page.get("items") or []:
+                pod = PodSummary.from_raw(raw_pod)
+                pods[(pod.namespace, pod.name)] = pod
+            resource_version = page["metadata"].get("resourceVersion")
+
+        with self._lock:
+            self._pods = pods
+            self._resource_version = resource_version
+        self._synced.set()
+
+    def _watch_from_resource_version(self) -> None:
+        from kubernetes import watch
+
+        # return_type="object" hands back the raw dict instead of a deserialized V1Pod.
+        self._watch = watch.Watch(return_type="object")
+        events = self._watch.stream(
+            get_client_api().list_pod_for_all_namespaces,
+            resource_version=self._resource_version,
+            timeout_seconds=_WATCH_TIMEOUT,
+            allow_watch_bookmarks=True,
+        )
+        for event in events:
+            if event["type"] == "ERROR":
+                # A Status object, e.g. 410 Gone once the resourceVersion has expired: list again.
+                status = event["raw_object"]
+                logger.info("Pod watch failed with %s %s, relisting.", status.get("code"), status.get("reason"))
+                self._resource_version = None
+                return
+            raw_pod = event["raw_object"]
+            resource_version = (raw_pod.get("metadata") or {}).get("resourceVersion")
+            with self._lock:
+                if event["type"] != "BOOKMARK":
+                    pod = PodSummary.from_raw(raw_pod)
+                    if event["type"] == "DELETED":
+                        self._pods.pop((pod.namespace, pod.name), None)
+                    else:
+                        self._pods[(pod.namespace, pod.name)] = pod
+                if resource_version:
+                    self._resource_version = resource_version
+
+
+_pod_informer = PodInformer()
+
+
+@on_shutdown
+def stop_pod_informer() -> None:
+    _pod_informer.stop()
+
+
+def iter_pods_from_api(
+        namespace: Optional[str] = None,
+        label_selector: Optional[str] = None,
+        field_selector: Optional[str] = None,
+        page_size: int = _LIST_PAGE_SIZE
+) -> Iterator[PodSummary]:
+    """Stream pods straight from the API server page by page, letting it apply the selectors."""
+    api = get_client_api()
+    selectors = {"label_selector": label_selector, "field_selector": field_selector}
+    selectors = {key: value for key, value in selectors.items() if value}
+    if namespace:
+        pages = iter_pod_pages(api.list_namespaced_pod, page_size, namespace=namespace, **selectors)
+    else:
+        pages = iter_pod_pages(api.list_pod_for_all_namespaces, page_size, **selectors)
+    for page in pages:
+        for raw_pod in page.get("items") or []:
+            yield PodSummary.from_raw(raw_pod)
+
+
+def render_pods(
+        pods: Iterable[PodSummary],
+        output_format: OutputFormat = "text",
+        max_rows: int = _MAX_ROWS,
+        fields: Optional[List[str]] = None
+) -> str:
+    """
+    Render at most max_rows pods as a tab-separated table or JSON lines. The
+    iterable is consumed lazily, so an API stream stops paging at the limit.
+    """
+    return render_records(pods, POD_COLUMNS, fields, max_rows, output_format, "No pods found.", "pods")
+
+
+@mcp.tool(
+    description="List Kubernetes pods with their namespace, name, IP, phase and node. "
+                "Optionally filter by namespace, label selector (e.g. app=nginx) "
+                "or field selector (e.g. status.phase=Running). "
+                "Returns at most max_rows pods as a table (output_format='text') or JSON lines ('jsonl'), "
+                "optionally only the given fields (namespace, name, ip, phase, node)."
+)
+def get_pods_api(
+        namespace: Optional[str] = None,
+        label_selector: Optional[str] = None,
+        field_selector: Optional[str] = None,
+        page_size: int = _LIST_PAGE_SIZE,
+        max_rows: int = _MAX_ROWS,
+        output_format: OutputFormat = "text",
+        fields: Optional[List[str]] = None
+) -> str:
+    page_size = max(1, page_size)
+    try:
+        select_columns(POD_COLUMNS, fields)
+    except ValueError as e:
+        return str(e)
+
+    pods: Optional[Iterable[PodSummary]] = None
+    if _INFORMER_ENABLED:
+        pods = _pod_informer.query(namespace, label_selector, field_selector)
+    if pods is None:
+        pods = iter_pods_from_api(namespace, label_selector, field_selector, page_size)
+
+    return render_pods(pods, output_format, max_rows, fields)
+
+
+@mcp.tool(mutating=True)
 def create_demo_nginx() -> str:
     """Create a demo Nginx Deployment+Service and return the direct access URL."""
+    from kubernetes.client import V1Pod, V1Service
+
     v1 = get_client_api()
     pod: V1Pod = V1Pod(
         api_version="v1",
@@ -39,6 +391,7 @@ def create_demo_nginx() -> str:
             ]
         },
     )
+    count_upstream_request()
     v1.create_namespaced_pod("default", pod)
     service: V1Service = V1Service(
         api_version="v1",
@@ -50,6 +403,7 @@ def create_demo_nginx() -> str:
             "selector": {"app": "nginx-demo"},
         },
     )
+    count_upstream_request()
     v1.create_namespaced_service("default", service)
 
     return f"Nginx demo is up!"
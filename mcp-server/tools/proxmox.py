@@ -1,65 +1,479 @@
+import logging
 import os
-from typing import List, Iterable
-
-from proxmoxmanager.main import ProxmoxManager
-from proxmoxmanager.utils import ProxmoxVM
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
 
+from common.cache import TTLCache
+from common.executor import submit_in_context
+from common.metrics import count_upstream_request
+from common.resilience import CircuitOpenError, UpstreamErrors, call_with_retries, serve_stale
+from common.results import OutputFormat, render_records, select_columns
 from mcp_server import mcp
 
+# For annotations only, the SDK is imported on first use (see tools/__init__.py).
+if TYPE_CHECKING:
+    from proxmoxmanager.main import ProxmoxManager
+    from proxmoxmanager.utils import APIWrapper
+
+logger = logging.getLogger(__name__)
+
+# How long one /cluster/resources snapshot is served before it is fetched again.
+_INVENTORY_TTL = float(os.getenv("PROXMOX_INVENTORY_TTL", "15"))
+# Power operations dispatched to one node at a time, and how long to wait for their tasks. The wait
+# stays well below the client's tool call timeout (60 s), tasks still running are reported by UPID.
+_NODE_CONCURRENCY = int(os.getenv("PROXMOX_NODE_CONCURRENCY", "4"))
+_TASK_TIMEOUT = float(os.getenv("PROXMOX_TASK_TIMEOUT", "30"))
+_MAX_ROWS = int(os.getenv("PROXMOX_MAX_ROWS", "500"))
 
-def get_proxmox_manager() -> ProxmoxManager:
-    """Get ProxmoxManager instance."""
-    proxmox_manager = ProxmoxManager(
-        host=os.getenv("PROXMOX_HOST"),
-        user=os.getenv("PROXMOX_USER"),
-        token_name=os.getenv("PROXMOX_TOKEN_NAME"),
-        token_value=os.getenv("PROXMOX_TOKEN_VALUE")
+_managers: Dict[Tuple[Optional[str], ...], "ProxmoxManager"] = {}
+_managers_lock = threading.Lock()
+_inventory_cache: TTLCache[str, "ProxmoxInventory"] = TTLCache(maxsize=8)
+_inventory_lock = threading.Lock()
+
+
+def get_proxmox_manager() -> "ProxmoxManager":
+    """
+    Get the shared ProxmoxManager instance. It is created once per host and
+    token, so its authenticated HTTP session is reused across tool calls.
+    """
+    from proxmoxmanager.main import ProxmoxManager
+
+    settings = (
+        os.getenv("PROXMOX_HOST"),
+        os.getenv("PROXMOX_USER"),
+        os.getenv("PROXMOX_TOKEN_NAME"),
+        os.getenv("PROXMOX_TOKEN_VALUE"),
     )
+    with _managers_lock:
+        proxmox_manager = _managers.get(settings)
+        if proxmox_manager is None:
+            host, user, token_name, token_value = settings
+            proxmox_manager = ProxmoxManager(host=host, user=user, token_name=token_name, token_value=token_value)
+            _managers[settings] = proxmox_manager
     return proxmox_manager
 
 
-@mcp.tool()
-def get_proxmox_virtual_machines() -> List[str]:
+def get_proxmox_api() -> "APIWrapper":
+    """The endpoint-level API of the shared manager, for calls ProxmoxManager does not expose."""
+    return get_proxmox_manager()._api
+
+
+def _status(error: Exception) -> Optional[int]:
+    from proxmoxer.core import ResourceException
+
+    return error.status_code if isinstance(error, ResourceException) else None
+
+
+def _transport_errors() -> Tuple[type, ...]:
+    from requests.exceptions import ConnectionError, Timeout
+
+    return ConnectionError, Timeout
+
+
+_ERRORS = UpstreamErrors(_status, _transport_errors)
+
+
+def proxmox_read(method: str, **kwargs: Any) -> Any:
     """
-    Return a flat list of all VMIDs across every Proxmox node,
-    using only the ProxmoxVMDict/ProxmoxVM SDK classes.
+    Make a read-only API call, retried on transient failures and guarded by
+    the Proxmox circuit breaker. Calls that change state must not go through
+    here, a retried start or stop could run twice.
     """
-    proxmox_manager = get_proxmox_manager()
-    vms: Iterable[ProxmoxVM] = proxmox_manager.vms.values()
 
-    response_string = ""
-    for vm in vms:
-        response_string += f"Id: {vm.id}, Node: {vm.node}, Running: {vm.running()}\n"
-    return response_string
+    def call() -> Any:
+        count_upstream_request()
+        return getattr(get_proxmox_api(), method)(**kwargs)
+
+    return call_with_retries("proxmox", call, _ERRORS)
+
+
+@dataclass
+class ProxmoxResource:
+    """One guest or node entry from /cluster/resources."""
+    id: str
+    type: str
+    node: str
+    status: str
+    name: str = ""
+    vmid: str = ""
+    cpu: float = 0.0
+    maxcpu: int = 0
+    mem: int = 0
+    maxmem: int = 0
+    uptime: int = 0
+    template: bool = False
+    pool: str = ""
+    tags: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_raw(cls, resource: Dict[str, Any]) -> "ProxmoxResource":
+        return cls(
+            id=resource.get("id", ""),
+            type=resource.get("type", ""),
+            node=resource.get("node", ""),
+            status=resource.get("status", ""),
+            name=resource.get("name", ""),
+            vmid=str(resource.get("vmid", "")),
+            cpu=float(resource.get("cpu") or 0.0),
+            maxcpu=int(resource.get("maxcpu") or 0),
+            mem=int(resource.get("mem") or 0),
+            maxmem=int(resource.get("maxmem") or 0),
+            uptime=int(resource.get("uptime") or 0),
+            template=bool(resource.get("template")),
+            pool=resource.get("pool", ""),
+            tags=[tag for tag in (resource.get("tags") or "").replace(",", ";").split(";") if tag],
+        )
+
+    @property
+    def running(self) -> bool:
+        return self.status == "running"
+
+
+@dataclass
+class ProxmoxInventory:
+    """Point-in-time view of the whole cluster, built from a single /cluster/resources call."""
+    vms: List[ProxmoxResource]
+    containers: List[ProxmoxResource]
+    nodes: List[ProxmoxResource]
+    fetched_at: float
+
+    @classmethod
+    def from_resources(cls, resources: List[Dict[str, Any]]) -> "ProxmoxInventory":
+        parsed = [ProxmoxResource.from_raw(resource) for resource in resources]
+        return cls(
+            vms=[resource for resource in parsed if resource.type == "qemu"],
+            containers=[resource for resource in parsed if resource.type == "lxc"],
+            nodes=[resource for resource in parsed if resource.type == "node"],
+            fetched_at=time.time(),
+        )
+
+    def find_vm(self, vm_id: str) -> Optional[ProxmoxResource]:
+        return next((vm for vm in self.vms if vm.vmid == str(vm_id)), None)
+
+
+def get_proxmox_inventory(max_age: Optional[float] = None) -> ProxmoxInventory:
+    """
+    Return a cluster snapshot no older than max_age seconds (PROXMOX_INVENTORY_TTL by default).
+    Concurrent callers share one refresh instead of each querying the cluster.
+    While the cluster is unreachable, the last snapshot is served however old it is.
+    """
+    host = os.getenv("PROXMOX_HOST") or ""
+    max_age = _INVENTORY_TTL if max_age is None else max_age
+
+    def cached() -> Optional[ProxmoxInventory]:
+        inventory = _inventory_cache.get(host)
+        if inventory is not None and time.time() - inventory.fetched_at <= max_age:
+            return inventory
+        return None
+
+    inventory = cached()
+    if inventory is not None:
+        return inventory
+
+    with _inventory_lock:
+        inventory = cached()
+        if inventory is None:
+            try:
+                resources = proxmox_read("list_resources")
+            except Exception as e:
+                stale = _inventory_cache.get_entry(host)
+                if stale is None or not serve_stale() or not (isinstance(e, CircuitOpenError) or _ERRORS.is_transient(e)):
+                    raise
+                logger.warning("Proxmox is unreachable, serving the inventory from %.0f s ago: %s",
+                               time.time() - stale.value.fetched_at, e)
+                return stale.value
+            inventory = ProxmoxInventory.from_resources(resources)
+            _inventory_cache.set(host, inventory, _INVENTORY_TTL)
+    return inventory
+
+
+def invalidate_proxmox_inventory() -> None:
+    """Drop the cached snapshot, e.g. after changing the power state of a VM."""
+    _inventory_cache.invalidate(os.getenv("PROXMOX_HOST") or "")
+
+
+_VM_COLUMNS = ["vmid", "name", "node", "status", "cpu", "maxcpu", "mem", "maxmem", "uptime", "pool", "tags"]
+_VM_DEFAULT_FIELDS = ["vmid", "name", "node", "status"]
+_NODE_COLUMNS = ["node", "status", "cpu_percent", "maxcpu", "mem_gib", "maxmem_gib", "uptime"]
+_USER_COLUMNS = ["userid", "enable", "expire", "firstname", "lastname", "email", "comment"]
+_USER_DEFAULT_FIELDS = ["userid", "enable", "email", "comment"]
+
+
+@mcp.tool(
+    description="List Proxmox virtual machines across every node with their ID, name, node and status. "
+                "Optionally filter by node or status (e.g. running, stopped) and choose the fields "
+                "(vmid, name, node, status, cpu, maxcpu, mem, maxmem, uptime, pool, tags)."
+)
+def get_proxmox_virtual_machines(
+        node: Optional[str] = None,
+        status: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        max_rows: int = _MAX_ROWS,
+        output_format: OutputFormat = "text"
+) -> str:
+    """
+    Return all VMs across every Proxmox node from the cluster snapshot,
+    which takes one /cluster/resources request however many VMs there are.
+    """
+    try:
+        columns = select_columns(_VM_COLUMNS, fields or _VM_DEFAULT_FIELDS)
+    except ValueError as e:
+        return str(e)
+
+    inventory = get_proxmox_inventory()
+    vms = (
+        vm for vm in inventory.vms
+        if (not node or vm.node == node) and (not status or vm.status == status)
+    )
+    return render_records(vms, columns, max_rows=max_rows, output_format=output_format,
+                          empty_message="No virtual machines found.", noun="virtual machines")
+
+
+@mcp.tool(description="List Proxmox nodes with their status, CPU and memory usage.")
+def get_proxmox_nodes(
+        fields: Optional[List[str]] = None,
+        max_rows: int = _MAX_ROWS,
+        output_format: OutputFormat = "text"
+) -> str:
+    try:
+        columns = select_columns(_NODE_COLUMNS, fields)
+    except ValueError as e:
+        return str(e)
+    if max_rows < 1:
+        return "max_rows must be at least 1."
+
+    inventory = get_proxmox_inventory()
+    nodes = (
+        {
+            "node": node.node,
+            "status": node.status,
+            "cpu_percent": round(node.cpu * 100, 1),
+            "maxcpu": node.maxcpu,
+            "mem_gib": round(node.mem / 2 ** 30, 1),
+            "maxmem_gib": round(node.maxmem / 2 ** 30, 1),
+            "uptime": node.uptime,
+        }
+        for node in inventory.nodes
+    )
+    return render_records(nodes, columns, max_rows=max_rows, output_format=output_format,
+                          empty_message="No nodes found.", noun="nodes")
+
+
+@mcp.tool(description="List Proxmox users with their ID, whether they are enabled, e-mail and comment.")
+def get_proxmox_users(
+        fields: Optional[List[str]] = None,
+        max_rows: int = _MAX_ROWS,
+        output_format: OutputFormat = "text"
+) -> str:
+    try:
+        columns = select_columns(_USER_COLUMNS, fields or _USER_DEFAULT_FIELDS)
+    except ValueError as e:
+        return str(e)
+
+    users = sorted(proxmox_read("list_users"), key=lambda user: user.get("userid", ""))
+    return render_records(users, columns, max_rows=max_rows, output_format=output_format,
+                          empty_message="No users found.", noun="users")
 
 
-@mcp.tool()
-def get_proxmox_nodes():
-    proxmox_manager = get_proxmox_manager()
-    nodes = proxmox_manager.nodes
-    return nodes
+@dataclass(frozen=True)
+class PowerAction:
+    api_method: str
+    # The VM status in which the action has nothing to do, and what to report then.
+    noop_status: str
+    noop_message: str
+    done_message: str
 
 
-@mcp.tool()
-def get_proxmox_users():
-    proxmox_manager = get_proxmox_manager()
-    users = proxmox_manager.users
-    return users
+_POWER_ACTIONS = {
+    "start": PowerAction("start_vm", "running", "is already running", "started"),
+    "stop": PowerAction("stop_vm", "stopped", "is already stopped", "stopped"),
+    "reboot": PowerAction("reboot_vm", "stopped", "is not running", "rebooted"),
+}
 
 
-@mcp.tool(description="Start a Proxmox virtual machine, given its ID.")
+def _select_vms(
+        inventory: ProxmoxInventory,
+        vm_ids: Optional[List[str]],
+        tag: Optional[str],
+        pool: Optional[str]
+) -> Tuple[List[ProxmoxResource], List[str]]:
+    """Resolve VM IDs and tag/pool selectors to VMs. Also returns the IDs that do not exist."""
+    wanted = {str(vm_id) for vm_id in vm_ids or []}
+    selected = [
+        vm for vm in inventory.vms
+        if vm.vmid in wanted or (tag and tag in vm.tags) or (pool and vm.pool == pool)
+    ]
+    missing = sorted(wanted - {vm.vmid for vm in inventory.vms})
+    return selected, missing
+
+
+def _dispatch_power_action(action: PowerAction, vms: List[ProxmoxResource]) -> Dict[str, Any]:
+    """
+    Issue the action for every VM concurrently, at most PROXMOX_NODE_CONCURRENCY
+    requests per node. Maps each VM ID to its task UPID, or to the exception raised.
+    """
+    api = get_proxmox_api()
+    node_limits = {node: threading.Semaphore(_NODE_CONCURRENCY) for node in {vm.node for vm in vms}}
+
+    def submit(vm: ProxmoxResource) -> str:
+        with node_limits[vm.node]:
+            count_upstream_request()
+            return getattr(api, action.api_method)(node=vm.node, vmid=vm.vmid)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(node_limits) * _NODE_CONCURRENCY))) as executor:
+        futures = {vm.vmid: submit_in_context(executor, submit, vm) for vm in vms}
+
+    results: Dict[str, Any] = {}
+    for vm_id, future in futures.items():
+        try:
+            results[vm_id] = future.result()
+        except Exception as e:
+            results[vm_id] = e
+    return results
+
+
+def _wait_for_tasks(tasks: Dict[str, str], timeout: float) -> Dict[str, str]:
+    """
+    Poll task UPIDs (by node) until they finish or the timeout passes. Each round
+    lists a node's recent tasks once, instead of querying every UPID separately.
+    Returns the exit status of every finished task.
+    """
+    api = get_proxmox_api()
+    pending: Dict[str, Set[str]] = {}
+    for upid, node in tasks.items():
+        pending.setdefault(node, set()).add(upid)
+
+    finished: Dict[str, str] = {}
+    deadline = time.monotonic() + timeout
+    interval = 0.5
+    while pending and time.monotonic() < deadline:
+        time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+        interval = min(interval * 1.5, 5.0)
+        for node, upids in list(pending.items()):
+            count_upstream_request()
+            try:
+                listed = {task["upid"]: task for task in api.list_tasks(node, source="all", limit=max(50, 4 * len(upids)))}
+            except Exception:
+                continue
+            for upid in list(upids):
+                task = listed.get(upid)
+                if task is None:
+                    # Pushed out of the listing by newer tasks, ask for it directly.
+                    count_upstream_request()
+                    try:
+                        status = api.get_task_status(node, upid)
+                    except Exception:
+                        continue
+                    task = {"endtime": status.get("status") == "stopped", "status": status.get("exitstatus", "")}
+                if task.get("endtime"):
+                    finished[upid] = task.get("status", "")
+                    upids.discard(upid)
+            if not upids:
+                del pending[node]
+    return finished
+
+
+def run_power_action(
+        action_name: str,
+        vm_ids: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+        pool: Optional[str] = None,
+        timeout: Optional[float] = None
+) -> List[str]:
+    """
+    Apply a power action to the selected VMs in parallel, wait up to timeout
+    seconds (at most PROXMOX_TASK_TIMEOUT) for the Proxmox tasks to complete,
+    and report one line per VM.
+    """
+    action = _POWER_ACTIONS[action_name]
+    if timeout is not None and timeout <= 0:
+        return ["timeout must be greater than 0."]
+    timeout = _TASK_TIMEOUT if timeout is None else min(timeout, _TASK_TIMEOUT)
+    if not (vm_ids or tag or pool):
+        return ["Specify vm_ids, tag or pool to select virtual machines."]
+
+    inventory = get_proxmox_inventory(max_age=0)
+    vms, missing = _select_vms(inventory, vm_ids, tag, pool)
+    lines = {vm_id: f"VM {vm_id} was not found." for vm_id in missing}
+
+    targets = []
+    for vm in vms:
+        if vm.status == action.noop_status:
+            lines[vm.vmid] = f"VM {vm.vmid} {action.noop_message}."
+        else:
+            targets.append(vm)
+
+    dispatched = _dispatch_power_action(action, targets) if targets else {}
+    invalidate_proxmox_inventory()
+    tasks = {upid: vm.node for vm in targets if isinstance(upid := dispatched[vm.vmid], str)}
+    finished = _wait_for_tasks(tasks, timeout) if tasks else {}
+
+    for vm in targets:
+        upid = dispatched[vm.vmid]
+        if not isinstance(upid, str):
+            lines[vm.vmid] = f"VM {vm.vmid} could not be {action.done_message}: {upid}"
+        elif upid not in finished:
+            lines[vm.vmid] = f"VM {vm.vmid}: task {upid} still running after {timeout:g}s."
+        elif finished[upid] != "OK":
+            lines[vm.vmid] = f"VM {vm.vmid} could not be {action.done_message}: {finished[upid]}"
+        else:
+            lines[vm.vmid] = f"VM {vm.vmid} ({vm.name} on {vm.node}) {action.done_message}."
+
+    if not lines:
+        return ["No virtual machines matched."]
+    return [lines[vm_id] for vm_id in sorted(lines, key=lambda vm_id: (len(vm_id), vm_id))]
+
+
+@mcp.tool(description="Start a Proxmox virtual machine, given its ID.", mutating=True)
 def start_proxmox_virtual_machine(vm_id: str):
-    proxmox_manager = get_proxmox_manager()
-    vm_is_running: bool = proxmox_manager.vms.__getitem__(vm_id).running()
-    if vm_is_running:
-        return f"VM {vm_id} is already running."
-    proxmox_manager.vms.__getitem__(vm_id).start()
+    return run_power_action("start", [vm_id])[0]
 
 
-@mcp.tool(description="Stop a Proxmox virtual machine, given its ID.")
+@mcp.tool(description="Stop a Proxmox virtual machine, given its ID.", mutating=True)
 def stop_proxmox_virtual_machine(vm_id: str):
-    proxmox_manager = get_proxmox_manager()
-    vm_is_running: bool = proxmox_manager.vms.__getitem__(vm_id).running()
-    if not vm_is_running:
-        return f"VM {vm_id} is already stopped."
-    proxmox_manager.vms.__getitem__(vm_id).stop()
+    return run_power_action("stop", [vm_id])[0]
+
+
+@mcp.tool(
+    description="Start several Proxmox virtual machines at once, selected by a list of VM IDs, a tag or a pool. "
+                "Waits up to timeout seconds for the start tasks and reports the result per VM.",
+    mutating=True,
+)
+def start_proxmox_virtual_machines(
+        vm_ids: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+        pool: Optional[str] = None,
+        timeout: float = _TASK_TIMEOUT
+) -> str:
+    return "\n".join(run_power_action("start", vm_ids, tag, pool, timeout))
+
+
+@mcp.tool(
+    description="Stop several Proxmox virtual machines at once, selected by a list of VM IDs, a tag or a pool. "
+                "Waits up to timeout seconds for the stop tasks and reports the result per VM.",
+    mutating=True,
+)
+def stop_proxmox_virtual_machines(
+        vm_ids: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+        pool: Optional[str] = None,
+        timeout: float = _TASK_TIMEOUT
+) -> str:
+    return "\n".join(run_power_action("stop", vm_ids, tag, pool, timeout))
+
+
+@mcp.tool(
+    description="Reboot several running Proxmox virtual machines at once, selected by a list of VM IDs, a tag "
+                "or a pool. Waits up to timeout seconds for the reboot tasks and reports the result per VM.",
+    mutating=True,
+)
+def reboot_proxmox_virtual_machines(
+        vm_ids: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+        pool: Optional[str] = None,
+        timeout: float = _TASK_TIMEOUT
+) -> str:
+    return "\n".join(run_power_action("reboot", vm_ids, tag, pool, timeout))
@@ -1,59 +1,280 @@
-from typing import Any
+import asyncio
+import importlib.util
+import logging
+import os
+import re
+from typing import Any, Awaitable, Dict, List, Optional, Tuple, TypeVar
 
 import httpx
 from httpx import HTTPStatusError
 
-from mcp_server import mcp
+from common.cache import TTLCache
+from common.metrics import count_upstream_request
+from common.resilience import (
+    RETRYABLE_STATUS,
+    CircuitOpenError,
+    UpstreamErrors,
+    acall_with_retries,
+    request_timeout,
+    retry_after_header,
+    serve_stale,
+)
+from common.results import OutputFormat, render_records, select_columns
+from mcp_server import mcp, on_shutdown
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
 
 NWS_API_BASE = "https://api.weather.gov"
 USER_AGENT = "weather-app/1.0"
 
+# Points resolve to a gridpoint that practically never moves, alerts change minute to minute.
+_ENDPOINT_TTLS = (
+    ("/points/", float(os.getenv("NWS_POINTS_TTL", "86400"))),
+    ("/alerts/", float(os.getenv("NWS_ALERTS_TTL", "60"))),
+    ("/forecast", float(os.getenv("NWS_FORECAST_TTL", "900"))),
+)
+_DEFAULT_TTL = float(os.getenv("NWS_DEFAULT_TTL", "60"))
+
+# Decimal places kept for /points lookups (2 places is roughly 1 km), so nearby points share entries.
+_POINTS_PRECISION = int(os.getenv("NWS_POINTS_PRECISION", "2"))
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+_STATE_CODE = re.compile(r"^[A-Z]{2}$")
+
+# Batch tools: how many NWS requests one call keeps in flight, and how many locations it accepts.
+_BATCH_CONCURRENCY = int(os.getenv("NWS_BATCH_CONCURRENCY", "8"))
+_MAX_BATCH_LOCATIONS = int(os.getenv("NWS_MAX_BATCH_LOCATIONS", "100"))
+
+_REQUEST_TIMEOUT = float(os.getenv("NWS_REQUEST_TIMEOUT", "10"))
+
+# Alert properties that can be selected, as named by the NWS API.
+_ALERT_COLUMNS = ["event", "areaDesc", "severity", "urgency", "certainty", "headline", "description",
+                  "instruction", "onset", "ends", "senderName"]
+_ALERT_DEFAULT_FIELDS = ["event", "areaDesc", "severity", "description", "instruction"]
+_MAX_ROWS = int(os.getenv("NWS_MAX_ROWS", "50"))
+
+_http_client: Optional[httpx.AsyncClient] = None
+_response_cache: TTLCache[str, Dict[str, Any]] = TTLCache(maxsize=int(os.getenv("NWS_CACHE_SIZE", "512")))
+
+
+def _http2_enabled() -> bool:
+    """HTTP/2 is opt-in via NWS_HTTP2 and needs the optional h2 package."""
+    if os.getenv("NWS_HTTP2", "false").lower() not in ("1", "true", "yes"):
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("NWS_HTTP2 is set but the h2 package is not installed, falling back to HTTP/1.1.")
+        return False
+    return True
+
 
-async def make_nws_request(url: str) -> dict[str, Any] | None:
-    """Make a request to the NWS API with proper error handling."""
-    headers = {
-        "User-Agent": USER_AGENT,
-        "Accept": "application/geo+json"
-    }
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers, timeout=30.0)
+async def _count_request(request: httpx.Request) -> None:
+    count_upstream_request()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get the shared NWS HTTP client, creating it on first use. Connections are kept
+    alive between tool calls so repeated requests skip the TCP and TLS handshakes.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            headers={
+                "User-Agent": USER_AGENT,
+                "Accept": "application/geo+json"
+            },
+            timeout=_REQUEST_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("NWS_MAX_CONNECTIONS", "20")),
+                max_keepalive_connections=int(os.getenv("NWS_MAX_KEEPALIVE_CONNECTIONS", "10")),
+                keepalive_expiry=float(os.getenv("NWS_KEEPALIVE_EXPIRY", "30")),
+            ),
+            http2=_http2_enabled(),
+            event_hooks={"request": [_count_request]},
+        )
+    return _http_client
+
+
+@on_shutdown
+async def close_http_client() -> None:
+    """Close the shared NWS HTTP client and its pooled connections."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _endpoint_ttl(url: str) -> float:
+    for fragment, ttl in _ENDPOINT_TTLS:
+        if fragment in url:
+            return ttl
+    return _DEFAULT_TTL
+
+
+def _response_ttl(response: httpx.Response, default: float) -> Optional[float]:
+    """
+    Freshness lifetime for a response, honoring Cache-Control. Returns None when
+    the response must not be stored.
+    """
+    cache_control = response.headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0.0
+    match = _MAX_AGE.search(cache_control)
+    if match:
+        return float(match.group(1))
+    return default
+
+
+def points_url(latitude: float, longitude: float) -> str:
+    """Build the /points URL with coordinates rounded so nearby locations share a cache entry."""
+    return f"{NWS_API_BASE}/points/{round(latitude, _POINTS_PRECISION)},{round(longitude, _POINTS_PRECISION)}"
+
+
+def _status(error: Exception) -> Optional[int]:
+    return error.response.status_code if isinstance(error, HTTPStatusError) else None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    if isinstance(error, HTTPStatusError):
+        return retry_after_header(error.response.headers)
+    return None
+
+
+_ERRORS = UpstreamErrors(_status, lambda: (httpx.TransportError,), _retry_after)
+
+
+def nws_cache_stats() -> Dict[str, int]:
+    """Hit, miss and revalidation counters for the NWS response cache."""
+    return _response_cache.stats()
+
+
+async def make_nws_request(url: str, ttl: Optional[float] = None) -> dict[str, Any] | None:
+    """
+    Make a request to the NWS API with proper error handling.
+
+    Responses are cached per URL. Fresh entries are served from memory, stale
+    ones are revalidated with If-None-Match / If-Modified-Since.
+
+    Timeouts, connection errors, 429s and 5xx responses are retried within the
+    tool's deadline. When the NWS stays unreachable a stale entry is served if
+    there is one, otherwise None is returned.
+    """
+    entry = _response_cache.get_entry(url)
+    if entry is not None and entry.fresh:
+        return entry.value
+
+    headers = {}
+    if entry is not None:
+        if entry.metadata.get("etag"):
+            headers["If-None-Match"] = entry.metadata["etag"]
+        if entry.metadata.get("last_modified"):
+            headers["If-Modified-Since"] = entry.metadata["last_modified"]
+
+    client = get_http_client()
+    default_ttl = _endpoint_ttl(url) if ttl is None else ttl
+
+    async def fetch() -> httpx.Response:
+        response = await client.get(url, headers=headers, timeout=request_timeout(_REQUEST_TIMEOUT))
+        if response.status_code in RETRYABLE_STATUS:
             response.raise_for_status()
-            return response.json()
-        except HTTPStatusError:
+        return response
+
+    try:
+        response = await acall_with_retries("weather", fetch, _ERRORS)
+        if response.status_code == 304 and entry is not None:
+            _response_cache.refresh(url, _response_ttl(response, default_ttl) or 0.0)
+            return entry.value
+        response.raise_for_status()
+        data = response.json()
+    except (HTTPStatusError, httpx.TransportError, CircuitOpenError, TimeoutError) as e:
+        # Outdated data beats none while the NWS is down, but not when it says the request is wrong.
+        if isinstance(e, HTTPStatusError) and not _ERRORS.is_transient(e):
             return None
+        if entry is not None and serve_stale():
+            logger.warning("NWS request for %s failed, serving the cached response: %s", url, e)
+            return entry.value
+        logger.warning("NWS request for %s failed: %s", url, e)
+        return None
 
+    response_ttl = _response_ttl(response, default_ttl)
+    if response_ttl is not None:
+        _response_cache.set(
+            url,
+            data,
+            response_ttl,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+    return data
 
-def format_alert(feature: dict) -> str:
-    """Format an alert feature into a readable string."""
-    props = feature["properties"]
+
+def render_alerts(
+        data: Optional[Dict[str, Any]],
+        fields: Optional[List[str]],
+        max_rows: int,
+        output_format: OutputFormat,
+        empty_message: str
+) -> str:
+    """Render the alert features of an /alerts response, at most max_rows of them."""
+    if not data or "features" not in data:
+        return "Unable to fetch alerts or no alerts found."
+    alerts = (feature["properties"] for feature in data["features"])
+    return render_records(alerts, fields or _ALERT_DEFAULT_FIELDS, max_rows=max_rows, output_format=output_format,
+                          empty_message=empty_message, noun="alerts")
+
+
+def format_period(period: dict) -> str:
+    """Format a forecast period into a readable string."""
     return f"""
-Event: {props.get('event', 'Unknown')}
-Area: {props.get('areaDesc', 'Unknown')}
-Severity: {props.get('severity', 'Unknown')}
-Description: {props.get('description', 'No description available')}
-Instructions: {props.get('instruction', 'No specific instructions provided')}
+{period['name']}:
+Temperature: {period['temperature']}°{period['temperatureUnit']}
+Wind: {period['windSpeed']} {period['windDirection']}
+Forecast: {period['detailedForecast']}
 """
 
 
-@mcp.tool(description="Get weather alerts for a US state. Call this tool when the user wants to find out about weather alerts.")
-async def get_alerts(state: str) -> str:
+async def _gather_bounded(coroutines: List[Awaitable[T]], limit: int = _BATCH_CONCURRENCY) -> List[T]:
+    """Await the coroutines concurrently, at most limit at a time, and return their results in order."""
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def bounded(coroutine: Awaitable[T]) -> T:
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(bounded(coroutine) for coroutine in coroutines))
+
+
+@mcp.tool(
+    description="Get weather alerts for a US state. Call this tool when the user wants to find out about weather "
+                "alerts. Optionally choose the fields (event, areaDesc, severity, urgency, certainty, headline, "
+                "description, instruction, onset, ends, senderName)."
+)
+async def get_alerts(
+        state: str,
+        fields: Optional[List[str]] = None,
+        max_rows: int = _MAX_ROWS,
+        output_format: OutputFormat = "text"
+) -> str:
     """Get weather alerts for a US state.
 
     Args:
         state: Two-letter US state code (e.g. CA, NY)
+        fields: Alert properties to return
+        max_rows: Maximum number of alerts to return
+        output_format: 'text' for a table, 'jsonl' for one JSON object per alert
     """
+    try:
+        select_columns(_ALERT_COLUMNS, fields)
+    except ValueError as e:
+        return str(e)
+
     url = f"{NWS_API_BASE}/alerts/active/area/{state}"
     data = await make_nws_request(url)
-
-    if not data or "features" not in data:
-        return "Unable to fetch alerts or no alerts found."
-
-    if not data["features"]:
-        return "No active alerts for this state."
-
-    alerts = [format_alert(feature) for feature in data["features"]]
-    return "\n---\n".join(alerts)
+    return render_alerts(data, fields, max_rows, output_format, "No active alerts for this state.")
 
 
 @mcp.tool()
@@ -64,8 +285,7 @@ async def get_forecast(latitude: float, longitude: float) -> str:
         latitude: Latitude of the location
         longitude: Longitude of the location
     """
-    points_url = f"{NWS_API_BASE}/points/{latitude},{longitude}"
-    points_data = await make_nws_request(points_url)
+    points_data = await make_nws_request(points_url(latitude, longitude))
 
     if not points_data:
         return "Unable to fetch forecast data for this location."
@@ -77,14 +297,92 @@ async def get_forecast(latitude: float, longitude: float) -> str:
         return "Unable to fetch detailed forecast."
 
     periods = forecast_data["properties"]["periods"]
-    forecasts = []
-    for period in periods[:5]:
-        forecast = f"""
-{period['name']}:
-Temperature: {period['temperature']}°{period['temperatureUnit']}
-Wind: {period['windSpeed']} {period['windDirection']}
-Forecast: {period['detailedForecast']}
-"""
-        forecasts.append(forecast)
+    return "\n---\n".join(format_period(period) for period in periods[:5])
+
+
+@mcp.tool(
+    description="Get weather alerts for several US states in one call. Call this tool instead of get_alerts "
+                "when the user asks about a region or more than one state. Takes the same fields as get_alerts."
+)
+async def get_alerts_for_states(
+        states: List[str],
+        fields: Optional[List[str]] = None,
+        max_rows: int = _MAX_ROWS,
+        output_format: OutputFormat = "text"
+) -> str:
+    """Get weather alerts for several US states with a single NWS request.
+
+    Args:
+        states: Two-letter US state codes (e.g. ["CA", "NV", "OR"])
+        fields: Alert properties to return
+        max_rows: Maximum number of alerts to return across all states
+        output_format: 'text' for a table, 'jsonl' for one JSON object per alert
+    """
+    try:
+        select_columns(_ALERT_COLUMNS, fields)
+    except ValueError as e:
+        return str(e)
+
+    codes = sorted({state.strip().upper() for state in states})
+    invalid = [code for code in codes if not _STATE_CODE.match(code)]
+    if invalid:
+        return f"Invalid state codes {', '.join(invalid)}. Use two-letter codes such as CA."
+    if not codes:
+        return "No states given."
+
+    # One multi-area query instead of one per state. Sorted, so any order of the same states shares a cache entry.
+    data = await make_nws_request(f"{NWS_API_BASE}/alerts/active?area={','.join(codes)}")
+    return render_alerts(data, fields, max_rows, output_format, f"No active alerts for {', '.join(codes)}.")
+
+
+def _format_location(location: Tuple[float, float]) -> str:
+    return f"{location[0]:g},{location[1]:g}"
+
+
+@mcp.tool(
+    description="Get the weather forecast for many locations in one call. Call this tool instead of get_forecast "
+                "when the user asks about more than one place, e.g. a list of sites."
+)
+async def get_forecasts(locations: List[Tuple[float, float]], periods: int = 2) -> str:
+    """Get forecasts for many locations. Locations in the same NWS gridpoint share one forecast.
+
+    Args:
+        locations: [latitude, longitude] pairs of the locations
+        periods: Forecast periods per location, from the next one on (e.g. 2 for tonight and tomorrow)
+    """
+    if len(locations) > _MAX_BATCH_LOCATIONS:
+        return f"At most {_MAX_BATCH_LOCATIONS} locations per call, got {len(locations)}."
+
+    # Nearby coordinates round to the same /points URL, so each URL is looked up once.
+    points_urls = {location: points_url(*location) for location in locations}
+    unique_points = list(dict.fromkeys(points_urls.values()))
+    points = dict(zip(unique_points, await _gather_bounded([make_nws_request(url) for url in unique_points])))
+
+    # Different points can still fall in the same gridpoint, which has a single forecast URL.
+    gridpoints: Dict[str, List[Tuple[float, float]]] = {}
+    failed: List[Tuple[float, float]] = []
+    for location, url in points_urls.items():
+        points_data = points[url]
+        if not points_data:
+            failed.append(location)
+            continue
+        gridpoints.setdefault(points_data["properties"]["forecast"], []).append(location)
+
+    forecast_urls = list(gridpoints)
+    forecasts = await _gather_bounded([make_nws_request(url) for url in forecast_urls])
+
+    sections = []
+    for forecast_url, forecast_data in zip(forecast_urls, forecasts):
+        names = "; ".join(_format_location(location) for location in gridpoints[forecast_url])
+        if not forecast_data:
+            sections.append(f"{names}:\nUnable to fetch detailed forecast.")
+            continue
+        text = "".join(format_period(period) for period in forecast_data["properties"]["periods"][:max(1, periods)])
+        sections.append(f"{names}:{text}")
+    sections.extend(
+        f"{_format_location(location)}:\nUnable to fetch forecast data for this location." for location in failed
+    )
 
-    return "\n---\n".join(forecasts)
+    if not sections:
+        return "No locations given."
+    return "\n---\n".join(sections)